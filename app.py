@@ -9,6 +9,9 @@ from flask import (
     jsonify,
     url_for,
     flash,
+    Response,
+    g,
+    send_file,
 )
 import secrets
 from functools import wraps
@@ -16,7 +19,6 @@ import firebase_admin
 from firebase_admin import credentials, firestore, auth, storage
 from datetime import timedelta
 import os
-import requests
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 from datetime import datetime
@@ -26,6 +28,34 @@ import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from collections import defaultdict
 from dateutil.relativedelta import relativedelta
+import json
+import mimetypes
+import shutil
+import atexit
+import socket
+import time
+import asyncio
+import contextvars
+import threading
+import queue
+from datetime import timezone
+from ingest import IngestBuffer, BufferPenuh, parse_data_daya
+from cache import TTLCache
+from auth_client import AuthClient, AuthTidakTersedia
+from token_cache import TokenCache, TokenDicabut
+from sessions import buat_session_interface
+import upload
+import upload_store
+import ekspor
+from werkzeug.exceptions import RequestEntityTooLarge
+from realtime import Hub
+from pemakaian import PemakaianBerjalan
+import energi
+import billing_engine
+import tracing
+import timeseries
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.api_core.exceptions import AlreadyExists
 
 load_dotenv()
 
@@ -41,6 +71,10 @@ app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"  # Can be 'Strict', 'Lax', or 'None'
 
+# Data session disimpan di server, cookie hanya berisi id bertanda tangan.
+# "sqlite" (default) dipakai bersama semua worker; "memory" hanya untuk satu proses.
+app.session_interface = buat_session_interface(os.getenv("SESSION_BACKEND", "sqlite"))
+
 # Firebase Admin SDK setup
 cred = credentials.Certificate("firebase-auth.json")
 firebase_admin.initialize_app(cred)
@@ -50,10 +84,124 @@ firebase_admin.initialize_app(cred)
 db = firestore.client()
 # bucket = storage.bucket()
 
+# Tracing latensi route + setiap panggilan Firestore per request (lihat tracing.py),
+# agregat tersedia di /metrics. TRACING=0 memakai client Firestore tanpa proxy.
+tracer = tracing.Tracer(
+    sampel=int(os.getenv("TRACING_SAMPEL", 1000)),
+    ambang_n1=int(os.getenv("TRACING_AMBANG_N1", 5)),
+    lambat_detik=float(os.getenv("TRACING_LAMBAT_DETIK", 1.0)),
+)
+TRACING_AKTIF = os.getenv("TRACING", "1") != "0"
+if TRACING_AKTIF:
+    db = tracer.bungkus(db)
+# /metrics dan header Server-Timing hanya untuk pemegang METRICS_TOKEN
+# ("Authorization: Bearer <token>"); tanpa METRICS_TOKEN keduanya tertutup.
+# SERVER_TIMING=1 menampilkan Server-Timing ke semua klien (mis. saat development).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+def izin_metrics():
+    return bool(METRICS_TOKEN) and secrets.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+
+
+@app.before_request
+def mulai_tracing():
+    if TRACING_AKTIF:
+        route = request.url_rule.rule if request.url_rule else "(tidak ditemukan)"
+        g.jejak = tracer.mulai(route)
+
+
+@app.after_request
+def selesai_tracing(response):
+    jejak = g.pop("jejak", None)
+    if jejak is not None:
+        ringkasan = tracer.selesai(jejak)
+        if SERVER_TIMING or izin_metrics():
+            response.headers["Server-Timing"] = (
+                f'firestore;dur={ringkasan["firestore"] * 1000:.1f};'
+                f'desc="{ringkasan["panggilan"]} panggilan, {ringkasan["dokumen"]} dok"'
+            )
+    return response
+
+
+@app.teardown_request
+def tutup_tracing(error=None):
+    # Request yang gagal dengan exception tidak melewati after_request
+    jejak = g.pop("jejak", None)
+    if jejak is not None:
+        tracer.selesai(jejak)
+
+
 # Setup Static folder for file
 UPLOAD_FOLDER = os.path.join("static", "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Bukti bayar baru disimpan di luar static (content-addressed, lihat upload_store.py)
+# dan hanya dilayani lewat route berotorisasi. UPLOAD_BACKEND: "disk" atau "firebase".
+BUKTI_FOLDER = os.getenv("BUKTI_FOLDER", "uploads")
+BUKTI_TMP = os.path.join(BUKTI_FOLDER, "tmp")
+os.makedirs(BUKTI_TMP, exist_ok=True)
+if os.getenv("UPLOAD_BACKEND", "disk") == "firebase":
+    bukti_store = upload_store.FirebaseStorageStore(
+        storage.bucket(os.getenv("FIREBASE_STORAGE_BUCKET"))
+    )
+else:
+    bukti_store = upload_store.DiskStore(os.path.join(BUKTI_FOLDER, "berkas"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+# Request lebih besar dari ini ditolak sebelum body dibaca (413)
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES + 64 * 1024
+upload_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_WORKERS", 2)), thread_name_prefix="upload"
+)
+
+# Format penyimpanan data_daya: "sampel" (satu dokumen per data) atau "bucket"
+# (satu dokumen per kamar per jam di koleksi data_daya_bucket)
+DAYA_FORMAT = os.getenv("DAYA_FORMAT", "sampel")
+
+# Buffer ingest data daya dari meter
+INGEST_API_KEY = os.getenv("INGEST_API_KEY")
+if not INGEST_API_KEY:
+    app.logger.warning("INGEST_API_KEY kosong: endpoint perangkat hanya menerima bearer token")
+INGEST_MAX_RECORDS = int(os.getenv("INGEST_MAX_RECORDS", 5000))  # per request
+ingest_buffer = IngestBuffer(
+    db,
+    writer=lambda records: tulis_data_daya(records),
+    flush_size=int(os.getenv("INGEST_FLUSH_SIZE", 500)),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", 2)),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", 20000)),
+)
+
+# Thread pool untuk query Firestore yang saling independen
+firestore_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FIRESTORE_POOL_SIZE", 16)),
+    thread_name_prefix="firestore",
+)
+
+# Cache kamar milik penghuni, key: UserID
+kamar_penghuni_cache = TTLCache(ttl=int(os.getenv("KAMAR_PENGHUNI_CACHE_TTL", 60)))
+
+# Cache koleksi referensi kecil yang jarang berubah (kamar, users penghuni)
+referensi_cache = TTLCache(
+    ttl=int(os.getenv("REFERENSI_CACHE_TTL", 300)),
+    maxsize=int(os.getenv("REFERENSI_CACHE_MAXSIZE", 64)),
+)
+
+# Klien login Firebase Auth (koneksi dipakai ulang) dan cache profil users/{uid}
+auth_client = AuthClient()
+profil_cache = TTLCache(
+    ttl=int(os.getenv("PROFIL_CACHE_TTL", 300)),
+    maxsize=int(os.getenv("PROFIL_CACHE_MAXSIZE", 1000)),
+)
+
+# Cache verifikasi ID token; status revoke diperbarui tiap TOKEN_REVOKE_REFRESH detik
+token_cache = TokenCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_MAXSIZE", 10000)),
+    refresh_interval=int(os.getenv("TOKEN_REVOKE_REFRESH", 300)),
+)
+
 
 ########################################
 """ Authentication and Authorization """
@@ -64,33 +212,106 @@ def auth_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # Check if user is authenticated
-        if "user" not in session:
-            return redirect(url_for("login"))
+        if "user_id" in session:
+            return f(*args, **kwargs)
 
-        else:
+        # Klien mesin boleh memakai header Authorization: Bearer <ID token>
+        if token_bearer():
+            g.user = verifikasi_bearer()
+            if not g.user:
+                return jsonify({"status": "error", "message": "Unauthorized"}), 401
             return f(*args, **kwargs)
 
+        if request.path.startswith("/api/"):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return redirect(url_for("login"))
+
+    return decorated_function
+
+
+def pengguna_aktif():
+    # (uid, role) dari session login, atau dari bearer token yang diverifikasi auth_required
+    if "user_id" in session:
+        return session["user_id"], session.get("role")
+    claims = g.get("user")
+    if not claims:
+        return None, None
+    profil = ambil_profil(claims["uid"]) or {}
+    return claims["uid"], profil.get("role")
+
+
+# Token tidak valid, kedaluwarsa, dicabut, atau akunnya dinonaktifkan
+GALAT_TOKEN = (ValueError, auth.InvalidIdTokenError, auth.UserDisabledError, TokenDicabut)
+
+
+def token_bearer():
+    header = request.headers.get("Authorization", "")
+    return header[7:] if header.startswith("Bearer ") else None
+
+
+def verifikasi_bearer():
+    # Claims token bearer yang valid, atau None
+    token = token_bearer()
+    if not token:
+        return None
+    try:
+        return token_cache.verify(token)
+    except GALAT_TOKEN:
+        return None
+
+
+# Decorator untuk endpoint yang dipanggil perangkat (meter), bukan browser.
+# Terima X-API-Key, atau bearer token milik akun dengan role perangkat/pemilik.
+# Tanpa INGEST_API_KEY hanya bearer token yang diterima (tidak pernah terbuka).
+def api_key_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get("X-API-Key")
+        if key is None and token_bearer():
+            claims = verifikasi_bearer()
+            profil = ambil_profil(claims["uid"]) if claims else None
+            if not profil or profil.get("role") not in ("perangkat", "pemilik"):
+                return jsonify({"status": "error", "message": "Unauthorized"}), 401
+            g.user = claims
+        elif not INGEST_API_KEY:
+            return (
+                jsonify({"status": "error", "message": "INGEST_API_KEY belum diatur"}),
+                503,
+            )
+        elif not secrets.compare_digest(key or "", INGEST_API_KEY):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+
     return decorated_function
 
 
 @app.route("/auth", methods=["POST"])
 def authorize():
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
+    token = token_bearer()
+    if not token:
         return "Unauthorized", 401
 
-    token = token[7:]  # Strip off 'Bearer ' to get the actual token
-
     try:
-        decoded_token = auth.verify_id_token(
-            token, check_revoked=True, clock_skew_seconds=60
-        )  # Validate token here
-        session["user"] = decoded_token  # Add user to session
-        return redirect(url_for("dashboard"))
+        # Validasi token (tanda tangan + revoke) lewat cache verifikasi
+        decoded_token = token_cache.verify(token)
+    except GALAT_TOKEN:
+        return "Unauthorized", 401
+    except auth.CertificateFetchError:
+        return "Layanan login sedang tidak tersedia", 503
 
-    except:
+    user_data = ambil_profil(decoded_token["uid"])
+    if not user_data:
         return "Unauthorized", 401
 
+    # Session sama seperti login biasa, bukan seluruh isi token
+    session.regenerate()
+    session["user_id"] = decoded_token["uid"]
+    session["role"] = user_data["role"]
+    session["nama"] = user_data["nama"]
+    if user_data["role"] == "pemilik":
+        return redirect(url_for("dashboard_pemilik"))
+    return redirect(url_for("dashboard_penghuni"))
+
 
 #####################
 """ Public Routes """
@@ -102,28 +323,20 @@ def home():
 
 
 @app.route("/login", methods=["GET", "POST"])
-def login():
+async def login():
     if request.method == "POST":
         email = request.form["email"]
         password = request.form["password"]
 
         try:
-            # Sign in user pakai Firebase Auth
-            user = auth.get_user_by_email(email)
-
-            api_key = os.getenv("FIREBASE_API_KEY")  # tambahkan ke .env
-            payload = {"email": email, "password": password, "returnSecureToken": True}
+            # Sign in user pakai Firebase Auth (FIREBASE_API_KEY di .env)
+            akun = await di_pool(auth_client.sign_in, email, password)
 
-            res = requests.post(
-                f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={api_key}",
-                json=payload,
-            )
-
-            if res.status_code == 200:
-                uid = res.json()["localId"]
-                user_doc = db.collection("users").document(uid).get()
-                user_data = user_doc.to_dict()
+            if akun:
+                uid = akun["localId"]
+                user_data = await di_pool(ambil_profil, uid)
 
+                session.regenerate()
                 session["user_id"] = uid
                 session["role"] = user_data["role"]
                 session["nama"] = user_data["nama"]
@@ -136,6 +349,8 @@ def login():
             else:
                 flash("Email atau password salah!", "danger")
 
+        except AuthTidakTersedia:
+            flash("Layanan login sedang tidak tersedia, coba lagi nanti.", "danger")
         except Exception as e:
             flash(f"Error: {str(e)}", "danger")
 
@@ -158,6 +373,8 @@ def register():
             db.collection("users").document(user.uid).set(
                 {"nama": nama, "email": email, "role": role}
             )
+            referensi_cache.invalidate("penghuni")
+            profil_cache.invalidate(user.uid)
 
             flash("Registrasi berhasil!", "success")
             return redirect(url_for("login"))
@@ -196,61 +413,127 @@ def privacy():
 """ Private Routes (Require authorization) """
 
 
+async def di_pool(fungsi, *args):
+    # Jalankan fungsi Firestore yang blocking di firestore_pool tanpa memblok event loop
+    # Context disalin supaya panggilan Firestore di thread pool tercatat di jejak request
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(firestore_pool, lambda: ctx.run(fungsi, *args))
+
+
+async def paralel(*fungsi):
+    # Jalankan beberapa fungsi tanpa argumen bersamaan; hasil sesuai urutan
+    return await asyncio.gather(*(di_pool(f) for f in fungsi))
+
+
+def ambil_profil(uid):
+    # Data users/{uid} (nama, email, role); salinan agar cache tidak ikut berubah
+    def muat():
+        return db.collection("users").document(uid).get().to_dict()
+
+    profil = profil_cache.get_or_load(uid, muat)
+    return dict(profil) if profil else None
+
+
+def ambil_semua_kamar():
+    # List data kamar (dengan "id"), urut created_at; salinan agar cache tidak ikut berubah
+    def muat():
+        kamar = [doc.to_dict() | {"id": doc.id} for doc in db.collection("kamar").stream()]
+        return sorted(
+            kamar,
+            key=lambda k: (k.get("created_at") is None, k.get("created_at") or 0),
+        )
+
+    return [dict(k) for k in referensi_cache.get_or_load("kamar", muat)]
+
+
+def ambil_penghuni():
+    def muat():
+        users_ref = db.collection("users").where("role", "==", "penghuni")
+        return [doc.to_dict() | {"uid": doc.id} for doc in users_ref.stream()]
+
+    return [dict(u) for u in referensi_cache.get_or_load("penghuni", muat)]
+
+
+def invalidasi_kamar():
+    referensi_cache.invalidate("kamar")
+    kamar_penghuni_cache.invalidate()
+
+
+def pasang_listener_referensi():
+    # Opsional: listener on_snapshot agar cache tiap worker ikut segar saat worker lain menulis
+    db.collection("kamar").on_snapshot(lambda *args: invalidasi_kamar())
+    db.collection("users").where("role", "==", "penghuni").on_snapshot(
+        lambda *args: referensi_cache.invalidate("penghuni")
+    )
+
+
+if os.getenv("REFERENSI_CACHE_LISTENER") == "1":
+    pasang_listener_referensi()
+
+
+def cari_kamar_penghuni(user_id):
+    # Kembalikan (kamar_id, kamar_data) milik penghuni, atau (None, None)
+    if not user_id:
+        return None, None
+
+    def muat():
+        doc = next(
+            db.collection("kamar").where("UserID", "==", user_id).limit(1).stream(),
+            None,
+        )
+        return (doc.id, doc.to_dict()) if doc else (None, None)
+
+    kamar_id, kamar_data = kamar_penghuni_cache.get_or_load(user_id, muat)
+    return kamar_id, dict(kamar_data) if kamar_data else None
+
+
 @app.route("/dashboard/pemilik")
-def dashboard_pemilik():
+async def dashboard_pemilik():
     if session.get("role") != "pemilik":
         return redirect(url_for("login"))
 
-    # Ambil semua kamar
-    kamar_list = db.collection("kamar").order_by("created_at").stream()
-    kamar_data = []
-    for doc in kamar_list:
-        kamar = doc.to_dict()
-        kamar["id"] = doc.id
-
-        # Ambil tagihan terakhir
-        tagihan_ref = (
-            db.collection("tagihan")
-            .where("KamarID", "==", doc.id)
-            .order_by("Bulan", direction=firestore.Query.DESCENDING)
-            .limit(1)
-            .stream()
-        )
-        tagihan = next(tagihan_ref, None)
-        kamar["tagihan"] = tagihan.to_dict() if tagihan else None
-
-        kamar_data.append(kamar)
+    # Kamar, penghuni, tagihan terakhir, statistik relay dan pemakaian saling
+    # independen: ambil bersamaan
+    (
+        kamar_data,
+        penghuni_list,
+        tagihan_terakhir,
+        statistik_relay,
+        pemakaian,
+    ) = await paralel(
+        ambil_semua_kamar,
+        ambil_penghuni,
+        ambil_tagihan_terakhir,
+        ambil_statistik_relay,
+        ambil_pemakaian_berjalan,
+    )
+    for kamar in kamar_data:
+        kamar["tagihan"] = tagihan_terakhir.get(kamar["id"])
+        kamar["relay_statistik"] = statistik_relay.get(kamar["id"])
+        kamar["kwh_bulan_ini"] = pemakaian.get(kamar["id"])
 
-    users_ref = db.collection("users").where("role", "==", "penghuni")
-    penghuni_list = [doc.to_dict() | {"uid": doc.id} for doc in users_ref.stream()]
     return render_template(
-        "dashboard/pemilik.html", kamar_data=kamar_data, penghuni_list=penghuni_list
+        "dashboard/pemilik.html",
+        kamar_data=kamar_data,
+        penghuni_list=penghuni_list,
+        stream_url=url_for("stream_pemilik"),
     )
 
 
 @app.route("/dashboard/penghuni")
-def dashboard_penghuni():
+async def dashboard_penghuni():
     if session.get("role") != "penghuni":
         return redirect(url_for("login"))
 
     user_id = session.get("user_id")
 
     # Cari kamar berdasarkan PenghuniID
-    kamar_doc = next(
-        (
-            doc
-            for doc in db.collection("kamar").stream()
-            if doc.to_dict().get("UserID") == user_id
-        ),
-        None,
-    )
-    if not kamar_doc:
+    kamar_id, kamar_data = await di_pool(cari_kamar_penghuni, user_id)
+    if not kamar_id:
         flash("Kamu belum terdaftar di kamar mana pun.", "warning")
         return render_template("penghuni/belum_assign.html", kamar=None)
 
-    kamar_data = kamar_doc.to_dict()
-    kamar_id = kamar_doc.id
-
     # Ambil tagihan terbaru
     tagihan_query = (
         db.collection("tagihan")
@@ -258,38 +541,16 @@ def dashboard_penghuni():
         .order_by("Bulan", direction=firestore.Query.DESCENDING)
         .limit(1)
     )
-    tagihan_docs = list(tagihan_query.stream())
+    tagihan_docs = await di_pool(lambda: list(tagihan_query.stream()))
     tagihan = tagihan_docs[0].to_dict() if tagihan_docs else None
 
-    # Ambil histori daya terakhir (7 data)
-    histori_query = (
-        db.collection("data_daya")
-        .where("KamarID", "==", kamar_id)
-        .order_by("Timestamp", direction=firestore.Query.DESCENDING)
-        .limit(7)
-    )
-    histori_raw = list(histori_query.stream())
-    histori_data = []
-
-    for doc in reversed(histori_raw):  # dari yang lama ke baru
-        data = doc.to_dict()
-        timestamp = data.get("Timestamp")
-        watt = data.get("JumlahWatt", 0)
-
-        kwh = round(watt * (5 / 60 / 60), 4)  # konversi watt ke kWh
-
-        histori_data.append(
-            {
-                "timestamp": timestamp.strftime("%Y-%m-%d") if timestamp else "Unknown",
-                "kWh": kwh,
-            }
-        )
-
+    # Grafik mengambil seri harian dari endpoint ringkasan
     return render_template(
         "dashboard/penghuni.html",
         kamar=kamar_data,
         tagihan=tagihan,
-        histori=histori_data,  # histori sekarang dalam kWh
+        seri_url=url_for("seri_daya", kamar=kamar_id, range="90d", resolusi="hari"),
+        stream_url=url_for("stream_kamar", kamar_id=kamar_id),
     )
 
 
@@ -303,20 +564,11 @@ def profil():
     role = session.get("role")
 
     # Ambil kamar penghuni
-    kamar_doc = next(
-        (
-            doc
-            for doc in db.collection("kamar").stream()
-            if doc.to_dict().get("UserID") == user_id
-        ),
-        None,
-    )
-    if not kamar_doc:
+    kamar_id, kamar_data = cari_kamar_penghuni(user_id)
+    if not kamar_id:
         flash("Kamu belum terdaftar di kamar mana pun.", "warning")
         return render_template("profil.html", user=user, role=role, kamar=None)
 
-    kamar_data = kamar_doc.to_dict()
-
     if request.method == "POST":
         new_password = request.form.get("new_password")
         if new_password:
@@ -365,15 +617,12 @@ def kelola_kamar():
             }
         )
 
+        invalidasi_kamar()
         flash("Kamar berhasil ditambahkan!", "success")
         return redirect(url_for("kelola_kamar"))
 
-    users_ref = db.collection("users").where("role", "==", "penghuni")
-    penghuni_list = [doc.to_dict() | {"uid": doc.id} for doc in users_ref.stream()]
-    daftar_kamar = [
-        doc.to_dict() | {"id": doc.id}
-        for doc in kamar_ref.order_by("created_at").stream()
-    ]
+    penghuni_list = ambil_penghuni()
+    daftar_kamar = ambil_semua_kamar()
     return render_template(
         "pemilik/kelola_kamar.html", kamar=daftar_kamar, penghuni_list=penghuni_list
     )
@@ -400,6 +649,7 @@ def edit_kamar(id):
 
     # Update data
     kamar_doc.update({"NomorKamar": nomor, "TarifPerKWH": tarif, "BatasKWH": batas})
+    invalidasi_kamar()
 
     flash("Kamar berhasil diupdate!", "success")
     return redirect(url_for("kelola_kamar"))
@@ -411,26 +661,35 @@ def delete_kamar(id):
         return redirect(url_for("login"))
 
     db.collection("kamar").document(id).delete()
+    db.collection("tagihan_terakhir").document(id).delete()
+    invalidasi_kamar()
     flash("Kamar berhasil dihapus!", "success")
     return redirect(url_for("kelola_kamar"))
 
 
 @app.route("/pemilik/relay_control", methods=["POST"])
 def relay_control():
+    if session.get("role") != "pemilik":
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"status": "error", "message": "Unauthorized"}), 403
+        return redirect(url_for("login"))
+
     kamar_id = request.form.get("kamar_id")
     relay1_status = request.form.get("relay1_status")
 
     # Konversi dari "on"/"off" ke boolean
     relay1_bool = relay1_status == "on"
 
-    kamar_ref = db.collection("kamar").document(kamar_id)
-
-    # Ambil data kamar untuk flash message
-    kamar_data = kamar_ref.get().to_dict()
+    # Data kamar untuk flash message diambil dari cache referensi
+    kamar_data = next((k for k in ambil_semua_kamar() if k["id"] == kamar_id), {})
     nomor_kamar = kamar_data.get("NomorKamar", "Tidak diketahui")
 
-    # Update hanya relay1_status
-    kamar_ref.update({"relay1_status": relay1_bool})
+    # Simpan status yang diinginkan sekaligus antrekan perintah untuk perangkat
+    perintah_id = kirim_perintah_relay(kamar_id, relay1_bool)
+    invalidasi_kamar()
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"status": "success", "perintah_id": perintah_id}), 202
 
     flash(
         f"Status relay Kamar {nomor_kamar} diperbarui menjadi {'ON' if relay1_bool else 'OFF'}.",
@@ -439,6 +698,55 @@ def relay_control():
     return redirect(url_for("dashboard_pemilik"))
 
 
+@app.route("/pemilik/cache-stats")
+def cache_stats():
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    return jsonify(
+        {
+            "referensi": referensi_cache.stats(),
+            "kamar_penghuni": kamar_penghuni_cache.stats(),
+            "profil": profil_cache.stats(),
+            "token": token_cache.stats(),
+            "sse_klien": realtime_hub.jumlah_klien(),
+        }
+    )
+
+
+@app.route("/metrics")
+def metrics():
+    # Format teks Prometheus; wajib "Authorization: Bearer <METRICS_TOKEN>"
+    if not METRICS_TOKEN:
+        return Response("Not Found\n", status=404, mimetype="text/plain")
+    if not izin_metrics():
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    caches = {
+        "referensi": referensi_cache.stats(),
+        "kamar_penghuni": kamar_penghuni_cache.stats(),
+        "profil": profil_cache.stats(),
+        "token": token_cache.stats(),
+    }
+    teks = [
+        tracer.prometheus(),
+        tracing.metrik(
+            "app_cache_hits_total", "Cache hit.",
+            [({"cache": nama}, s["hits"]) for nama, s in caches.items()], "counter",
+        ),
+        tracing.metrik(
+            "app_cache_misses_total", "Cache miss.",
+            [({"cache": nama}, s["misses"]) for nama, s in caches.items()], "counter",
+        ),
+        tracing.metrik(
+            "app_cache_entries", "Jumlah entri di cache.",
+            [({"cache": nama}, s.get("size", s.get("tokens", 0))) for nama, s in caches.items()],
+        ),
+        tracing.metrik("app_sse_clients", "Klien SSE terhubung.", [({}, realtime_hub.jumlah_klien())]),
+    ]
+    return Response("".join(teks), mimetype="text/plain; version=0.0.4")
+
+
 ### Assign penghuni ke kamar
 @app.route("/pemilik/kamar/assign/<id>", methods=["POST"])
 def assign_penghuni(id):
@@ -450,6 +758,7 @@ def assign_penghuni(id):
     if user_id == "":
         # Unassign kamar
         db.collection("kamar").document(id).update({"UserID": firestore.DELETE_FIELD})
+        invalidasi_kamar()
         flash("Penghuni berhasil di-unassign dari kamar.", "info")
         return redirect(url_for("kelola_kamar"))
 
@@ -461,329 +770,1221 @@ def assign_penghuni(id):
 
     # Assign user_id ke kamar ini
     db.collection("kamar").document(id).update({"UserID": user_id})
+    # Kamar lama penghuni sebelumnya juga berubah, jadi kosongkan seluruh cache
+    invalidasi_kamar()
     flash("Penghuni berhasil di-assign ke kamar.", "success")
     return redirect(url_for("kelola_kamar"))
 
 
-### Tagihan
-# def buat_tagihan_bulanan():
-    now = datetime.now()
-    bulan_str = now.strftime("%Y-%m")
-
-    kamar_ref = db.collection("kamar").stream()
-    tagihan_terbuat = 0  # Counter untuk menghitung jumlah tagihan yang berhasil dibuat
+### Aksi massal kamar
+BATAS_OPERASI_BATCH = 500
 
-    for kamar in kamar_ref:
-        kamar_data = kamar.to_dict()
-        kamar_id = kamar.id
-        batas_kwh = kamar_data.get("BatasKWH", 0)
 
-        histori_ref = (
-            db.collection("data_daya").where("KamarID", "==", kamar_id).stream()
-        )
+def tulis_batch(operasi):
+    # operasi: list of (ref, data); update dalam batch berisi maksimal 500 operasi
+    for i in range(0, len(operasi), BATAS_OPERASI_BATCH):
+        batch = db.batch()
+        for ref, data in operasi[i : i + BATAS_OPERASI_BATCH]:
+            batch.update(ref, data)
+        batch.commit()
 
-        total_kwh = 0.0
-        for doc in histori_ref:
-            data = doc.to_dict()
-            ts = data.get("Timestamp")
-            if ts and ts.month == now.month and ts.year == now.year:
-                watt = data.get(
-                    "JumlahWatt", 0
-                )  # Perhatikan field-nya: JumlahWatt, bukan Watt
-                total_kwh += (watt / 1000) * (3 / 3600)
-
-        total_kwh = round(total_kwh, 3)
-
-        if total_kwh > batas_kwh:
-            pemakaian_berlebih = round(total_kwh - batas_kwh, 3)
-            total_tagihan = round(pemakaian_berlebih * 1400, 2)
-
-            existing = (
-                db.collection("tagihan")
-                .where("KamarID", "==", kamar_id)
-                .where("Bulan", "==", bulan_str)
-                .get()
-            )
 
-            if not existing:
-                db.collection("tagihan").add(
+def angka(nilai):
+    try:
+        return float(nilai or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"Nilai tidak valid: {nilai}")
+
+
+def id_dokumen_valid(nilai):
+    return isinstance(nilai, str) and bool(nilai) and "/" not in nilai
+
+
+def ambil_daftar_id():
+    # Daftar id dari JSON ({"ids": [...]}) atau form (field "ids" berulang);
+    # ValueError jika bentuk JSON tidak sesuai
+    data = request.get_json(silent=True)
+    if data is not None:
+        ids = data.get("ids", []) if isinstance(data, dict) else None
+        if not isinstance(ids, list) or not all(id_dokumen_valid(i) for i in ids):
+            raise ValueError("Body harus objek dengan ids berupa list string")
+        return data, ids
+    ids = request.form.getlist("ids")
+    return request.form, [i for i in ids if id_dokumen_valid(i)]
+
+
+def respons_massal(hasil, tujuan):
+    berhasil = sum(1 for h in hasil if h["status"] == "ok")
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        return jsonify({"berhasil": berhasil, "gagal": len(hasil) - berhasil, "hasil": hasil})
+    kategori = "success" if berhasil == len(hasil) else "warning"
+    flash(f"{berhasil} dari {len(hasil)} item berhasil diproses.", kategori)
+    for h in hasil:
+        if h["status"] != "ok":
+            flash(f"{h['id']}: {h['pesan']}", "danger")
+    return redirect(tujuan)
+
+
+@app.route("/pemilik/kamar/bulk", methods=["POST"])
+def bulk_kamar():
+    # Edit dan assign banyak kamar sekaligus:
+    # {"perubahan": [{"id": ..., "nomor_kamar": ..., "tarif_per_kwh": ..., "batas_kwh": ...,
+    #                 "user_id": ...}]}  (user_id "" = unassign; field yang tidak ada tidak diubah)
+    if session.get("role") != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+
+    body = request.get_json(silent=True)
+    daftar = body.get("perubahan") if isinstance(body, dict) else None
+    if not isinstance(daftar, list) or len(daftar) > 1000:
+        return jsonify({"status": "error", "message": "perubahan harus list (maks 1000)"}), 400
+    for item in daftar:
+        # Bentuk item dicek dulu: id dan user_id dipakai sebagai kunci dict / id dokumen
+        if (
+            not isinstance(item, dict)
+            or not isinstance(item.get("id"), str)
+            or not isinstance(item.get("user_id", ""), (str, type(None)))
+        ):
+            return (
+                jsonify(
                     {
-                        "KamarID": kamar_id,
-                        "Bulan": bulan_str,
-                        "JumlahKWH": pemakaian_berlebih,
-                        "TotalTagihan": total_tagihan,
-                        "StatusPembayaran": "Menunggu",
-                        "Timestamp": datetime.now(),
+                        "status": "error",
+                        "message": "Setiap perubahan harus objek dengan id dan user_id string",
                     }
-                )
-                tagihan_terbuat += 1
+                ),
+                400,
+            )
 
-    return tagihan_terbuat
+    # Keadaan terbaru dari server (bukan cache) untuk validasi, disimulasikan berurutan
+    kamar = {doc.id: doc.to_dict() for doc in db.collection("kamar").stream()}
+    user_ids = {p["user_id"] for p in daftar if id_dokumen_valid(p.get("user_id"))}
+    users = {
+        doc.id: doc.to_dict()
+        for doc in db.get_all([db.collection("users").document(u) for u in user_ids])
+        if doc.exists
+    }
+
+    hasil, operasi = [], []
+    for item in daftar:
+        kamar_id = item["id"]
+        if kamar_id not in kamar:
+            hasil.append({"id": kamar_id, "status": "gagal", "pesan": "Kamar tidak ditemukan"})
+            continue
 
-def buat_tagihan_bulanan():
-    tagihan_terbuat = 0
-    now = datetime.now()
+        perubahan = {}
+        try:
+            if "nomor_kamar" in item:
+                nomor = str(item["nomor_kamar"]).strip()
+                if any(k.get("NomorKamar") == nomor for kid, k in kamar.items() if kid != kamar_id):
+                    raise ValueError("Nomor kamar sudah digunakan oleh kamar lain")
+                perubahan["NomorKamar"] = nomor
+            if "tarif_per_kwh" in item:
+                perubahan["TarifPerKWH"] = angka(item["tarif_per_kwh"])
+            if "batas_kwh" in item:
+                perubahan["BatasKWH"] = angka(item["batas_kwh"])
+            if "user_id" in item:
+                user_id = item["user_id"]
+                if not user_id:
+                    perubahan["UserID"] = firestore.DELETE_FIELD
+                elif (users.get(user_id) or {}).get("role") != "penghuni":
+                    raise ValueError("Penghuni tidak ditemukan")
+                elif any(k.get("UserID") == user_id for kid, k in kamar.items() if kid != kamar_id):
+                    raise ValueError("Penghuni ini sudah menempati kamar lain")
+                else:
+                    perubahan["UserID"] = user_id
+        except ValueError as e:
+            hasil.append({"id": kamar_id, "status": "gagal", "pesan": str(e)})
+            continue
 
-    kamar_docs = db.collection("kamar").stream()
+        if not perubahan:
+            hasil.append({"id": kamar_id, "status": "gagal", "pesan": "Tidak ada perubahan"})
+            continue
 
-    for kamar in kamar_docs:
-        kamar_data = kamar.to_dict()
-        kamar_id = kamar.id
-        batas_kwh = kamar_data.get("BatasKWH", 0)
-        tarif = kamar_data.get("TarifPerKWH", 1400)
+        # Terapkan ke keadaan simulasi agar item berikutnya divalidasi terhadap hasil ini
+        for field, nilai in perubahan.items():
+            if nilai is firestore.DELETE_FIELD:
+                kamar[kamar_id].pop(field, None)
+            else:
+                kamar[kamar_id][field] = nilai
+        operasi.append((db.collection("kamar").document(kamar_id), perubahan))
+        hasil.append({"id": kamar_id, "status": "ok"})
 
-        # Ambil semua histori pemakaian daya listrik untuk kamar ini
-        histori_ref = db.collection("data_daya").where("KamarID", "==", kamar_id).stream()
+    tulis_batch(operasi)
+    if operasi:
+        invalidasi_kamar()
+    return respons_massal(hasil, url_for("kelola_kamar"))
 
-        # Kelompokkan berdasarkan bulan: "2025-05", "2025-06", dll
-        pemakaian_per_bulan = defaultdict(float)
 
-        for doc in histori_ref:
-            data = doc.to_dict()
-            ts = data.get("Timestamp")
-            if ts:
-                bulan_str = ts.strftime("%Y-%m")
-                watt = data.get("JumlahWatt", 0)
-                kwh = (watt / 1000) * (3 / 3600)  # interval 3 detik
-                pemakaian_per_bulan[bulan_str] += kwh
-
-        # Ambil semua bulan yang sudah ada tagihannya
-        existing_tagihan = db.collection("tagihan").where("KamarID", "==", kamar_id).stream()
-        bulan_tertagih = {doc.to_dict().get("Bulan") for doc in existing_tagihan}
-
-        for bulan, total_kwh in pemakaian_per_bulan.items():
-            if bulan not in bulan_tertagih:
-                total_kwh = round(total_kwh, 3)
-
-                if total_kwh > batas_kwh:
-                    kelebihan = round(total_kwh - batas_kwh, 3)
-                    total_tagihan = round(kelebihan * tarif, 2)
-
-                    # Hanya buat tagihan jika > 0
-                    if total_tagihan > 0:
-                        db.collection("tagihan").add({
-                            "KamarID": kamar_id,
-                            "Bulan": bulan,
-                            "JumlahKWH": kelebihan,
-                            "TotalTagihan": total_tagihan,
-                            "StatusPembayaran": "Belum Dibayar",
-                            "Timestamp": datetime.now(),
-                        })
-                        tagihan_terbuat += 1
+### Rollup pemakaian bulanan
+# Satu dokumen kecil per kamar per bulan (id: "{KamarID}_{YYYY-MM}") berisi total kWh
+# dan jumlah sampel. Posisi sampel terakhir yang sudah dihitung ada di
+# "rollup_posisi/{KamarID}"; setiap pembaruan hanya membaca data_daya setelah posisi itu
+# dan memajukannya dalam transaksi, jadi dua run bersamaan tidak menambah rentang yang sama.
+# Seri ringkasan daya_ringkas (menit/jam/hari) ditulis dari rentang yang sama.
+VERSI_ROLLUP = 4  # naikkan jika rumus energi berubah agar rollup dihitung ulang
+LEASE_ROLLUP = "rollup"  # dipegang semua job yang memperbarui rollup (rollup & tagihan)
 
-    return tagihan_terbuat
 
+def rollup_id(kamar_id, bulan):
+    return f"{kamar_id}_{bulan}"
 
-@app.route("/pemilik/tagihan", methods=["GET", "POST"])
-def tagihan_pemilik():
-    if session.get("role") != "pemilik":
-        return redirect(url_for("login"))
 
-    # Ambil parameter filter dari query string
-    selected_kamar = request.args.get("kamar")
-    selected_bulan = request.args.get("bulan")
+def hapus_rollup_kamar(kamar_id):
+    # Hapus rollup_daya, rollup_posisi, dan daya_ringkas satu kamar
+    lama = [
+        doc.reference
+        for doc in db.collection("rollup_daya").where("KamarID", "==", kamar_id).stream()
+    ]
+    lama.append(db.collection("rollup_posisi").document(kamar_id))
+    for i in range(0, len(lama), 500):
+        batch = db.batch()
+        for ref in lama[i : i + 500]:
+            batch.delete(ref)
+        batch.commit()
+    timeseries.hapus_ringkasan(db, kamar_id)
+
+
+def hitung_ulang_rollup(kamar_ids=None, log=print):
+    # Hitung ulang rollup dan daya_ringkas dari data mentah (pegang LEASE_ROLLUP dulu)
+    kamar = {doc.id: doc.to_dict() for doc in db.collection("kamar").stream()}
+    for kamar_id in kamar_ids or sorted(kamar):
+        hapus_rollup_kamar(kamar_id)
+        jumlah = perbarui_rollup_kamar(kamar_id, kamar.get(kamar_id))
+        log(f"{kamar_id}: {jumlah} bulan")
+
+
+BATAS_TULIS_TRANSAKSI = 500
+
+
+def perbarui_rollup_kamar(kamar_id, kamar_data=None):
+    rollup_ref = db.collection("rollup_daya")
+    posisi_ref = db.collection("rollup_posisi").document(kamar_id)
+
+    posisi = posisi_ref.get()
+    terakhir = posisi.to_dict() if posisi.exists else None
+    # Nilai yang harus masih sama saat transaksi (None = dokumen posisi belum ada)
+    posisi_awal = terakhir["TerakhirDiproses"] if terakhir else None
+    if terakhir is None:
+        # Data lama sebelum ada dokumen posisi: posisi ada di rollup bulan terbaru
+        doc = next(
+            rollup_ref.where("KamarID", "==", kamar_id)
+            .order_by("Bulan", direction=firestore.Query.DESCENDING)
+            .limit(1)
+            .stream(),
+            None,
+        )
+        terakhir = doc.to_dict() if doc else None
+
+    if terakhir is None or terakhir.get("Versi") != VERSI_ROLLUP:
+        # Belum ada rollup atau dari rumus lama: buang sisa lama, hitung ulang dari awal
+        hapus_rollup_kamar(kamar_id)
+        terakhir = posisi_awal = None
+
+    stempel, waktu, watt = [], [], []
+    for ts, w in iter_sampel_kamar(
+        kamar_id, setelah=terakhir["TerakhirDiproses"] if terakhir else None
+    ):
+        stempel.append(ts)
+        waktu.append(energi.ke_detik(ts))
+        watt.append(w)
+
+    if not waktu:
+        return 0
+
+    sebelum = None
+    if terakhir and terakhir.get("WattTerakhir") is not None:
+        sebelum = (
+            energi.ke_detik(terakhir["TerakhirDiproses"]),
+            terakhir["WattTerakhir"],
+        )
+    gap_maks = energi.gap_maks_kamar(kamar_data)
+
+    def _simpan(transaction, tambahan, bulan_ts, ringkasan, ts_akhir, watt_akhir):
+        snapshot = posisi_ref.get(transaction=transaction)
+        sekarang = snapshot.get("TerakhirDiproses") if snapshot.exists else None
+        if sekarang != posisi_awal:
+            return False  # run lain sudah menghitung rentang ini
+        for bulan, t in tambahan.items():
+            ts_bulan, watt_bulan = bulan_ts[bulan]
+            transaction.set(
+                rollup_ref.document(rollup_id(kamar_id, bulan)),
+                {
+                    "KamarID": kamar_id,
+                    "Bulan": bulan,
+                    "TotalKWH": firestore.Increment(t["kwh"]),
+                    "JumlahSampel": firestore.Increment(t["sampel"]),
+                    "TerakhirDiproses": ts_bulan,
+                    "WattTerakhir": watt_bulan,
+                    "Versi": VERSI_ROLLUP,
+                },
+                merge=True,
+            )
+        # daya_ringkas ikut transaksi yang sama: posisi hanya maju bersama ringkasannya
+        for doc_id, data in timeseries.dokumen_ringkasan(ringkasan):
+            transaction.set(ringkas_ref.document(doc_id), data, merge=True)
+        transaction.set(
+            posisi_ref,
+            {
+                "KamarID": kamar_id,
+                "TerakhirDiproses": ts_akhir,
+                "WattTerakhir": watt_akhir,
+                "Versi": VERSI_ROLLUP,
+            },
+        )
+        return True
+
+    ringkas_ref = db.collection(timeseries.RINGKAS_COLLECTION)
+    simpan = firestore.transactional(_simpan)
+    bulan_diperbarui = set()
+    awal = 0
+    for akhir in potong_sampel_rollup(waktu, stempel):
+        tambahan = energi.kwh_per_bulan(
+            waktu[awal:akhir], watt[awal:akhir], gap_maks=gap_maks, sebelum=sebelum
+        )
+        # Sampel terakhir tiap bulan: "2025-05", "2025-06", dll
+        bulan_ts = {
+            ts.strftime("%Y-%m"): (ts, w)
+            for ts, w in zip(stempel[awal:akhir], watt[awal:akhir])
+        }
+        ringkasan = timeseries.ringkas(
+            kamar_id, waktu[awal:akhir], watt[awal:akhir], sebelum=sebelum, gap_maks=gap_maks
+        )
+        ts_akhir, watt_akhir = stempel[akhir - 1], watt[akhir - 1]
+        if not simpan(db.transaction(), tambahan, bulan_ts, ringkasan, ts_akhir, watt_akhir):
+            app.logger.info("Rollup kamar %s sudah diperbarui proses lain", kamar_id)
+            break
+        bulan_diperbarui.update(tambahan)
+        posisi_awal = ts_akhir
+        sebelum = (waktu[akhir - 1], watt_akhir)
+        awal = akhir
+    return len(bulan_diperbarui)
+
+
+def potong_sampel_rollup(waktu, stempel):
+    # Indeks akhir tiap potongan sampel yang tulisannya (dokumen daya_ringkas, rollup per
+    # bulan, posisi) muat dalam satu transaksi Firestore
+    kunci, bulan = set(), set()
+    for i, (t, ts) in enumerate(zip(waktu, stempel)):
+        ms = int(round(t * 1000))
+        kunci_sampel = {(r, timeseries.awal_ringkas_ms(ms, r)) for r in timeseries.RESOLUSI_DETIK}
+        bulan_sampel = ts.strftime("%Y-%m")
+        jumlah = len(kunci | kunci_sampel) + len(bulan | {bulan_sampel}) + 1
+        if kunci and jumlah > BATAS_TULIS_TRANSAKSI:
+            yield i
+            kunci, bulan = set(), set()
+        kunci |= kunci_sampel
+        bulan.add(bulan_sampel)
+    yield len(waktu)
+
+
+def ambil_rollup_kamar(kamar_id, kamar_data=None):
+    # Kembalikan {bulan: total_kwh} dari rollup yang sudah diperbarui
+    perbarui_rollup_kamar(kamar_id, kamar_data)
+    rollup_docs = (
+        db.collection("rollup_daya").where("KamarID", "==", kamar_id).stream()
+    )
+    return {
+        data["Bulan"]: data.get("TotalKWH", 0.0)
+        for data in (doc.to_dict() for doc in rollup_docs)
+    }
+
+
+def kwh_tersimpan(kamar_id=None, mulai=None, akhir=None, bulan=None):
+    # {KamarID: kWh} yang sudah dihitung rollup dalam rentang, satu query untuk semua kamar:
+    # filter bulan dari rollup_daya, filter lain dari bucket jam daya_ringkas
+    if mulai and not bulan:
+        query = (
+            db.collection(timeseries.RINGKAS_COLLECTION)
+            .where("Resolusi", "==", "jam")
+            .where("Mulai", ">=", mulai)
+            .where("Mulai", "<", akhir)
+        )
+        field = "KWH"
+    else:
+        query = db.collection("rollup_daya")
+        if bulan:
+            query = query.where("Bulan", "==", bulan)
+        field = "TotalKWH"
+    if kamar_id:
+        query = query.where("KamarID", "==", kamar_id)
+
+    hasil = defaultdict(float)
+    for doc in query.select(["KamarID", field]).stream():
+        data = doc.to_dict()
+        hasil[data["KamarID"]] += data.get(field) or 0.0
+    return dict(hasil)
+
+
+def kwh_belum_dirollup(kamar_id, kamar_data=None, mulai=None, akhir=None):
+    # kWh dari sampel sesudah rollup_posisi yang jatuh di [mulai, akhir); hanya membaca
+    posisi = db.collection("rollup_posisi").document(kamar_id).get()
+    terakhir = posisi.to_dict() if posisi.exists else {}
+    sebelum = None
+    if terakhir.get("WattTerakhir") is not None:
+        sebelum = (energi.ke_detik(terakhir["TerakhirDiproses"]), terakhir["WattTerakhir"])
+
+    mulai_detik = energi.ke_detik(mulai) if mulai else None
+    akhir_detik = energi.ke_detik(akhir) if akhir else None
+    waktu, watt = [], []
+    for ts, w in iter_sampel_kamar(kamar_id, setelah=terakhir.get("TerakhirDiproses")):
+        t = energi.ke_detik(ts)
+        if akhir_detik is not None and t >= akhir_detik:
+            break
+        if mulai_detik is not None and t < mulai_detik:
+            sebelum = (t, w)
+            continue
+        if not waktu and sebelum:
+            # Segmen yang berakhir di sampel pertama rentang ikut dihitung
+            waktu.append(sebelum[0])
+            watt.append(sebelum[1])
+        waktu.append(t)
+        watt.append(w)
+    return energi.integrasi_kwh(waktu, watt, gap_maks=energi.gap_maks_kamar(kamar_data))
 
-    # Handle POST
-    if request.method == "POST":
-        if request.form.get("aksi") == "generate_tagihan":
-            jumlah_tagihan = buat_tagihan_bulanan()
-            if jumlah_tagihan > 0:
-                flash(
-                    f"{jumlah_tagihan} tagihan berhasil dibuat untuk bulan ini.",
-                    "success",
-                )
-            else:
-                flash(
-                    "Tidak ada tagihan yang dibuat. Semua kamar berada di bawah batas kWh atau tagihan sudah dibuat.",
-                    "warning",
-                )
-            return redirect(url_for("tagihan_pemilik"))
 
-        tagihan_id = request.form.get("tagihan_id")
-        aksi = request.form.get("aksi")
-        if tagihan_id and aksi:
-            status = "Sudah Bayar" if aksi == "konfirmasi" else "Belum Bayar"
-            db.collection("tagihan").document(tagihan_id).update(
-                {"StatusPembayaran": status}
-            )
-            flash(
-                f"Status pembayaran berhasil diperbarui menjadi '{status}'.", "success"
-            )
-        return redirect(url_for("tagihan_pemilik"))
+def kwh_rentang(kamar_id, kamar_data=None, mulai=None, akhir=None, bulan=None):
+    # Total kWh satu kamar: bagian rollup + sampel yang belum di-rollup
+    tersimpan = kwh_tersimpan(kamar_id, mulai, akhir, bulan).get(kamar_id, 0.0)
+    return tersimpan + kwh_belum_dirollup(kamar_id, kamar_data, mulai, akhir)
 
-    # Ambil data kamar untuk filter dan akses cepat
-    kamar_ref = db.collection("kamar").stream()
-    kamar_dict = {doc.id: doc.to_dict() for doc in kamar_ref}
 
-    # Query tagihan
-    tagihan_query = db.collection("tagihan")
+### Tagihan terakhir per kamar
+# View "tagihan_terakhir/{KamarID}" menyimpan salinan tagihan dengan Bulan terbaru
+# per kamar (plus TagihanID), diperbarui setiap kali tagihan dibuat atau diubah.
+_tagihan_terakhir_dibangun = False
 
-    if selected_kamar:
-        tagihan_query = tagihan_query.where("KamarID", "==", selected_kamar)
-    if selected_bulan:
-        tagihan_query = tagihan_query.where("Bulan", "==", selected_bulan)
 
-    tagihan_docs = tagihan_query.order_by(
-        "Bulan", direction=firestore.Query.DESCENDING
-    ).stream()
+def simpan_tagihan_terakhir(tagihan_id, data):
+    ref = db.collection("tagihan_terakhir").document(data["KamarID"])
+    snapshot = ref.get()
+    if snapshot.exists and (snapshot.get("Bulan") or "") > data["Bulan"]:
+        return
+    ref.set(data | {"TagihanID": tagihan_id})
 
-    tagihan_list = []
-    for doc in tagihan_docs:
+
+def perbarui_tagihan_terakhir(tagihan_id, perubahan):
+    # Hanya berpengaruh jika tagihan ini adalah tagihan terakhir kamarnya
+    for doc in (
+        db.collection("tagihan_terakhir")
+        .where("TagihanID", "==", tagihan_id)
+        .limit(1)
+        .stream()
+    ):
+        doc.reference.update(perubahan)
+
+
+def bangun_tagihan_terakhir():
+    # Isi ulang view dari seluruh koleksi tagihan (untuk data lama)
+    terbaru = {}
+    for doc in db.collection("tagihan").stream():
         data = doc.to_dict()
-        data["id"] = doc.id
-        kamar_info = kamar_dict.get(data["KamarID"], {})
-        data["NomorKamar"] = kamar_info.get("NomorKamar", "Unknown")
-        tagihan_list.append(data)
+        kamar_id = data.get("KamarID")
+        if not kamar_id or not data.get("Bulan"):
+            continue
+        if kamar_id not in terbaru or data["Bulan"] > terbaru[kamar_id]["Bulan"]:
+            terbaru[kamar_id] = data | {"TagihanID": doc.id}
+
+    view_ref = db.collection("tagihan_terakhir")
+    items = list(terbaru.items())
+    for i in range(0, len(items), 500):
+        batch = db.batch()
+        for kamar_id, data in items[i : i + 500]:
+            batch.set(view_ref.document(kamar_id), data)
+        batch.commit()
+    return terbaru
+
+
+def ambil_tagihan_terakhir():
+    global _tagihan_terakhir_dibangun
+    terbaru = {
+        doc.id: doc.to_dict() for doc in db.collection("tagihan_terakhir").stream()
+    }
+    if not terbaru and not _tagihan_terakhir_dibangun:
+        terbaru = bangun_tagihan_terakhir()
+        _tagihan_terakhir_dibangun = True
+    return terbaru
 
-    # Siapkan list kamar untuk dropdown filter
-    kamar_options = [
-        {"id": kid, "nomor": info.get("NomorKamar")} for kid, info in kamar_dict.items()
-    ]
 
-    return render_template(
-        "pemilik/tagihan_pemilik.html",
-        tagihan_list=tagihan_list,
-        kamar_options=kamar_options,
-        selected_kamar=selected_kamar,
-        selected_bulan=selected_bulan,
-    )
+### Tagihan
+TAGIHAN_WORKERS = int(os.getenv("TAGIHAN_WORKERS", 8))
 
 
-@app.route("/pemilik/verifikasi-pembayaran/<tagihan_id>", methods=["POST"])
-def verifikasi_pembayaran(tagihan_id):
-    if session.get("role") != "pemilik":
-        return redirect(url_for("login"))
+def tagihan_id(kamar_id, bulan):
+    # Id deterministik: satu tagihan per kamar per bulan, aman untuk retry
+    return f"{kamar_id}_{bulan}"
 
-    aksi = request.form.get("aksi")
-    tagihan_ref = db.collection("tagihan").document(tagihan_id)
-    tagihan = tagihan_ref.get().to_dict()
 
-    if not tagihan:
-        flash("Tagihan tidak ditemukan.", "error")
-        return redirect(url_for("tagihan_pemilik"))
+def buat_tagihan_kamar(kamar_id, kamar_data):
+    tagihan_terbuat = 0
 
-    if aksi == "terima":
-        tagihan_ref.update({"StatusPembayaran": "Sudah Bayar"})
-        flash("Pembayaran berhasil dikonfirmasi.", "success")
-    elif aksi == "tolak":
-        tagihan_ref.update({"StatusPembayaran": "Ditolak"})
-        flash("Pembayaran ditolak. Penghuni dapat mengunggah ulang bukti.", "warning")
-    else:
-        flash("Aksi tidak valid.", "error")
+    # Pemakaian per bulan dari rollup: "2025-05", "2025-06", dll
+    pemakaian_per_bulan = ambil_rollup_kamar(kamar_id, kamar_data)
 
-    return redirect(url_for("tagihan_pemilik"))
+    # Tagihan lama (sebelum id deterministik) dibuat dengan id acak
+    existing_tagihan = db.collection("tagihan").where("KamarID", "==", kamar_id).stream()
+    bulan_tertagih = {doc.to_dict().get("Bulan") for doc in existing_tagihan}
 
+    daftar_tagihan = billing_engine.buat_tagihan(
+        {kamar_id: pemakaian_per_bulan},
+        {kamar_id: kamar_data},
+        sudah_tertagih={kamar_id: bulan_tertagih},
+        sebelum_bulan=billing_engine.bulan_berjalan(),
+    )
+    for data_tagihan in daftar_tagihan:
+        data_tagihan["Timestamp"] = datetime.now()
+        id_baru = tagihan_id(kamar_id, data_tagihan["Bulan"])
+        try:
+            # create() gagal jika dokumen sudah ada (run lain sudah membuatnya)
+            db.collection("tagihan").document(id_baru).create(data_tagihan)
+        except AlreadyExists:
+            continue
+        simpan_tagihan_terakhir(id_baru, data_tagihan)
+        tagihan_terbuat += 1
 
-### Daya
-@app.route("/pemilik/histori-daya", methods=["GET", "POST"])
-def histori_daya():
-    if session.get("role") != "pemilik":
-        return redirect(url_for("login"))
+    return tagihan_terbuat
 
-    selected_kamar = request.args.get("kamar")
-    selected_date = request.args.get("tanggal")
-    selected_bulan = request.args.get("bulan")
-    page = int(request.args.get("page", 1))
-    per_page = 15
 
-    if selected_date in (None, "", "None"):
-        selected_date = None
-    if selected_bulan in (None, "", "None"):
-        selected_bulan = None
+def buat_tagihan_bulanan(statistik=None):
+    # Setiap kamar diproses paralel di thread pool dengan jumlah worker terbatas
+    mulai_run = time.perf_counter()
+    kamar_docs = list(db.collection("kamar").stream())
 
-    # Ambil semua data kamar (nomor & batas kWh)
+    def proses(kamar):
+        mulai = time.perf_counter()
+        jumlah = buat_tagihan_kamar(kamar.id, kamar.to_dict())
+        return jumlah, time.perf_counter() - mulai
+
+    tagihan_terbuat = 0
+    waktu_kamar = {}
+    gagal = []
+    with ThreadPoolExecutor(
+        max_workers=TAGIHAN_WORKERS, thread_name_prefix="tagihan"
+    ) as pool:
+        futures = {pool.submit(proses, kamar): kamar.id for kamar in kamar_docs}
+        for future in as_completed(futures):
+            kamar_id = futures[future]
+            try:
+                jumlah, durasi = future.result()
+            except Exception:
+                app.logger.exception("Gagal membuat tagihan kamar %s", kamar_id)
+                gagal.append(kamar_id)
+                continue
+            tagihan_terbuat += jumlah
+            waktu_kamar[kamar_id] = round(durasi, 4)
+            app.logger.info(
+                "Tagihan kamar %s: %d dibuat dalam %.3f detik", kamar_id, jumlah, durasi
+            )
+
+    durasi_run = time.perf_counter() - mulai_run
+    app.logger.info(
+        "Pembuatan tagihan selesai: %d kamar, %d tagihan, %.3f detik (%d worker)",
+        len(kamar_docs),
+        tagihan_terbuat,
+        durasi_run,
+        TAGIHAN_WORKERS,
+    )
+    if statistik is not None:
+        statistik.update(
+            {
+                "JumlahKamar": len(kamar_docs),
+                "TagihanDibuat": tagihan_terbuat,
+                "KamarGagal": gagal,
+                "Worker": TAGIHAN_WORKERS,
+                "DurasiDetik": round(durasi_run, 4),
+                "DurasiPerKamar": waktu_kamar,
+            }
+        )
+    return tagihan_terbuat
+
+
+### Job latar belakang
+# Scheduler berjalan di setiap worker, tetapi job yang menulis data (tagihan, rollup)
+# hanya dijalankan oleh satu worker: pemegang lease di "scheduler_lock/{nama_job}".
+scheduler = BackgroundScheduler(timezone=pytz.timezone("Asia/Jakarta"))
+_scheduler_pid = None
+JOB_LEASE_DETIK = int(os.getenv("JOB_LEASE_DETIK", 900))
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def ambil_lease(nama, durasi=JOB_LEASE_DETIK):
+    # Kembalikan token lease, atau None jika lease masih dipegang (termasuk oleh job lain
+    # di proses yang sama: lease tidak re-entrant)
+    lease_ref = db.collection("scheduler_lock").document(nama)
+    token = secrets.token_hex(16)
+
+    @firestore.transactional
+    def _ambil(transaction):
+        snapshot = lease_ref.get(transaction=transaction)
+        sekarang = datetime.now(timezone.utc)
+        if snapshot.exists and snapshot.get("Berakhir") > sekarang:
+            return None
+        transaction.set(
+            lease_ref,
+            {
+                "Pemilik": worker_id(),
+                "Token": token,
+                "Berakhir": sekarang + timedelta(seconds=durasi),
+            },
+        )
+        return token
+
+    return _ambil(db.transaction())
+
+
+def lepas_lease(nama, token):
+    # Hanya pemegang token ini yang boleh melepas lease
+    lease_ref = db.collection("scheduler_lock").document(nama)
+
+    @firestore.transactional
+    def _lepas(transaction):
+        snapshot = lease_ref.get(transaction=transaction)
+        if snapshot.exists and snapshot.to_dict().get("Token") == token:
+            transaction.delete(lease_ref)
+
+    _lepas(db.transaction())
+
+
+def jalankan_dengan_lease(nama, fungsi):
+    # Kembalikan (True, hasil) jika dijalankan, (False, None) jika lease sedang dipegang
+    token = ambil_lease(nama)
+    if token is None:
+        return False, None
+    try:
+        return True, fungsi()
+    finally:
+        lepas_lease(nama, token)
+
+
+def perbarui_semua_rollup():
     kamar_docs = db.collection("kamar").stream()
-    kamar_dict = {}
-    for k in kamar_docs:
-        data = k.to_dict()
-        kamar_dict[k.id] = {
-            "nomor": data.get("NomorKamar", "Tidak diketahui"),
-            "batas_kwh": data.get("BatasKWH", 0),
+    return sum(perbarui_rollup_kamar(k.id, k.to_dict()) for k in kamar_docs)
+
+
+def job_tagihan():
+    # Dijadwalkan dalam UTC setelah bulan (UTC, kunci rollup) ditutup: satu pass rollup
+    # penuh dulu supaya sampel akhir bulan ikut, lalu tagihan dengan lease yang sama
+    job_rollup()
+    jalankan_dengan_lease(LEASE_ROLLUP, buat_tagihan_bulanan)
+
+
+def job_rollup():
+    if DAYA_FORMAT == "bucket":
+        jalankan_dengan_lease("kompaksi", lambda: timeseries.kompaksi(db))
+    jalankan_dengan_lease(LEASE_ROLLUP, perbarui_semua_rollup)
+
+
+def gc_bukti():
+    # Hapus file bukti yang tidak lagi direferensikan tagihan mana pun
+    direferensikan = set()
+    for doc in (
+        db.collection("tagihan").select(["BuktiBayarFile", "BuktiBayarThumbFile"]).stream()
+    ):
+        data = doc.to_dict()
+        direferensikan.update(
+            data[f] for f in ("BuktiBayarFile", "BuktiBayarThumbFile") if data.get(f)
+        )
+    return upload_store.gc(bukti_store, direferensikan)
+
+
+def job_gc_bukti():
+    jalankan_dengan_lease("gc_bukti", gc_bukti)
+
+
+def job_warmup_cache():
+    # Cache ada di memori tiap worker, jadi tidak perlu lease
+    ambil_semua_kamar()
+    ambil_penghuni()
+
+
+def jalankan_job_tagihan(job_id):
+    job_ref = db.collection("jobs").document(job_id)
+    job_ref.update({"Status": "berjalan", "Mulai": datetime.now(timezone.utc)})
+    try:
+        # Tunggu jika worker lain sedang membuat tagihan
+        for _ in range(int(os.getenv("JOB_TAGIHAN_PERCOBAAN", 60))):
+            statistik = {}
+            dijalankan, hasil = jalankan_dengan_lease(
+                LEASE_ROLLUP, lambda: buat_tagihan_bulanan(statistik)
+            )
+            if dijalankan:
+                job_ref.update(
+                    {
+                        "Status": "selesai",
+                        "Hasil": hasil,
+                        "Statistik": statistik,
+                        "Selesai": datetime.now(timezone.utc),
+                    }
+                )
+                return
+            time.sleep(5)
+        job_ref.update(
+            {
+                "Status": "gagal",
+                "Error": "Pembuatan tagihan lain masih berjalan",
+                "Selesai": datetime.now(timezone.utc),
+            }
+        )
+    except Exception as e:
+        app.logger.exception("Job tagihan %s gagal", job_id)
+        job_ref.update(
+            {"Status": "gagal", "Error": str(e), "Selesai": datetime.now(timezone.utc)}
+        )
+
+
+def antrekan_job_tagihan():
+    job_ref = db.collection("jobs").document()
+    job_ref.set(
+        {
+            "Jenis": "tagihan",
+            "Status": "antre",
+            "Dibuat": datetime.now(timezone.utc),
+            "DibuatOleh": session.get("user_id"),
         }
+    )
+    pastikan_scheduler()
+    scheduler.add_job(jalankan_job_tagihan, args=[job_ref.id], id=f"job-{job_ref.id}")
+    return job_ref.id
+
+
+def pastikan_scheduler():
+    # Dijalankan sekali per proses (setelah fork worker gunicorn)
+    global _scheduler_pid
+    if _scheduler_pid == os.getpid() or os.getenv("SCHEDULER_ENABLED", "1") != "1":
+        return
+    _scheduler_pid = os.getpid()
+
+    scheduler.add_job(
+        job_tagihan,
+        "cron",
+        hour=int(os.getenv("JOB_TAGIHAN_JAM", 1)),
+        timezone=pytz.utc,  # jam UTC, sama dengan batas bulan rollup
+        id="tagihan",
+        replace_existing=True,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        job_rollup,
+        "interval",
+        minutes=int(os.getenv("JOB_ROLLUP_MENIT", 15)),
+        id="rollup",
+        replace_existing=True,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        periksa_batas,
+        "interval",
+        seconds=BATAS_INTERVAL_DETIK,
+        id="periksa_batas",  # tanpa lease: tiap worker memeriksa sampel di memorinya
+        replace_existing=True,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        job_gc_bukti,
+        "cron",
+        hour=int(os.getenv("JOB_GC_BUKTI_JAM", 3)),
+        id="gc_bukti",
+        replace_existing=True,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        job_warmup_cache,
+        "interval",
+        seconds=max(30, referensi_cache.ttl - 30),
+        id="warmup_cache",
+        replace_existing=True,
+        coalesce=True,
+        next_run_time=datetime.now(scheduler.timezone),
+    )
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown(wait=False))
 
-    # Query histori daya
-    query = db.collection("data_daya")
-    if selected_kamar:
-        query = query.where("KamarID", "==", selected_kamar)
 
-    query = query.order_by("Timestamp", direction=firestore.Query.DESCENDING).stream()
+@app.before_request
+def mulai_scheduler():
+    pastikan_scheduler()
 
-    histori_data = []
-    ringkasan_kamar = (
-        {}
-    )  # kunci: KamarID, isi: {total_kwh, total_kwh_over, nomor_kamar}
 
-    for doc in query:
+@app.route("/pemilik/tagihan/job/<job_id>")
+def status_job_tagihan(job_id):
+    if session.get("role") != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+
+    job_doc = db.collection("jobs").document(job_id).get()
+    if not job_doc.exists:
+        return jsonify({"status": "error", "message": "Job tidak ditemukan"}), 404
+
+    job = job_doc.to_dict()
+    return jsonify(
+        {
+            "job_id": job_id,
+            "jenis": job.get("Jenis"),
+            "status": job.get("Status"),
+            "hasil": job.get("Hasil"),
+            "statistik": job.get("Statistik"),
+            "error": job.get("Error"),
+            "dibuat": job["Dibuat"].isoformat() if job.get("Dibuat") else None,
+            "mulai": job["Mulai"].isoformat() if job.get("Mulai") else None,
+            "selesai": job["Selesai"].isoformat() if job.get("Selesai") else None,
+        }
+    )
+
+
+@app.route("/pemilik/tagihan", methods=["GET", "POST"])
+async def tagihan_pemilik():
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    # Ambil parameter filter dari query string
+    selected_kamar = request.args.get("kamar")
+    selected_bulan = request.args.get("bulan")
+
+    # Handle POST
+    if request.method == "POST":
+        if request.form.get("aksi") == "generate_tagihan":
+            # Tagihan dibuat di latar belakang; status bisa dipantau lewat job_id
+            job_id = antrekan_job_tagihan()
+            status_url = url_for("status_job_tagihan", job_id=job_id)
+            if request.accept_mimetypes.best == "application/json":
+                return (
+                    jsonify({"status": "antre", "job_id": job_id, "status_url": status_url}),
+                    202,
+                )
+            flash(
+                f"Pembuatan tagihan sedang diproses di latar belakang (job {job_id}).",
+                "info",
+            )
+            return redirect(url_for("tagihan_pemilik", job=job_id))
+
+        tagihan_id = request.form.get("tagihan_id")
+        aksi = request.form.get("aksi")
+        if tagihan_id and aksi:
+            status = "Sudah Bayar" if aksi == "konfirmasi" else "Belum Bayar"
+            db.collection("tagihan").document(tagihan_id).update(
+                {"StatusPembayaran": status}
+            )
+            perbarui_tagihan_terakhir(tagihan_id, {"StatusPembayaran": status})
+            flash(
+                f"Status pembayaran berhasil diperbarui menjadi '{status}'.", "success"
+            )
+        return redirect(url_for("tagihan_pemilik"))
+
+    # Query tagihan
+    tagihan_query = db.collection("tagihan")
+
+    if selected_kamar:
+        tagihan_query = tagihan_query.where("KamarID", "==", selected_kamar)
+    if selected_bulan:
+        tagihan_query = tagihan_query.where("Bulan", "==", selected_bulan)
+    tagihan_query = tagihan_query.order_by("Bulan", direction=firestore.Query.DESCENDING)
+
+    # Data kamar (untuk filter dan akses cepat) diambil bersamaan dengan tagihan
+    kamar_list, tagihan_docs = await paralel(
+        ambil_semua_kamar, lambda: list(tagihan_query.stream())
+    )
+    kamar_dict = {k["id"]: k for k in kamar_list}
+
+    tagihan_list = []
+    for doc in tagihan_docs:
         data = doc.to_dict()
-        ts = data.get("Timestamp")
-        if not ts:
+        data["id"] = doc.id
+        kamar_info = kamar_dict.get(data["KamarID"], {})
+        data["NomorKamar"] = kamar_info.get("NomorKamar", "Unknown")
+        tagihan_list.append(data)
+
+    # Siapkan list kamar untuk dropdown filter
+    kamar_options = [
+        {"id": kid, "nomor": info.get("NomorKamar")} for kid, info in kamar_dict.items()
+    ]
+
+    return render_template(
+        "pemilik/tagihan_pemilik.html",
+        tagihan_list=tagihan_list,
+        kamar_options=kamar_options,
+        selected_kamar=selected_kamar,
+        selected_bulan=selected_bulan,
+        job_id=request.args.get("job"),
+    )
+
+
+@app.route("/pemilik/cek-pembayaran")
+@app.route("/pemilik/cek-pembayaran/<tagihan_id>", methods=["POST"])
+def cek_pembayaran(tagihan_id=None):
+    # Daftar bukti pembayaran yang menunggu konfirmasi (thumbnail, bukan file asli)
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    if request.method == "POST":
+        aksi = request.form.get("aksi")
+        status = {"konfirmasi": "Sudah Bayar", "tolak": "Ditolak"}.get(aksi)
+        if status:
+            db.collection("tagihan").document(tagihan_id).update({"StatusPembayaran": status})
+            perbarui_tagihan_terakhir(tagihan_id, {"StatusPembayaran": status})
+            flash(f"Status pembayaran diperbarui menjadi '{status}'.", "success")
+        else:
+            flash("Aksi tidak valid.", "error")
+        return redirect(url_for("cek_pembayaran"))
+
+    tagihan = [
+        doc.to_dict() | {"id": doc.id}
+        for doc in db.collection("tagihan")
+        .where("StatusPembayaran", "==", "Menunggu")
+        .stream()
+    ]
+    return render_template("pemilik/cek_pembayaran.html", tagihan=tagihan)
+
+
+@app.route("/pemilik/verifikasi-pembayaran/<tagihan_id>", methods=["POST"])
+def verifikasi_pembayaran(tagihan_id):
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    aksi = request.form.get("aksi")
+    tagihan_ref = db.collection("tagihan").document(tagihan_id)
+    tagihan = tagihan_ref.get().to_dict()
+
+    if not tagihan:
+        flash("Tagihan tidak ditemukan.", "error")
+        return redirect(url_for("tagihan_pemilik"))
+
+    if aksi == "terima":
+        tagihan_ref.update({"StatusPembayaran": "Sudah Bayar"})
+        perbarui_tagihan_terakhir(tagihan_id, {"StatusPembayaran": "Sudah Bayar"})
+        flash("Pembayaran berhasil dikonfirmasi.", "success")
+    elif aksi == "tolak":
+        tagihan_ref.update({"StatusPembayaran": "Ditolak"})
+        perbarui_tagihan_terakhir(tagihan_id, {"StatusPembayaran": "Ditolak"})
+        flash("Pembayaran ditolak. Penghuni dapat mengunggah ulang bukti.", "warning")
+    else:
+        flash("Aksi tidak valid.", "error")
+
+    return redirect(url_for("tagihan_pemilik"))
+
+
+@app.route("/pemilik/tagihan/bulk", methods=["POST"])
+def bulk_tagihan():
+    # Konfirmasi / tolak banyak tagihan sekaligus: {"aksi": "konfirmasi"|"tolak", "ids": [...]}
+    if session.get("role") != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+
+    try:
+        data, ids = ambil_daftar_id()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    aksi = data.get("aksi")
+    status = None
+    if isinstance(aksi, str):
+        status = {"konfirmasi": "Sudah Bayar", "tolak": "Ditolak"}.get(aksi)
+    tujuan = url_for("tagihan_pemilik")
+    if not status or not ids:
+        if request.is_json:
+            return jsonify({"status": "error", "message": "aksi dan ids wajib diisi"}), 400
+        flash("Pilih tagihan dan aksi terlebih dahulu.", "warning")
+        return redirect(tujuan)
+    ids = list(dict.fromkeys(ids))[:1000]
+
+    # Satu round trip untuk membaca semua tagihan yang dipilih
+    tagihan = {
+        doc.id: doc.to_dict()
+        for doc in db.get_all([db.collection("tagihan").document(i) for i in ids])
+        if doc.exists
+    }
+    # View tagihan terakhir kamar terkait, supaya ikut diperbarui dalam batch yang sama
+    kamar_ids = {t["KamarID"] for t in tagihan.values() if t.get("KamarID")}
+    view = {
+        doc.id: doc.to_dict()
+        for doc in db.get_all([db.collection("tagihan_terakhir").document(k) for k in kamar_ids])
+        if doc.exists
+    }
+
+    hasil, operasi = [], []
+    for tagihan_id in ids:
+        data_tagihan = tagihan.get(tagihan_id)
+        if data_tagihan is None:
+            hasil.append({"id": tagihan_id, "status": "gagal", "pesan": "Tagihan tidak ditemukan"})
+            continue
+        if data_tagihan.get("StatusPembayaran") == status:
+            hasil.append({"id": tagihan_id, "status": "ok", "pesan": "Tidak berubah"})
             continue
+        operasi.append(
+            (db.collection("tagihan").document(tagihan_id), {"StatusPembayaran": status})
+        )
+        kamar_id = data_tagihan.get("KamarID")
+        if (view.get(kamar_id) or {}).get("TagihanID") == tagihan_id:
+            operasi.append(
+                (db.collection("tagihan_terakhir").document(kamar_id), {"StatusPembayaran": status})
+            )
+        hasil.append({"id": tagihan_id, "status": "ok"})
 
-        # Filter tanggal
-        if selected_date:
-            try:
-                if ts.date() != datetime.strptime(selected_date, "%Y-%m-%d").date():
-                    continue
-            except ValueError:
-                continue
+    tulis_batch(operasi)
+    return respons_massal(hasil, tujuan)
 
-        elif selected_bulan:
-            try:
-                bulan_obj = datetime.strptime(selected_bulan, "%Y-%m")
-                if ts.year != bulan_obj.year or ts.month != bulan_obj.month:
-                    continue
-            except ValueError:
-                continue
 
-        kamar_id = data.get("KamarID")
-        watt = data.get("JumlahWatt", 0)
-        kwh = round((watt / 1000) * (3 / 3600), 6)
+### Daya
+def rentang_waktu(tanggal=None, bulan=None):
+    # Ubah filter "YYYY-MM-DD" / "YYYY-MM" menjadi rentang [mulai, akhir)
+    if tanggal:
+        mulai = datetime.strptime(tanggal, "%Y-%m-%d")
+        return mulai, mulai + timedelta(days=1)
+    if bulan:
+        mulai = datetime.strptime(bulan, "%Y-%m")
+        return mulai, mulai + relativedelta(months=1)
+    return None, None
+
+
+def query_data_daya(kamar_id=None, mulai=None, akhir=None):
+    query = db.collection("data_daya")
+    if kamar_id:
+        query = query.where("KamarID", "==", kamar_id)
+    if mulai:
+        query = query.where("Timestamp", ">=", mulai)
+    if akhir:
+        query = query.where("Timestamp", "<", akhir)
+    return query
+
+
+def agregat_daya(query):
+    # Jumlah dokumen dan total JumlahWatt dalam satu round trip, dihitung di server
+    hasil = query.count(alias="jumlah").sum("JumlahWatt", alias="total_watt").get()
+    nilai = {r.alias: r.value for r in hasil[0]}
+    return int(nilai.get("jumlah") or 0), float(nilai.get("total_watt") or 0)
+
+
+def ambil_halaman(query, collection, per_page, after=None, before=None):
+    # Pagination pakai cursor dokumen; ambil satu data ekstra untuk tahu ada halaman lain
+    if before:
+        snapshot = db.collection(collection).document(before).get()
+        if snapshot.exists:
+            docs = list(query.end_before(snapshot).limit_to_last(per_page + 1).get())
+            return docs[-per_page:], len(docs) > per_page, True
+
+    has_prev = False
+    if after:
+        snapshot = db.collection(collection).document(after).get()
+        if snapshot.exists:
+            query = query.start_after(snapshot)
+            has_prev = True
+
+    docs = list(query.limit(per_page + 1).stream())
+    return docs[:per_page], has_prev, len(docs) > per_page
+
+
+### Penyimpanan data daya
+# Semua baca/tulis data_daya lewat fungsi di bawah agar route tidak perlu tahu
+# apakah data disimpan per sampel atau dalam bucket (lihat timeseries.py).
+def tulis_data_daya(records):
+    if DAYA_FORMAT == "bucket":
+        timeseries.tulis_chunk(db, records)
+        return
+
+    col = db.collection("data_daya")
+    for i in range(0, len(records), 500):
+        batch = db.batch()
+        for data in records[i : i + 500]:
+            batch.set(col.document(), data)
+        batch.commit()
+
+
+def agregat_daya_kamar(kamar_id=None, mulai=None, akhir=None):
+    # (jumlah data, total JumlahWatt); rentang filter selalu kelipatan jam
+    if DAYA_FORMAT != "bucket":
+        return agregat_daya(query_data_daya(kamar_id, mulai, akhir))
+
+    query = db.collection(timeseries.BUCKET_COLLECTION)
+    if kamar_id:
+        query = query.where("KamarID", "==", kamar_id)
+    if mulai:
+        query = query.where("Mulai", ">=", mulai)
+    if akhir:
+        query = query.where("Mulai", "<", akhir)
+    hasil = query.sum("Jumlah", alias="jumlah").sum("TotalWatt", alias="total_watt").get()
+    nilai = {r.alias: r.value for r in hasil[0]}
+    return int(nilai.get("jumlah") or 0), float(nilai.get("total_watt") or 0)
+
+
+def _cursor_bucket(cursor):
+    # Cursor bucket: "{ms}-{KamarID}"
+    try:
+        ms, kamar_id = cursor.split("-", 1)
+        return int(ms), kamar_id
+    except (AttributeError, ValueError):
+        return None
+
+
+def halaman_daya(kamar_id=None, mulai=None, akhir=None, per_page=15, after=None, before=None):
+    # Satu halaman data terbaru-ke-terlama: (rows, has_prev, has_next); tiap row punya "id"
+    # yang dipakai sebagai cursor after/before halaman berikutnya
+    if DAYA_FORMAT != "bucket":
+        query = query_data_daya(kamar_id, mulai, akhir).order_by(
+            "Timestamp", direction=firestore.Query.DESCENDING
+        )
+        docs, has_prev, has_next = ambil_halaman(
+            query, "data_daya", per_page, after=after, before=before
+        )
+        return [doc.to_dict() | {"id": doc.id} for doc in docs], has_prev, has_next
+
+    def ambil(turun, batas):
+        sampel = timeseries.iter_sampel(
+            db, kamar_id, mulai, akhir, turun=turun, batas=batas
+        )
+        rows = []
+        for ms, kid, watt in sampel:
+            rows.append(
+                {
+                    "id": f"{ms}-{kid}",
+                    "KamarID": kid,
+                    "JumlahWatt": watt,
+                    "Timestamp": timeseries.dari_ms(ms),
+                }
+            )
+            if len(rows) > per_page:
+                break
+        return rows
+
+    batas = _cursor_bucket(before)
+    if batas:
+        rows = ambil(False, batas)
+        return list(reversed(rows[:per_page])), len(rows) > per_page, True
+
+    batas = _cursor_bucket(after)
+    rows = ambil(True, batas)
+    return rows[:per_page], batas is not None, len(rows) > per_page
+
+
+def iter_sampel_kamar(kamar_id, setelah=None):
+    # (Timestamp, JumlahWatt) satu kamar, urut naik, sesudah timestamp `setelah`
+    if DAYA_FORMAT == "bucket":
+        batas = (timeseries.ke_ms(setelah), kamar_id) if setelah else None
+        for ms, _, watt in timeseries.iter_sampel(db, kamar_id, batas=batas):
+            yield timeseries.dari_ms(ms), watt
+        return
+
+    query = db.collection("data_daya").where("KamarID", "==", kamar_id)
+    if setelah:
+        query = query.where("Timestamp", ">", setelah)
+    for doc in query.order_by("Timestamp").stream():
+        data = doc.to_dict()
+        if data.get("Timestamp"):
+            yield data["Timestamp"], data.get("JumlahWatt", 0)
+
+
+@app.route("/pemilik/histori-daya", methods=["GET", "POST"])
+async def histori_daya():
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    selected_kamar = request.args.get("kamar")
+    selected_date = request.args.get("tanggal")
+    selected_bulan = request.args.get("bulan")
+    page = int(request.args.get("page", 1))
+    after = request.args.get("after")
+    before = request.args.get("before")
+    per_page = 15
+
+    if selected_date in (None, "", "None"):
+        selected_date = None
+    if selected_bulan in (None, "", "None"):
+        selected_bulan = None
+
+    # Ambil semua data kamar (nomor & batas kWh)
+    kamar_dict = {}
+    for data in await di_pool(ambil_semua_kamar):
+        kamar_dict[data["id"]] = {
+            "nomor": data.get("NomorKamar", "Tidak diketahui"),
+            "batas_kwh": data.get("BatasKWH", 0),
+            "data": data,
+        }
+    kamar_tidak_dikenal = {"nomor": "Tidak diketahui", "batas_kwh": 0}
+    kamar_for_filter = [{"id": k, "nomor": v["nomor"]} for k, v in kamar_dict.items()]
+
+    try:
+        mulai, akhir = rentang_waktu(selected_date, selected_bulan)
+    except ValueError:
+        # Format filter tidak valid: tidak ada data yang cocok
+        return render_template(
+            "pemilik/histori_daya.html",
+            histori_data=[],
+            kamar_list=kamar_for_filter,
+            selected_kamar=selected_kamar,
+            selected_date=selected_date,
+            selected_bulan=selected_bulan,
+            current_page=1,
+            total_pages=0,
+            ringkasan_kamar={},
+        )
 
-        kamar_info = kamar_dict.get(
-            kamar_id, {"nomor": "Tidak diketahui", "batas_kwh": 0}
+    # kWh per kamar dari rollup/daya_ringkas: satu query untuk semua kamar. Sampel yang
+    # belum di-rollup hanya diintegrasikan untuk kamar yang dipilih, jadi biaya halaman
+    # tidak tumbuh dengan jumlah kamar. Halaman data, jumlah data (untuk pagination), dan
+    # total diambil bersamaan di thread pool.
+    bulan = None if selected_date else selected_bulan
+    tugas = [
+        lambda: halaman_daya(selected_kamar, mulai, akhir, per_page, after=after, before=before),
+        lambda: agregat_daya_kamar(selected_kamar, mulai, akhir),
+        lambda: kwh_tersimpan(selected_kamar, mulai, akhir, bulan),
+    ]
+    if selected_kamar:
+        tugas.append(
+            lambda: kwh_belum_dirollup(
+                selected_kamar,
+                kamar_dict.get(selected_kamar, {}).get("data"),
+                mulai,
+                akhir,
+            )
         )
-        batas_kwh = kamar_info["batas_kwh"]
-        kwh_over = max(kwh - batas_kwh, 0)
+    halaman, (total_data, _), total_per_kamar, *belum = await paralel(*tugas)
+    if belum:
+        total_per_kamar[selected_kamar] = total_per_kamar.get(selected_kamar, 0.0) + belum[0]
+
+    ringkasan_kamar = {}
+    ringkasan_total = None
+    if not selected_kamar and total_per_kamar:
+        # Total semua kamar (termasuk kamar yang sudah dihapus) ditampilkan terpisah
+        ringkasan_total = {"total_kwh": sum(total_per_kamar.values())}
+    for kamar_id, kamar_info in kamar_dict.items():
+        total_kwh = total_per_kamar.get(kamar_id)
+        if not total_kwh:
+            continue
+        ringkasan_kamar[kamar_id] = {
+            "nomor": kamar_info["nomor"],
+            "total_kwh": total_kwh,
+            "total_kwh_over": max(total_kwh - kamar_info["batas_kwh"], 0),
+        }
+
+    rows, has_prev, has_next = halaman
+
+    histori_data = []
+    for data in rows:
+        ts = data.get("Timestamp")
+        kamar_id = data.get("KamarID")
+        kamar_info = kamar_dict.get(kamar_id, kamar_tidak_dikenal)
 
         histori_data.append(
             {
+                "id": data["id"],
                 "NomorKamar": kamar_info["nomor"],
                 "KamarID": kamar_id,
-                "Tanggal": ts.strftime("%Y-%m-%d %H:%M:%S"),
-                "kWh": kwh,
-                "kWhOverLimit": kwh_over,
+                "Tanggal": ts.strftime("%Y-%m-%d %H:%M:%S") if ts else "Unknown",
+                "Watt": data.get("JumlahWatt", 0),
             }
         )
 
-        # Akumulasi per kamar
-        if kamar_id not in ringkasan_kamar:
-            ringkasan_kamar[kamar_id] = {
-                "nomor": kamar_info["nomor"],
-                "total_kwh": 0,
-                "total_kwh_over": 0,
-            }
-        ringkasan_kamar[kamar_id]["total_kwh"] += kwh
-        ringkasan_kamar[kamar_id]["total_kwh_over"] += kwh_over
-
-    # Pagination
-    total_data = len(histori_data)
     total_pages = (total_data + per_page - 1) // per_page
-    start = (page - 1) * per_page
-    end = start + per_page
-    histori_data_paginated = histori_data[start:end]
-
-    kamar_for_filter = [{"id": k, "nomor": v["nomor"]} for k, v in kamar_dict.items()]
 
     return render_template(
         "pemilik/histori_daya.html",
-        histori_data=histori_data_paginated,
+        histori_data=histori_data,
         kamar_list=kamar_for_filter,
         selected_kamar=selected_kamar,
         selected_date=selected_date,
         selected_bulan=selected_bulan,
         current_page=page,
         total_pages=total_pages,
+        prev_cursor=histori_data[0]["id"] if has_prev and histori_data else None,
+        next_cursor=histori_data[-1]["id"] if has_next and histori_data else None,
         ringkasan_kamar=ringkasan_kamar,
+        ringkasan_total=ringkasan_total,
     )
 
 
@@ -811,30 +2012,45 @@ def upload_bukti(tagihan_id):
         return redirect(url_for("tagihan_penghuni"))
 
     if request.method == "POST":
-        file = request.files["bukti"]
+        try:
+            file = request.files.get("bukti")
+        except RequestEntityTooLarge:
+            file = None
+            flash(f"Ukuran file maksimal {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.", "danger")
+            return redirect(url_for("upload_bukti", tagihan_id=tagihan_id))
+
         if file:
-            # Hapus file lama di folder lokal (jika ada)
-            old_url = tagihan.get("BuktiBayarURL")
-            if old_url and "static/uploads" in old_url:
-                try:
-                    old_filename = old_url.split("uploads/")[-1]
-                    os.remove(os.path.join(UPLOAD_FOLDER, old_filename))
-                except Exception as e:
-                    print("Gagal menghapus file lama:", e)
-
-            filename = secure_filename(f"{tagihan_id}_{file.filename}")
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-
-            url = url_for("static", filename=f"uploads/{filename}", _external=True)
-
-            tagihan_ref.update(
-                {
-                    "BuktiBayarURL": url,
-                    "StatusPembayaran": "Menunggu",
-                    "TerakhirUpload": datetime.utcnow(),
-                }
+            ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+            sementara = os.path.join(BUKTI_TMP, secrets.token_hex(16) + ext)
+            try:
+                upload.simpan_stream(file.stream, sementara, UPLOAD_MAX_BYTES)
+            except upload.FileTerlaluBesar:
+                flash(f"Ukuran file maksimal {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.", "danger")
+                return redirect(url_for("upload_bukti", tagihan_id=tagihan_id))
+
+            # File asli langsung bisa dilihat; versi bersih + thumbnail menyusul
+            diproses = upload.bisa_diproses(sementara)
+            if diproses:
+                salinan = sementara + ".proses"
+                shutil.copyfile(sementara, salinan)
+            kunci = bukti_store.put(sementara, ext)
+
+            perubahan = {
+                "BuktiBayarURL": url_for("bukti_bayar", tagihan_id=tagihan_id, _external=True),
+                "BuktiBayarFile": kunci,
+                "BuktiBayarThumbFile": firestore.DELETE_FIELD,
+                "StatusPembayaran": "Menunggu",
+                "TerakhirUpload": datetime.utcnow(),
+            }
+            tagihan_ref.update(perubahan)
+            perbarui_tagihan_terakhir(
+                tagihan_id,
+                {k: v for k, v in perubahan.items() if k != "BuktiBayarThumbFile"},
             )
+            hapus_bukti_lama(tagihan)
+
+            if diproses:
+                upload_pool.submit(proses_bukti, tagihan_id, kunci, salinan)
 
             flash("Bukti pembayaran berhasil diunggah.", "success")
             return redirect(url_for("tagihan_penghuni"))
@@ -844,8 +2060,118 @@ def upload_bukti(tagihan_id):
     return render_template("penghuni/upload_bukti.html", tagihan=tagihan)
 
 
+def hapus_bukti_lama(tagihan):
+    # Bukti format lama (static/uploads) dihapus langsung; file di bukti_store
+    # dibersihkan oleh job GC karena bisa saja dipakai tagihan lain (deduplikasi)
+    old_url = tagihan.get("BuktiBayarURL")
+    if old_url and "static/uploads" in old_url:
+        try:
+            old_filename = old_url.split("uploads/")[-1]
+            os.remove(os.path.join(UPLOAD_FOLDER, old_filename))
+        except Exception as e:
+            print("Gagal menghapus file lama:", e)
+
+
+def proses_bukti(tagihan_id, kunci_asli, path_salinan):
+    # Dijalankan di upload_pool: encode ulang tanpa EXIF + thumbnail, lalu ganti file asli
+    dasar = path_salinan.rsplit(".", 1)[0]
+    path_hasil, path_thumb = f"{dasar}.bersih.jpg", f"{dasar}.thumb.jpg"
+    try:
+        upload.proses_gambar(path_salinan, path_hasil, path_thumb)
+        kunci_hasil = bukti_store.put(path_hasil, ".jpg")
+        kunci_thumb = bukti_store.put(path_thumb, ".jpg")
+    except Exception:
+        # Bukan gambar yang valid: file asli tetap dipakai
+        app.logger.exception("Gagal memproses bukti tagihan %s", tagihan_id)
+        return
+    finally:
+        for path in (path_salinan, path_hasil, path_thumb):
+            if os.path.exists(path):
+                os.remove(path)
+
+    tagihan_ref = db.collection("tagihan").document(tagihan_id)
+
+    @firestore.transactional
+    def _ganti(transaction):
+        snapshot = tagihan_ref.get(transaction=transaction)
+        # Lewati jika penghuni sudah upload ulang selama proses berjalan
+        if not snapshot.exists or snapshot.get("BuktiBayarFile") != kunci_asli:
+            return
+        transaction.update(
+            tagihan_ref, {"BuktiBayarFile": kunci_hasil, "BuktiBayarThumbFile": kunci_thumb}
+        )
+
+    # File asli yang tidak dipakai lagi dihapus oleh job GC
+    _ganti(db.transaction())
+
+
+def boleh_lihat_bukti(tagihan):
+    if session.get("role") == "pemilik":
+        return True
+    kamar_id, _ = cari_kamar_penghuni(session.get("user_id"))
+    return kamar_id is not None and tagihan.get("KamarID") == kamar_id
+
+
+@app.route("/bukti/<tagihan_id>")
+def bukti_bayar(tagihan_id):
+    # URL stabil per tagihan, diarahkan ke file versi terbaru
+    if session.get("role") not in ("pemilik", "penghuni"):
+        return redirect(url_for("login"))
+
+    tagihan_doc = db.collection("tagihan").document(tagihan_id).get()
+    if not tagihan_doc.exists:
+        abort(404)
+    tagihan = tagihan_doc.to_dict()
+    if not boleh_lihat_bukti(tagihan):
+        abort(403)
+
+    field = "BuktiBayarThumbFile" if request.args.get("ukuran") == "thumb" else "BuktiBayarFile"
+    if not tagihan.get(field):
+        abort(404)
+    response = redirect(url_for("berkas_bukti", kunci=tagihan[field]))
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/berkas/<path:kunci>")
+def berkas_bukti(kunci):
+    # Isi file tidak pernah berubah untuk kunci yang sama: cache selamanya + ETag
+    role = session.get("role")
+    if role not in ("pemilik", "penghuni"):
+        return redirect(url_for("login"))
+    if not upload_store.kunci_valid(kunci):
+        abort(404)
+
+    etag = upload_store.etag(kunci)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        if role == "penghuni":
+            # Satu file bisa dipakai beberapa tagihan (deduplikasi)
+            pemakai = list(
+                db.collection("tagihan").where("BuktiBayarFile", "==", kunci).stream()
+            ) + list(
+                db.collection("tagihan").where("BuktiBayarThumbFile", "==", kunci).stream()
+            )
+            if not any(boleh_lihat_bukti(doc.to_dict()) for doc in pemakai):
+                abort(403)
+        try:
+            berkas = bukti_store.buka(kunci)
+        except FileNotFoundError:
+            abort(404)
+        response = send_file(
+            berkas,
+            mimetype=mimetypes.guess_type(kunci)[0] or "application/octet-stream",
+            etag=False,
+            conditional=False,
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
 @app.route("/penghuni/tagihan")
-def tagihan_penghuni():
+async def tagihan_penghuni():
     if session.get("role") != "penghuni":
         return redirect(url_for("login"))
 
@@ -853,13 +2179,7 @@ def tagihan_penghuni():
     # print(user_id)
 
     # Ambil kamar_id dari UserID
-    kamar_id = None
-    for doc in db.collection("kamar").stream():
-        data = doc.to_dict()
-        if data.get("UserID") == user_id:
-            kamar_id = doc.id
-            # print(kamar_id)
-            break
+    kamar_id, _ = await di_pool(cari_kamar_penghuni, user_id)
 
     if not kamar_id:
         flash("Anda belum terdaftar di kamar mana pun.", "warning")
@@ -873,9 +2193,11 @@ def tagihan_penghuni():
     if bulan_filter:
         tagihan_ref = tagihan_ref.where("Bulan", "==", bulan_filter)
 
-    tagihan_docs = tagihan_ref.order_by(
-        "Bulan", direction=firestore.Query.DESCENDING
-    ).stream()
+    tagihan_docs = await di_pool(
+        lambda: list(
+            tagihan_ref.order_by("Bulan", direction=firestore.Query.DESCENDING).stream()
+        )
+    )
 
     tagihan_all = [doc.to_dict() | {"id": doc.id} for doc in tagihan_docs]
     total_pages = (len(tagihan_all) + 14) // 15
@@ -892,21 +2214,15 @@ def tagihan_penghuni():
 
 
 @app.route("/penghuni/histori")
-def histori_penghuni():
+async def histori_penghuni():
     if session.get("role") != "penghuni":
         return redirect(url_for("login"))
 
     user_id = session.get("user_id")
-    kamar_id = None
-    batas_kwh = 0
 
     # Cari kamar milik penghuni
-    for doc in db.collection("kamar").stream():
-        data = doc.to_dict()
-        if data.get("UserID") == user_id:
-            kamar_id = doc.id
-            batas_kwh = data.get("BatasKWH", 0)  # dari watt ke kWh
-            break
+    kamar_id, kamar_data = await di_pool(cari_kamar_penghuni, user_id)
+    batas_kwh = kamar_data.get("BatasKWH", 0) if kamar_data else 0
 
     if not kamar_id:
         flash("Anda belum terdaftar di kamar mana pun.", "warning")
@@ -920,34 +2236,33 @@ def histori_penghuni():
 
     bulan_filter = request.args.get("bulan")  # format: YYYY-MM
     page = int(request.args.get("page", 1))
+    after = request.args.get("after")
+    before = request.args.get("before")
+    per_page = 15
 
-    daya_ref = db.collection("data_daya").where("KamarID", "==", kamar_id)
-
-    if bulan_filter:
-        year, month = map(int, bulan_filter.split("-"))
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
-        daya_ref = daya_ref.where("Timestamp", ">=", start_date).where(
-            "Timestamp", "<", end_date
+    try:
+        mulai, akhir = rentang_waktu(bulan=bulan_filter)
+    except ValueError:
+        flash("Format bulan tidak valid.", "warning")
+        return render_template(
+            "penghuni/histori_penghuni.html",
+            histori=[],
+            bulan_filter=None,
+            page=1,
+            total_pages=0,
+            batas_kwh=batas_kwh,
+            total_kwh=0,
         )
 
-    daya_docs = daya_ref.order_by(
-        "Timestamp", direction=firestore.Query.DESCENDING
-    ).stream()
-    daya_all = [doc.to_dict() for doc in daya_docs]
-
-    # Hitung total kWh bulan ini
-    total_kwh = round(sum([d.get("JumlahWatt", 0) for d in daya_all]) / 1200000, 6)
-
-    # Pagination
-    total_pages = (len(daya_all) + 14) // 15
-    daya = daya_all[(page - 1) * 15 : page * 15]
-
-    for data in daya:
-        data["kWh"] = round(data.get("JumlahWatt", 0) / 1200000, 6)
+    # Total kWh (rollup + sampel yang belum di-rollup), jumlah data, dan halaman data
+    # diambil bersamaan
+    total_kwh, (total_data, _), (daya, has_prev, has_next) = await paralel(
+        lambda: kwh_rentang(kamar_id, kamar_data, mulai, akhir, bulan_filter),
+        lambda: agregat_daya_kamar(kamar_id, mulai, akhir),
+        lambda: halaman_daya(kamar_id, mulai, akhir, per_page, after=after, before=before),
+    )
+    total_kwh = round(total_kwh, 6)
+    total_pages = (total_data + per_page - 1) // per_page
 
     return render_template(
         "penghuni/histori_penghuni.html",
@@ -955,11 +2270,856 @@ def histori_penghuni():
         bulan_filter=bulan_filter,
         page=page,
         total_pages=total_pages,
+        prev_cursor=daya[0]["id"] if has_prev and daya else None,
+        next_cursor=daya[-1]["id"] if has_next and daya else None,
         batas_kwh=batas_kwh,
         total_kwh=total_kwh,
     )
 
 
+### Ingest data daya dari meter
+@app.route("/api/daya", methods=["POST"])
+@api_key_required
+def ingest_daya():
+    # Body: JSON (satu objek, list, atau {"data": [...]}) atau NDJSON (satu objek per baris)
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            items = [
+                json.loads(line)
+                for line in request.get_data(as_text=True).splitlines()
+                if line.strip()
+            ]
+        else:
+            items = json.loads(request.get_data(as_text=True) or "null")
+            if isinstance(items, dict):
+                items = items.get("data", [items])
+    except ValueError:
+        return jsonify({"status": "error", "message": "Body bukan JSON/NDJSON yang valid"}), 400
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "Tidak ada data"}), 400
+    if len(items) > INGEST_MAX_RECORDS:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"Maksimal {INGEST_MAX_RECORDS} data per request",
+                }
+            ),
+            413,
+        )
+
+    records = []
+    errors = []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Data harus berupa objek")
+            records.append(parse_data_daya(item))
+        except (ValueError, TypeError, OverflowError) as e:
+            errors.append({"index": i, "message": str(e)})
+
+    if records:
+        try:
+            ingest_buffer.submit(records)
+        except BufferPenuh:
+            # Backpressure: meter harus mengirim ulang setelah jeda
+            response = jsonify(
+                {"status": "error", "message": "Server sibuk, coba lagi nanti"}
+            )
+            response.headers["Retry-After"] = str(
+                max(1, math.ceil(ingest_buffer.flush_interval))
+            )
+            return response, 503
+
+    return (
+        jsonify(
+            {
+                "status": "success" if not errors else "partial",
+                "diterima": len(records),
+                "ditolak": len(errors),
+                "errors": errors,
+            }
+        ),
+        202 if records else 400,
+    )
+
+
+### Seri ringkasan daya (downsampling)
+# daya_ringkas ditulis oleh rollup (perbarui_rollup_kamar), jadi tertinggal paling lama
+# satu periode JOB_ROLLUP_MENIT dari data mentah.
+MAKS_TITIK_SERI = int(os.getenv("MAKS_TITIK_SERI", 500))
+
+
+def parse_rentang(value):
+    # "90m", "24h", "7d" -> timedelta (maksimal satu tahun)
+    satuan = {"m": "minutes", "h": "hours", "d": "days"}
+    if not value or value[-1] not in satuan or not value[:-1].isdigit():
+        raise ValueError("Format range harus seperti 90m, 24h, atau 7d")
+    rentang = timedelta(**{satuan[value[-1]]: int(value[:-1])})
+    return min(rentang, timedelta(days=366))
+
+
+@app.route("/api/daya/seri")
+@auth_required
+def seri_daya():
+    # Browser memakai session login; klien mesin boleh memakai bearer token
+    user_id, role = pengguna_aktif()
+    kamar_id = request.args.get("kamar")
+    if role == "penghuni":
+        # Penghuni hanya boleh melihat kamarnya sendiri
+        kamar_penghuni, _ = cari_kamar_penghuni(user_id)
+        kamar_id = kamar_id or kamar_penghuni
+        if not kamar_id or kamar_id != kamar_penghuni:
+            return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    elif role != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    if not kamar_id:
+        return jsonify({"status": "error", "message": "Parameter kamar wajib diisi"}), 400
+
+    try:
+        rentang = parse_rentang(request.args.get("range", "7d"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    resolusi = request.args.get("resolusi", "auto")
+    if resolusi != "auto" and resolusi not in timeseries.RESOLUSI_DETIK:
+        return jsonify({"status": "error", "message": "Resolusi tidak dikenal"}), 400
+
+    # Pilih resolusi terhalus yang jumlah titiknya masih dalam batas
+    urutan = list(timeseries.RESOLUSI_DETIK)
+    if resolusi == "auto":
+        resolusi = urutan[0]
+    for kandidat in urutan[urutan.index(resolusi) :]:
+        resolusi = kandidat
+        if rentang.total_seconds() / timeseries.RESOLUSI_DETIK[kandidat] <= MAKS_TITIK_SERI:
+            break
+
+    akhir = datetime.now(timezone.utc)
+    mulai = akhir - rentang
+    seri = timeseries.baca_seri(
+        db, kamar_id, resolusi, mulai, akhir, batas=MAKS_TITIK_SERI + 1
+    )
+    return jsonify(
+        {
+            "kamar": kamar_id,
+            "resolusi": resolusi,
+            "mulai": mulai.isoformat(),
+            "akhir": akhir.isoformat(),
+            "points": seri[-MAKS_TITIK_SERI:],
+        }
+    )
+
+
+### Ekspor CSV / Parquet
+# Baris dibaca per halaman (cursor) dan langsung dikirim, jadi memori tetap datar.
+# Kolom "id" berisi cursor: jika unduhan terputus, ulangi dengan ?after=<id terakhir>.
+UKURAN_HALAMAN_EKSPOR = int(os.getenv("UKURAN_HALAMAN_EKSPOR", 1000))
+AWAL_DATA = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+KOLOM_DAYA = [
+    ("id", "teks"),
+    ("KamarID", "teks"),
+    ("NomorKamar", "teks"),
+    ("Timestamp", "waktu"),
+    ("JumlahWatt", "angka"),
+]
+KOLOM_RINGKAS = [
+    ("id", "teks"),
+    ("KamarID", "teks"),
+    ("NomorKamar", "teks"),
+    ("Mulai", "waktu"),
+    ("Resolusi", "teks"),
+    ("KWH", "angka"),
+    ("Jumlah", "bulat"),
+    ("MinWatt", "angka"),
+    ("MaxWatt", "angka"),
+    ("MeanWatt", "angka"),
+]
+KOLOM_TAGIHAN = [
+    ("id", "teks"),
+    ("KamarID", "teks"),
+    ("NomorKamar", "teks"),
+    ("Bulan", "teks"),
+    ("JumlahKWH", "angka"),
+    ("TotalTagihan", "angka"),
+    ("StatusPembayaran", "teks"),
+    ("Timestamp", "waktu"),
+]
+
+
+def ke_utc(ts):
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(energi.ke_detik(ts), timezone.utc)
+
+
+def iter_ekspor_daya(kamar, kamar_id, mulai, akhir, after=None):
+    while True:
+        rows, _, has_next = halaman_daya(
+            kamar_id, mulai, akhir, UKURAN_HALAMAN_EKSPOR, after=after
+        )
+        for r in rows:
+            kamar_data = kamar.get(r["KamarID"], {})
+            yield {
+                "id": r["id"],
+                "KamarID": r["KamarID"],
+                "NomorKamar": kamar_data.get("NomorKamar"),
+                "Timestamp": ke_utc(r.get("Timestamp")),
+                "JumlahWatt": float(r.get("JumlahWatt") or 0),
+            }
+        if not has_next or not rows:
+            return
+        after = rows[-1]["id"]
+
+
+def iter_ekspor_ringkas(kamar, kamar_id, resolusi, mulai, akhir, after=None):
+    # Cursor: "{KamarID}|{Mulai ISO}"; kamar diproses urut id
+    kamar_ids = [kamar_id] if kamar_id else sorted(kamar)
+    after_kamar, after_mulai = (after.split("|", 1) + [None])[:2] if after else (None, None)
+    for kid in kamar_ids:
+        if after_kamar and kid < after_kamar:
+            continue
+        dari = mulai or AWAL_DATA
+        if kid == after_kamar and after_mulai:
+            dari = datetime.fromisoformat(after_mulai) + timedelta(seconds=1)
+        while True:
+            seri = timeseries.baca_seri(
+                db, kid, resolusi, dari, akhir, batas=UKURAN_HALAMAN_EKSPOR
+            )
+            for p in seri:
+                yield {
+                    "id": f"{kid}|{p['t']}",
+                    "KamarID": kid,
+                    "NomorKamar": kamar.get(kid, {}).get("NomorKamar"),
+                    "Mulai": datetime.fromisoformat(p["t"]),
+                    "Resolusi": resolusi,
+                    "KWH": p["kwh"],
+                    "Jumlah": p["jumlah"],
+                    "MinWatt": p["min_watt"],
+                    "MaxWatt": p["max_watt"],
+                    "MeanWatt": p["mean_watt"],
+                }
+            if len(seri) < UKURAN_HALAMAN_EKSPOR:
+                break
+            dari = datetime.fromisoformat(seri[-1]["t"]) + timedelta(seconds=1)
+
+
+def iter_ekspor_tagihan(kamar, kamar_id, bulan, after=None):
+    query = db.collection("tagihan")
+    if kamar_id:
+        query = query.where("KamarID", "==", kamar_id)
+    if bulan:
+        query = query.where("Bulan", "==", bulan)
+    query = query.order_by("Bulan", direction=firestore.Query.DESCENDING)
+    while True:
+        docs, _, has_next = ambil_halaman(query, "tagihan", UKURAN_HALAMAN_EKSPOR, after=after)
+        for doc in docs:
+            data = doc.to_dict()
+            yield {
+                "id": doc.id,
+                "KamarID": data.get("KamarID"),
+                "NomorKamar": kamar.get(data.get("KamarID"), {}).get("NomorKamar"),
+                "Bulan": data.get("Bulan"),
+                "JumlahKWH": data.get("JumlahKWH"),
+                "TotalTagihan": data.get("TotalTagihan"),
+                "StatusPembayaran": data.get("StatusPembayaran"),
+                "Timestamp": ke_utc(data.get("Timestamp")),
+            }
+        if not has_next or not docs:
+            return
+        after = docs[-1].id
+
+
+def respons_ekspor(nama, rows, kolom):
+    format_ = request.args.get("format", "csv")
+    if format_ == "parquet":
+        try:
+            body = ekspor.stream_parquet(rows, kolom)
+        except ekspor.FormatTidakTersedia as e:
+            return jsonify({"status": "error", "message": str(e)}), 501
+        mimetype, ext = "application/vnd.apache.parquet", "parquet"
+    elif format_ == "csv":
+        body = ekspor.stream_csv(rows, kolom)
+        mimetype, ext = "text/csv", "csv"
+    else:
+        return jsonify({"status": "error", "message": "format harus csv atau parquet"}), 400
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{nama}.{ext}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@app.route("/pemilik/ekspor/daya")
+def ekspor_daya():
+    # ?kamar=&tanggal=YYYY-MM-DD|bulan=YYYY-MM&resolusi=sampel|menit|jam|hari
+    # &format=csv|parquet&after=
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    kamar_id = request.args.get("kamar") or None
+    resolusi = request.args.get("resolusi", "sampel")
+    after = request.args.get("after") or None
+    tanggal = request.args.get("tanggal") or None
+    bulan = request.args.get("bulan") or None
+    try:
+        mulai, akhir = rentang_waktu(tanggal, bulan)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Format tanggal/bulan tidak valid"}), 400
+    kamar = {k["id"]: k for k in ambil_semua_kamar()}
+
+    nama = f"daya_{kamar_id or 'semua'}_{tanggal or bulan or 'semua'}_{resolusi}"
+    if resolusi == "sampel":
+        rows = iter_ekspor_daya(kamar, kamar_id, mulai, akhir, after)
+        return respons_ekspor(nama, rows, KOLOM_DAYA)
+    if resolusi in timeseries.RESOLUSI_DETIK:
+        rows = iter_ekspor_ringkas(kamar, kamar_id, resolusi, mulai, akhir, after)
+        return respons_ekspor(nama, rows, KOLOM_RINGKAS)
+    return jsonify({"status": "error", "message": "Resolusi tidak dikenal"}), 400
+
+
+@app.route("/pemilik/ekspor/tagihan")
+def ekspor_tagihan():
+    # ?kamar=&bulan=YYYY-MM&format=csv|parquet&after=
+    if session.get("role") != "pemilik":
+        return redirect(url_for("login"))
+
+    kamar_id = request.args.get("kamar") or None
+    bulan = request.args.get("bulan") or None
+    kamar = {k["id"]: k for k in ambil_semua_kamar()}
+    rows = iter_ekspor_tagihan(kamar, kamar_id, bulan, request.args.get("after") or None)
+    return respons_ekspor(f"tagihan_{kamar_id or 'semua'}_{bulan or 'semua'}", rows, KOLOM_TAGIHAN)
+
+
+### Realtime (Server-Sent Events)
+# Sumber event daya terkini: "listener" (ingest menulis daya_terkini/{KamarID}, semua
+# worker membaca lewat satu listener on_snapshot) atau "ingest" (langsung dari buffer
+# ingest di proses ini, tanpa tulis tambahan; hanya untuk deployment satu proses)
+REALTIME_SUMBER = os.getenv("REALTIME_SUMBER", "listener")
+# daya_terkini ditulis paling sering sekali per DAYA_TERKINI_JEDA_DETIK per kamar; jika
+# watt tidak berubah, cukup sekali per DAYA_TERKINI_MAKS_DETIK (biar timestamp tidak basi)
+DAYA_TERKINI_JEDA_DETIK = float(os.getenv("DAYA_TERKINI_JEDA_DETIK", 5))
+DAYA_TERKINI_MAKS_DETIK = float(os.getenv("DAYA_TERKINI_MAKS_DETIK", 60))
+_daya_terkini_ditulis = {}  # kamar -> (time.monotonic(), watt) tulisan terakhir
+SSE_HEARTBEAT = int(os.getenv("SSE_HEARTBEAT", 15))
+realtime_hub = Hub(
+    maxsize=int(os.getenv("SSE_QUEUE_SIZE", 100)),
+    maks_klien=int(os.getenv("SSE_MAKS_KLIEN", 500)),
+)
+CHANNEL_PEMILIK = "pemilik"
+_listener_realtime_pid = None
+_listener_realtime_lock = threading.Lock()
+
+
+def channel_kamar(kamar_id):
+    return f"kamar:{kamar_id}"
+
+
+def publish_daya(kamar_id, watt, timestamp):
+    realtime_hub.publish(
+        [channel_kamar(kamar_id), CHANNEL_PEMILIK],
+        "daya",
+        {
+            "kamar_id": kamar_id,
+            "watt": watt,
+            "timestamp": datetime.fromtimestamp(
+                energi.ke_detik(timestamp), timezone.utc
+            ).isoformat()
+            if timestamp
+            else None,
+        },
+        kunci=kamar_id,
+    )
+
+
+def relay_menyala(nilai):
+    # Kamar lama menyimpan "ON"/"OFF" (string), yang baru boolean
+    if isinstance(nilai, str):
+        return nilai.strip().lower() in ("on", "true", "1")
+    return bool(nilai)
+
+
+def publish_relay(kamar_id, relay1_status, relay1_aktual=None):
+    realtime_hub.publish(
+        [channel_kamar(kamar_id), CHANNEL_PEMILIK],
+        "relay",
+        {
+            "kamar_id": kamar_id,
+            "relay1_status": relay_menyala(relay1_status),
+            "relay1_aktual": relay1_aktual,
+        },
+        kunci=kamar_id,
+    )
+
+
+def publish_peringatan(data):
+    realtime_hub.publish(
+        [channel_kamar(data["KamarID"]), CHANNEL_PEMILIK],
+        "peringatan",
+        {
+            "kamar_id": data["KamarID"],
+            "nomor_kamar": data.get("NomorKamar"),
+            "bulan": data["Bulan"],
+            "ambang": data["Ambang"],
+            "total_kwh": round(data["TotalKWH"], 3),
+            "batas_kwh": data["BatasKWH"],
+        },
+        simpan=False,
+    )
+
+
+def teruskan_daya_terkini(records):
+    # Dipanggil setiap batch ingest tersimpan: cukup sampel terbaru per kamar
+    terbaru = {}
+    for r in records:
+        lama = terbaru.get(r["KamarID"])
+        if lama is None or energi.ke_detik(r["Timestamp"]) >= energi.ke_detik(lama["Timestamp"]):
+            terbaru[r["KamarID"]] = r
+
+    if REALTIME_SUMBER == "ingest":
+        for kamar_id, r in terbaru.items():
+            publish_daya(kamar_id, r["JumlahWatt"], r["Timestamp"])
+        return
+
+    sekarang = time.monotonic()
+    batch = db.batch()
+    ditulis = 0
+    for kamar_id, r in terbaru.items():
+        terakhir = _daya_terkini_ditulis.get(kamar_id)
+        if terakhir:
+            jeda = sekarang - terakhir[0]
+            if jeda < DAYA_TERKINI_JEDA_DETIK or (
+                r["JumlahWatt"] == terakhir[1] and jeda < DAYA_TERKINI_MAKS_DETIK
+            ):
+                continue
+        batch.set(
+            db.collection("daya_terkini").document(kamar_id),
+            {"KamarID": kamar_id, "JumlahWatt": r["JumlahWatt"], "Timestamp": r["Timestamp"]},
+        )
+        _daya_terkini_ditulis[kamar_id] = (sekarang, r["JumlahWatt"])
+        ditulis += 1
+    if ditulis:
+        batch.commit()
+
+
+ingest_buffer.on_flush.append(teruskan_daya_terkini)
+
+
+def _snapshot_daya(docs, changes, read_time):
+    for change in changes:
+        if change.type.name == "REMOVED":
+            continue
+        data = change.document.to_dict()
+        publish_daya(change.document.id, data.get("JumlahWatt"), data.get("Timestamp"))
+
+
+def _snapshot_relay(docs, changes, read_time):
+    for change in changes:
+        if change.type.name == "REMOVED":
+            continue
+        data = change.document.to_dict()
+        publish_relay(change.document.id, data.get("relay1_status"), data.get("relay1_aktual"))
+
+
+def _snapshot_perintah(docs, changes, read_time):
+    # Bangunkan long-poll / stream perangkat di proses ini saat ada perintah baru
+    for change in changes:
+        if change.type.name != "ADDED":
+            continue
+        data = change.document.to_dict()
+        realtime_hub.publish(
+            [channel_perintah(data["KamarID"])],
+            "perintah",
+            format_perintah(change.document.id, data),
+            simpan=False,
+        )
+
+
+def _snapshot_peringatan(docs, changes, read_time):
+    for change in changes:
+        if change.type.name == "ADDED":
+            publish_peringatan(change.document.to_dict())
+
+
+def pastikan_listener_realtime():
+    # Satu listener per proses, dipasang saat klien SSE pertama terhubung
+    global _listener_realtime_pid
+    if _listener_realtime_pid == os.getpid():
+        return
+    with _listener_realtime_lock:
+        if _listener_realtime_pid == os.getpid():
+            return
+        _listener_realtime_pid = os.getpid()
+        if REALTIME_SUMBER == "listener":
+            db.collection("daya_terkini").on_snapshot(_snapshot_daya)
+            # Hanya peringatan baru, bukan seluruh riwayat
+            db.collection("peringatan").where(
+                "DibuatPada", ">", datetime.now(timezone.utc)
+            ).on_snapshot(_snapshot_peringatan)
+        db.collection("kamar").on_snapshot(_snapshot_relay)
+        db.collection("relay_perintah").where("Status", "==", "menunggu").on_snapshot(
+            _snapshot_perintah
+        )
+
+
+def respons_sse(channel, replay=True):
+    if realtime_hub.jumlah_klien() >= realtime_hub.maks_klien:
+        return jsonify({"status": "error", "message": "Terlalu banyak koneksi"}), 503
+    pastikan_listener_realtime()
+    return Response(
+        realtime_hub.stream(channel, heartbeat=SSE_HEARTBEAT, replay=replay),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/stream/kamar/<kamar_id>")
+def stream_kamar(kamar_id):
+    role = session.get("role")
+    if role == "penghuni":
+        kamar_penghuni, _ = cari_kamar_penghuni(session.get("user_id"))
+        if kamar_id != kamar_penghuni:
+            return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    elif role != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    return respons_sse(channel_kamar(kamar_id))
+
+
+@app.route("/stream/pemilik")
+def stream_pemilik():
+    if session.get("role") != "pemilik":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    return respons_sse(CHANNEL_PEMILIK)
+
+
+### Perintah relay
+# Setiap perubahan relay menjadi dokumen relay_perintah (id + waktu dibuat). Perangkat
+# mengambil perintah lewat long-poll atau SSE lalu mengirim ack berisi status yang
+# benar-benar diterapkan; latensi ujung-ke-ujung dicatat di relay_statistik/{KamarID}.
+RELAY_LONGPOLL_DETIK = int(os.getenv("RELAY_LONGPOLL_DETIK", 25))
+RELAY_SAMPEL_LATENSI = int(os.getenv("RELAY_SAMPEL_LATENSI", 100))
+
+
+def channel_perintah(kamar_id):
+    return f"perintah:{kamar_id}"
+
+
+def format_perintah(perintah_id, data):
+    return {
+        "id": perintah_id,
+        "kamar_id": data.get("KamarID"),
+        "relay1_status": data.get("relay1_status"),
+        "dibuat": data["DibuatPada"].isoformat() if data.get("DibuatPada") else None,
+    }
+
+
+def kirim_perintah_relay(kamar_id, relay1_status, sumber="pemilik"):
+    perintah_ref = db.collection("relay_perintah").document()
+    batch = db.batch()
+    batch.set(
+        perintah_ref,
+        {
+            "KamarID": kamar_id,
+            "relay1_status": relay1_status,
+            "Status": "menunggu",
+            "Sumber": sumber,
+            "DibuatPada": datetime.now(timezone.utc),
+        },
+    )
+    # relay1_status di kamar tetap jadi status yang diinginkan (dibaca UI & perangkat lama)
+    batch.update(db.collection("kamar").document(kamar_id), {"relay1_status": relay1_status})
+    batch.commit()
+    return perintah_ref.id
+
+
+def perintah_menunggu(kamar_id):
+    # Hanya perintah terbaru yang relevan; yang lebih lama akan digantikan saat ack
+    docs = (
+        db.collection("relay_perintah")
+        .where("KamarID", "==", kamar_id)
+        .where("Status", "==", "menunggu")
+        .stream()
+    )
+    perintah = [format_perintah(doc.id, doc.to_dict()) for doc in docs]
+    return sorted(perintah, key=lambda p: p["dibuat"] or "")[-1:]
+
+
+def persentil(nilai, p):
+    # Persentil nearest-rank dari list angka
+    if not nilai:
+        return None
+    urut = sorted(nilai)
+    return urut[max(math.ceil(p / 100 * len(urut)) - 1, 0)]
+
+
+def catat_ack_relay(perintah_id, relay1_aktual):
+    perintah_ref = db.collection("relay_perintah").document(perintah_id)
+
+    @firestore.transactional
+    def _ack(transaction):
+        snapshot = perintah_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        if data.get("Status") != "menunggu":
+            # Ack ganda: kembalikan hasil sebelumnya
+            return data
+
+        statistik_ref = db.collection("relay_statistik").document(data["KamarID"])
+        statistik = statistik_ref.get(transaction=transaction)
+        sampel = (statistik.to_dict() or {}).get("SampelMs", []) if statistik.exists else []
+
+        sekarang = datetime.now(timezone.utc)
+        latensi_ms = max(int((sekarang - data["DibuatPada"]).total_seconds() * 1000), 0)
+        sampel = (sampel + [latensi_ms])[-RELAY_SAMPEL_LATENSI:]
+
+        perubahan = {
+            "Status": "diterapkan",
+            "StatusDiterapkan": relay1_aktual,
+            "DiterapkanPada": sekarang,
+            "LatensiMs": latensi_ms,
+        }
+        transaction.update(perintah_ref, perubahan)
+        transaction.update(
+            db.collection("kamar").document(data["KamarID"]),
+            {"relay1_aktual": relay1_aktual},
+        )
+        transaction.set(
+            statistik_ref,
+            {
+                "KamarID": data["KamarID"],
+                "SampelMs": sampel,
+                "P50Ms": persentil(sampel, 50),
+                "P95Ms": persentil(sampel, 95),
+                "TerakhirMs": latensi_ms,
+                "DiperbaruiPada": sekarang,
+            },
+        )
+        return data | perubahan
+
+    hasil = _ack(db.transaction())
+    if hasil and hasil.get("Status") == "diterapkan":
+        tandai_perintah_digantikan(hasil["KamarID"], hasil.get("DibuatPada"))
+    return hasil
+
+
+def tandai_perintah_digantikan(kamar_id, sebelum):
+    # Perintah lebih lama yang belum sempat di-ack tidak perlu diterapkan lagi
+    if not sebelum:
+        return
+    batch = db.batch()
+    jumlah = 0
+    for doc in (
+        db.collection("relay_perintah")
+        .where("KamarID", "==", kamar_id)
+        .where("Status", "==", "menunggu")
+        .stream()
+    ):
+        if doc.get("DibuatPada") < sebelum:
+            batch.update(doc.reference, {"Status": "digantikan"})
+            jumlah += 1
+    if jumlah:
+        batch.commit()
+
+
+def ambil_statistik_relay():
+    return {
+        doc.id: doc.to_dict() for doc in db.collection("relay_statistik").stream()
+    }
+
+
+@app.route("/api/relay/perintah")
+@api_key_required
+def ambil_perintah_relay():
+    # Long-poll: balas segera jika ada perintah, jika tidak tunggu maksimal `tunggu` detik
+    kamar_id = request.args.get("kamar")
+    if not kamar_id:
+        return jsonify({"status": "error", "message": "Parameter kamar wajib diisi"}), 400
+    tunggu = min(request.args.get("tunggu", RELAY_LONGPOLL_DETIK, type=int), RELAY_LONGPOLL_DETIK)
+
+    pastikan_listener_realtime()
+    channel = channel_perintah(kamar_id)
+    # Subscribe sebelum query agar perintah yang masuk di antaranya tidak terlewat
+    q = realtime_hub.subscribe(channel, replay=False)
+    try:
+        perintah = perintah_menunggu(kamar_id)
+        if not perintah and tunggu > 0:
+            try:
+                perintah = [q.get(timeout=tunggu)[1]]
+            except queue.Empty:
+                perintah = []
+    finally:
+        realtime_hub.unsubscribe(channel, q)
+
+    return jsonify({"status": "success", "perintah": perintah})
+
+
+@app.route("/api/relay/stream")
+@api_key_required
+def stream_perintah_relay():
+    # Alternatif long-poll: perintah baru dikirim sebagai event SSE "perintah".
+    # Perangkat sebaiknya memanggil /api/relay/perintah sekali setelah (re)connect.
+    kamar_id = request.args.get("kamar")
+    if not kamar_id:
+        return jsonify({"status": "error", "message": "Parameter kamar wajib diisi"}), 400
+    return respons_sse(channel_perintah(kamar_id), replay=False)
+
+
+@app.route("/api/relay/ack", methods=["POST"])
+@api_key_required
+def ack_perintah_relay():
+    data = request.get_json(silent=True) or {}
+    perintah_id = data.get("id")
+    relay1_aktual = data.get("relay1_status")
+    if not perintah_id or not isinstance(relay1_aktual, bool):
+        return (
+            jsonify({"status": "error", "message": "id dan relay1_status (boolean) wajib diisi"}),
+            400,
+        )
+
+    hasil = catat_ack_relay(perintah_id, relay1_aktual)
+    if hasil is None:
+        return jsonify({"status": "error", "message": "Perintah tidak ditemukan"}), 404
+    return jsonify(
+        {
+            "status": "success",
+            "id": perintah_id,
+            "hasil": hasil.get("Status"),
+            "latensi_ms": hasil.get("LatensiMs"),
+        }
+    )
+
+
+### Penegakan batas kWh
+# Total kWh bulan berjalan per kamar dihitung di memori (pemakaian.py): callback ingest
+# hanya menampung sampel, job periksa_batas tiap BATAS_INTERVAL_DETIK membaca rollup kamar
+# yang berubah sekaligus, menulis pemakaian_berjalan/{KamarID}_{YYYY-MM} dalam satu batch,
+# dan memakai transaksi hanya saat total melewati ambang (rasio dari BatasKWH).
+BATAS_AMBANG = sorted(float(a) for a in os.getenv("BATAS_AMBANG", "0.8,1.0").split(","))
+BATAS_AUTO_PUTUS = os.getenv("BATAS_AUTO_PUTUS") == "1"
+BATAS_INTERVAL_DETIK = int(os.getenv("BATAS_INTERVAL_DETIK", 30))
+
+pemakaian_berjalan = PemakaianBerjalan()
+
+
+def pemakaian_id(kamar_id, bulan):
+    return f"{kamar_id}_{bulan}"
+
+
+def evaluasi_batas(records):
+    # Berjalan di thread flush ingest: tanpa Firestore, O(1) per sampel
+    pemakaian_berjalan.tambah(records)
+
+
+ingest_buffer.on_flush.append(evaluasi_batas)
+
+
+def periksa_batas():
+    kamar_ids = pemakaian_berjalan.berubah()
+    if not kamar_ids:
+        return 0
+    kamar = {k["id"]: k for k in ambil_semua_kamar()}
+    for kamar_id in [k for k in kamar_ids if k not in kamar]:
+        pemakaian_berjalan.hapus(kamar_id)
+    kamar_ids = [k for k in kamar_ids if k in kamar]
+
+    posisi = {}
+    posisi_refs = [db.collection("rollup_posisi").document(k) for k in kamar_ids]
+    for doc in db.get_all(posisi_refs) if posisi_refs else []:
+        data = doc.to_dict() if doc.exists else None
+        if data and data.get("WattTerakhir") is not None:
+            posisi[doc.id] = (energi.ke_detik(data["TerakhirDiproses"]), data["WattTerakhir"])
+    rollup = defaultdict(dict)
+    rollup_refs = [
+        db.collection("rollup_daya").document(rollup_id(k, bulan))
+        for k in kamar_ids
+        for bulan in pemakaian_berjalan.bulan(k)
+    ]
+    for doc in db.get_all(rollup_refs) if rollup_refs else []:
+        if doc.exists:
+            data = doc.to_dict()
+            rollup[data["KamarID"]][data["Bulan"]] = data.get("TotalKWH", 0.0)
+
+    sekarang = datetime.now(timezone.utc)
+    operasi = []
+    terlewati = []
+    for kamar_id in kamar_ids:
+        kamar_data = kamar[kamar_id]
+        hasil = pemakaian_berjalan.hitung(
+            kamar_id,
+            posisi.get(kamar_id),
+            rollup[kamar_id],
+            gap_maks=energi.gap_maks_kamar(kamar_data),
+        )
+        batas = float(kamar_data.get("BatasKWH") or 0)
+        for bulan, (lama, baru) in hasil.items():
+            operasi.append(
+                (
+                    db.collection("pemakaian_berjalan").document(pemakaian_id(kamar_id, bulan)),
+                    {
+                        "KamarID": kamar_id,
+                        "Bulan": bulan,
+                        # Beberapa worker menulis dokumen yang sama; simpan yang terbesar
+                        "TotalKWH": firestore.Maximum(baru),
+                        "DiperbaruiPada": sekarang,
+                    },
+                )
+            )
+            for ambang in BATAS_AMBANG:
+                if batas and lama < ambang * batas <= baru:
+                    terlewati.append((kamar_id, kamar_data, bulan, ambang, baru, batas))
+
+    for i in range(0, len(operasi), BATAS_OPERASI_BATCH):
+        batch = db.batch()
+        for ref, data in operasi[i : i + BATAS_OPERASI_BATCH]:
+            batch.set(ref, data, merge=True)
+        batch.commit()
+    for args in terlewati:
+        catat_peringatan(*args)
+    return len(operasi)
+
+
+def catat_peringatan(kamar_id, kamar_data, bulan, ambang, kwh, batas):
+    data = {
+        "KamarID": kamar_id,
+        "NomorKamar": kamar_data.get("NomorKamar"),
+        "Bulan": bulan,
+        "Ambang": ambang,
+        "TotalKWH": kwh,
+        "BatasKWH": batas,
+        "DibuatPada": datetime.now(timezone.utc),
+    }
+    peringatan_ref = db.collection("peringatan").document(f"{kamar_id}_{bulan}_{int(ambang * 100)}")
+
+    @firestore.transactional
+    def _catat(transaction):
+        # Satu peringatan per kamar per bulan per ambang, walau beberapa worker melihatnya
+        if peringatan_ref.get(transaction=transaction).exists:
+            return False
+        transaction.create(peringatan_ref, data)
+        return True
+
+    if not _catat(db.transaction()):
+        return
+
+    if REALTIME_SUMBER == "ingest":
+        publish_peringatan(data)
+
+    if BATAS_AUTO_PUTUS and ambang >= 1.0 and relay_menyala(kamar_data.get("relay1_status")):
+        kirim_perintah_relay(kamar_id, False, sumber="batas")
+        invalidasi_kamar()
+
+
+def ambil_pemakaian_berjalan():
+    bulan = datetime.now(timezone.utc).strftime("%Y-%m")
+    docs = db.collection("pemakaian_berjalan").where("Bulan", "==", bulan).stream()
+    return {doc.get("KamarID"): doc.get("TotalKWH") for doc in docs}
+
+
 ### Dummy
 @app.route("/dev/dummydata", methods=["GET"])
 def generate_dummy_data():
@@ -978,11 +3138,12 @@ def generate_dummy_data():
     except ValueError:
         return jsonify({"status": "error", "message": "Format tanggal tidak valid. Gunakan format YYYY-MM-DD"}), 400
 
-    db.collection("data_daya").add({
+    ingest_buffer.submit([{
         "KamarID": kamar_id,
         "JumlahWatt": watt_besar,
         "Timestamp": tanggal,
-    })
+    }])
+    ingest_buffer.flush()
 
     return jsonify({
         "status": "success",
@@ -0,0 +1,87 @@
+# Klien REST Firebase Auth (Identity Toolkit) untuk login email/password.
+# Satu requests.Session dipakai ulang (koneksi keep-alive), dengan timeout dan retry.
+# Untuk pengujian, arahkan ke server stub lewat IDENTITY_TOOLKIT_URL atau ke
+# Firebase Auth Emulator lewat FIREBASE_AUTH_EMULATOR_HOST.
+import logging
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def url_default():
+    emulator = os.getenv("FIREBASE_AUTH_EMULATOR_HOST")
+    if emulator:
+        return f"http://{emulator}/identitytoolkit.googleapis.com/v1"
+    return os.getenv(
+        "IDENTITY_TOOLKIT_URL", "https://identitytoolkit.googleapis.com/v1"
+    )
+
+
+class AuthTidakTersedia(Exception):
+    """Identity Toolkit tidak bisa dihubungi setelah semua percobaan."""
+
+
+class AuthClient:
+    # Status HTTP yang layak dicoba ulang
+    STATUS_RETRY = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        timeout=None,
+        retries=None,
+        backoff=0.2,
+        pool_size=None,
+    ):
+        self.api_key = api_key or os.getenv("FIREBASE_API_KEY")
+        self.base_url = (base_url or url_default()).rstrip("/")
+        # (connect, read) detik
+        self.timeout = timeout or (
+            float(os.getenv("AUTH_CONNECT_TIMEOUT", 3)),
+            float(os.getenv("AUTH_READ_TIMEOUT", 10)),
+        )
+        self.retries = int(os.getenv("AUTH_RETRY", 2) if retries is None else retries)
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=int(pool_size or os.getenv("AUTH_POOL_SIZE", 20)),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _post(self, path, payload):
+        url = f"{self.base_url}/{path}"
+        for percobaan in range(self.retries + 1):
+            try:
+                res = self.session.post(
+                    url, params={"key": self.api_key}, json=payload, timeout=self.timeout
+                )
+                if res.status_code not in self.STATUS_RETRY:
+                    return res
+                logger.warning("Identity Toolkit membalas %s", res.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.warning("Identity Toolkit gagal dihubungi: %s", e)
+            if percobaan < self.retries:
+                # Exponential backoff dengan full jitter
+                time.sleep(random.uniform(0, self.backoff * 2**percobaan))
+        raise AuthTidakTersedia()
+
+    def sign_in(self, email, password):
+        # Kembalikan data akun (localId, idToken, ...) atau None jika email/password salah
+        res = self._post(
+            "accounts:signInWithPassword",
+            {"email": email, "password": password, "returnSecureToken": True},
+        )
+        if res.status_code == 200:
+            return res.json()
+        if res.status_code == 400:
+            return None
+        raise AuthTidakTersedia()
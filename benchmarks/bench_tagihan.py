@@ -0,0 +1,179 @@
+# Benchmark billing_engine dengan data sintetis (satu sampel per 3 detik per kamar).
+# Dijalankan dari root repo:
+#
+#   python -m benchmarks.bench_tagihan                       # 10 kamar x 1 bulan
+#   python -m benchmarks.bench_tagihan --penuh               # 10/100/1000 kamar x 1/3/12 bulan
+#   python -m benchmarks.bench_tagihan --kamar 10 --bulan 3 --json hasil.json
+#
+# Data dibuat per kamar per hari dan langsung dikonsumsi, jadi memori puncak
+# mencerminkan engine, bukan ukuran dataset. Catatan: grid --penuh sampai 1000 kamar x
+# 12 bulan (~10,5 miliar sampel) butuh numpy dan berjam-jam; default-nya grid kecil.
+import argparse
+import json
+import math
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import billing_engine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+AWAL = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DETIK_PER_HARI = 86400
+
+
+def jumlah_hari(bulan):
+    tahun, sisa = divmod(AWAL.month - 1 + bulan, 12)
+    akhir = AWAL.replace(year=AWAL.year + tahun, month=sisa + 1)
+    return (akhir - AWAL).days
+
+
+def buat_kamar(jumlah):
+    acak = random.Random(1)
+    return {
+        f"kamar{i:04d}": {
+            "NomorKamar": str(i + 1),
+            "BatasKWH": acak.choice([30, 50, 75, 100]),
+            "TarifPerKWH": acak.choice([1400, 1444.7, 1699.5]),
+        }
+        for i in range(jumlah)
+    }
+
+
+def data_sintetis(kamar, bulan, interval=3, seed=0):
+    # Yield potongan (KamarID, detik, watt) satu hari per kamar: beban dasar + pola
+    # harian + noise, dengan satu celah data (meter mati) sesekali
+    per_hari = DETIK_PER_HARI // interval
+    awal = AWAL.timestamp()
+    ids = sorted(kamar)
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        offset = np.arange(per_hari, dtype=np.float64) * interval
+        pola = 1 + 0.6 * np.sin(2 * np.pi * offset / DETIK_PER_HARI)
+    else:
+        rng = random.Random(seed)
+
+    for hari in range(jumlah_hari(bulan)):
+        mulai = awal + hari * DETIK_PER_HARI
+        for i, kamar_id in enumerate(ids):
+            dasar = 60 + (i % 7) * 25
+            if np is not None:
+                detik = mulai + offset
+                watt = dasar * pola + rng.normal(0, 10, per_hari).clip(-dasar, None)
+                if rng.random() < 0.05:
+                    potong = rng.integers(0, per_hari - 600)
+                    keep = np.ones(per_hari, dtype=bool)
+                    keep[potong : potong + 600] = False
+                    detik, watt = detik[keep], watt[keep]
+            else:
+                detik = [mulai + j * interval for j in range(per_hari)]
+                watt = [
+                    dasar * (1 + 0.6 * math.sin(2 * math.pi * j * interval / DETIK_PER_HARI))
+                    + rng.gauss(0, 10)
+                    for j in range(per_hari)
+                ]
+            yield kamar_id, detik, watt
+
+
+class Stopwatch:
+    # Bungkus iterator dan hitung waktu yang dihabiskan untuk membuat item
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.detik = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        mulai = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.detik += time.perf_counter() - mulai
+
+
+def jalankan(jumlah_kamar, bulan, interval=3, ukur_memori=True):
+    kamar = buat_kamar(jumlah_kamar)
+    sumber = Stopwatch(data_sintetis(kamar, bulan, interval))
+    statistik = {}
+
+    if ukur_memori:
+        tracemalloc.start()
+    mulai = time.perf_counter()
+    billing_engine.jalankan(sumber, kamar, statistik=statistik)
+    total = time.perf_counter() - mulai
+    puncak = 0
+    if ukur_memori:
+        puncak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    engine = statistik["integrasi_detik"] + statistik["tagihan_detik"]
+    return {
+        "kamar": jumlah_kamar,
+        "bulan": bulan,
+        "sampel": statistik["sampel"],
+        "tagihan": statistik["tagihan"],
+        "generate_detik": sumber.detik,
+        "integrasi_detik": statistik["integrasi_detik"],
+        "tagihan_detik": statistik["tagihan_detik"],
+        "total_detik": total,
+        "sampel_per_detik": statistik["sampel"] / engine if engine else 0.0,
+        "memori_puncak_mb": puncak / 2**20,
+    }
+
+
+def daftar_angka(teks):
+    return [int(x) for x in teks.split(",") if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark billing_engine")
+    parser.add_argument("--kamar", help="daftar jumlah kamar (default 10)")
+    parser.add_argument("--bulan", help="daftar jumlah bulan (default 1)")
+    parser.add_argument(
+        "--penuh",
+        action="store_true",
+        help="grid besar 10,100,1000 kamar x 1,3,12 bulan (lama, butuh numpy)",
+    )
+    parser.add_argument("--interval", type=int, default=3, help="detik antar sampel")
+    parser.add_argument(
+        "--tanpa-memori",
+        action="store_true",
+        help="matikan tracemalloc (lebih cepat, memori puncak tidak diukur)",
+    )
+    parser.add_argument("--json", help="simpan hasil ke file JSON")
+    args = parser.parse_args()
+    kamar_grid = args.kamar or ("10,100,1000" if args.penuh else "10")
+    bulan_grid = args.bulan or ("1,3,12" if args.penuh else "1")
+
+    print(f"numpy: {'ya' if np is not None else 'tidak (jalur Python murni)'}")
+    header = (
+        f"{'kamar':>6} {'bulan':>5} {'sampel':>14} {'tagihan':>8} {'generate s':>11} "
+        f"{'integrasi s':>12} {'tagihan s':>10} {'total s':>9} {'sampel/s':>13} {'puncak MB':>10}"
+    )
+    print(header)
+    hasil = []
+    for jumlah_kamar in daftar_angka(kamar_grid):
+        for bulan in daftar_angka(bulan_grid):
+            r = jalankan(jumlah_kamar, bulan, args.interval, not args.tanpa_memori)
+            hasil.append(r)
+            print(
+                f"{r['kamar']:>6} {r['bulan']:>5} {r['sampel']:>14,} {r['tagihan']:>8} "
+                f"{r['generate_detik']:>11.2f} {r['integrasi_detik']:>12.2f} "
+                f"{r['tagihan_detik']:>10.4f} {r['total_detik']:>9.2f} "
+                f"{r['sampel_per_detik']:>13,.0f} {r['memori_puncak_mb']:>10.1f}",
+                flush=True,
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(hasil, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
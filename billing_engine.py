@@ -0,0 +1,131 @@
+# Perhitungan tagihan tanpa Firestore: data daya + konfigurasi kamar -> daftar tagihan.
+# Dipakai oleh buat_tagihan_kamar() di app.py, CLI hitung_tagihan.py, dan benchmarks/.
+#
+# Data daya diterima sebagai potongan (KamarID, detik[], watt[]) yang terurut waktu per
+# kamar; potongan antar kamar boleh berselang-seling. Setiap potongan langsung
+# diintegrasikan lalu dibuang, jadi memori tidak bergantung pada jumlah sampel.
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import energi
+
+TARIF_DEFAULT = 1400
+STATUS_BARU = "Belum Dibayar"
+SAMPEL_PER_POTONGAN = 10000
+
+
+def potong(readings, ukuran=SAMPEL_PER_POTONGAN):
+    # (KamarID, detik, watt) satu per satu -> potongan (KamarID, [detik], [watt])
+    buffer = defaultdict(lambda: ([], []))
+    for kamar_id, detik, watt in readings:
+        waktu, daya = buffer[kamar_id]
+        waktu.append(detik)
+        daya.append(watt)
+        if len(waktu) >= ukuran:
+            yield kamar_id, waktu, daya
+            del buffer[kamar_id]
+    for kamar_id, (waktu, daya) in buffer.items():
+        yield kamar_id, waktu, daya
+
+
+class Integrator:
+    # Akumulasi kWh per kamar per bulan dari potongan yang datang bertahap
+    def __init__(self, kamar):
+        self.kamar = kamar
+        self.pemakaian = defaultdict(lambda: defaultdict(float))  # kamar -> bulan -> kWh
+        self.sampel = 0
+        self._terakhir = {}  # kamar -> (detik, watt) sampel terakhir yang sudah dihitung
+
+    def tambah(self, kamar_id, detik, watt):
+        if len(detik) == 0:
+            return
+        hasil = energi.kwh_per_bulan(
+            detik,
+            watt,
+            gap_maks=energi.gap_maks_kamar(self.kamar.get(kamar_id)),
+            sebelum=self._terakhir.get(kamar_id),
+        )
+        per_bulan = self.pemakaian[kamar_id]
+        for bulan, t in hasil.items():
+            per_bulan[bulan] += t["kwh"]
+            self.sampel += t["sampel"]
+        self._terakhir[kamar_id] = (float(detik[-1]), float(watt[-1]))
+
+    def hasil(self):
+        return {k: dict(v) for k, v in self.pemakaian.items()}
+
+
+def hitung_tagihan(total_kwh, batas_kwh, tarif):
+    # (JumlahKWH kelebihan, TotalTagihan) atau None jika tidak ada yang ditagih
+    total_kwh = round(total_kwh, 3)
+    if total_kwh <= batas_kwh:
+        return None
+    kelebihan = round(total_kwh - batas_kwh, 3)
+    total_tagihan = round(kelebihan * tarif, 2)
+    if total_tagihan <= 0:
+        return None
+    return kelebihan, total_tagihan
+
+
+def bulan_berjalan(sekarang=None):
+    # Bulan "YYYY-MM" yang belum selesai sehingga belum boleh ditagih. Memakai UTC,
+    # sama dengan kunci bulan rollup (energi.kwh_per_bulan).
+    sekarang = sekarang or datetime.now(timezone.utc)
+    return sekarang.astimezone(timezone.utc).strftime("%Y-%m")
+
+
+def buat_tagihan(pemakaian, kamar, sudah_tertagih=None, sebelum_bulan=None):
+    # pemakaian: {KamarID: {bulan: kWh}}; kamar: {KamarID: data kamar}
+    # sudah_tertagih: {KamarID: set(bulan)} yang dilewati; sebelum_bulan: hanya tagih
+    # bulan < "YYYY-MM" ini (bulan berjalan belum selesai). Hasil urut (KamarID, Bulan).
+    sudah_tertagih = sudah_tertagih or {}
+    tagihan = []
+    for kamar_id in sorted(pemakaian):
+        kamar_data = kamar.get(kamar_id) or {}
+        batas_kwh = kamar_data.get("BatasKWH", 0) or 0
+        tarif = kamar_data.get("TarifPerKWH", TARIF_DEFAULT)
+        lewati = sudah_tertagih.get(kamar_id, ())
+        for bulan in sorted(pemakaian[kamar_id]):
+            if bulan in lewati or (sebelum_bulan and bulan >= sebelum_bulan):
+                continue
+            hasil = hitung_tagihan(pemakaian[kamar_id][bulan], batas_kwh, tarif)
+            if hasil is None:
+                continue
+            tagihan.append(
+                {
+                    "KamarID": kamar_id,
+                    "Bulan": bulan,
+                    "JumlahKWH": hasil[0],
+                    "TotalTagihan": hasil[1],
+                    "StatusPembayaran": STATUS_BARU,
+                }
+            )
+    return tagihan
+
+
+def jalankan(potongan, kamar, sudah_tertagih=None, statistik=None, sebelum_bulan=None):
+    # Integrasi semua potongan lalu terapkan aturan tagihan.
+    # `statistik` (dict, opsional) diisi jumlah sampel dan waktu per tahap (detik).
+    integrator = Integrator(kamar)
+    waktu_integrasi = 0.0
+    for kamar_id, detik, watt in potongan:
+        mulai = time.perf_counter()
+        integrator.tambah(kamar_id, detik, watt)
+        waktu_integrasi += time.perf_counter() - mulai
+
+    mulai = time.perf_counter()
+    tagihan = buat_tagihan(integrator.hasil(), kamar, sudah_tertagih, sebelum_bulan)
+    waktu_tagihan = time.perf_counter() - mulai
+
+    if statistik is not None:
+        statistik.update(
+            {
+                "sampel": integrator.sampel,
+                "kamar": len(integrator.pemakaian),
+                "tagihan": len(tagihan),
+                "integrasi_detik": waktu_integrasi,
+                "tagihan_detik": waktu_tagihan,
+            }
+        )
+    return tagihan
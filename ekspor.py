@@ -0,0 +1,98 @@
+# Serialisasi baris (dict) menjadi potongan bytes CSV atau Parquet untuk response
+# streaming. Baris dibaca dari generator sedikit demi sedikit, jadi memori tetap datar
+# berapa pun jumlah datanya.
+import csv
+import io
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow opsional, hanya untuk format parquet
+    pa = None
+
+BARIS_PER_POTONGAN = 1000
+
+# Kolom ekspor: list (nama, tipe) dengan tipe "teks", "angka", "bulat", atau "waktu"
+TIPE_PARQUET = {
+    "teks": lambda: pa.string(),
+    "angka": lambda: pa.float64(),
+    "bulat": lambda: pa.int64(),
+    "waktu": lambda: pa.timestamp("us", tz="UTC"),
+}
+
+
+class FormatTidakTersedia(Exception):
+    """Format ekspor membutuhkan library yang tidak terpasang."""
+
+
+def _nilai_csv(nilai):
+    if isinstance(nilai, datetime):
+        if nilai.tzinfo is None:
+            nilai = nilai.replace(tzinfo=timezone.utc)
+        return nilai.isoformat()
+    return "" if nilai is None else nilai
+
+
+def stream_csv(rows, kolom):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([nama for nama, _ in kolom])
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_nilai_csv(row.get(nama)) for nama, _ in kolom])
+        if i % BARIS_PER_POTONGAN == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class _Penampung(io.RawIOBase):
+    # File tujuan ParquetWriter yang isinya diambil (dan dikosongkan) setiap row group
+    def __init__(self):
+        self._potongan = []
+        self._posisi = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._potongan.append(bytes(data))
+        self._posisi += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._posisi
+
+    def ambil(self):
+        data = b"".join(self._potongan)
+        self._potongan = []
+        return data
+
+
+def stream_parquet(rows, kolom):
+    if pa is None:
+        raise FormatTidakTersedia("Format parquet membutuhkan pyarrow")
+    return _stream_parquet(rows, kolom)
+
+
+def _stream_parquet(rows, kolom):
+    schema = pa.schema([(nama, TIPE_PARQUET[tipe]()) for nama, tipe in kolom])
+    penampung = _Penampung()
+    writer = pq.ParquetWriter(penampung, schema)
+    potongan = []
+
+    def tulis():
+        # Satu row group per potongan
+        writer.write_table(pa.Table.from_pylist(potongan, schema=schema))
+
+    for row in rows:
+        potongan.append(row)
+        if len(potongan) >= BARIS_PER_POTONGAN:
+            tulis()
+            potongan = []
+            yield penampung.ambil()
+    if potongan:
+        tulis()
+    writer.close()
+    yield penampung.ambil()
@@ -0,0 +1,104 @@
+# Konversi daya (watt) ke energi (kWh) untuk seluruh aplikasi.
+# Semua route, rollup, dan tagihan memakai fungsi di sini agar angka kWh selalu sama.
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # numpy opsional, ada jalur Python murni
+    np = None
+
+# Selisih waktu maksimum antar sampel yang diintegrasikan (meter mati / data hilang),
+# bisa di-override per kamar lewat field GapMaksDetik
+GAP_MAKS_DETIK = float(os.getenv("DAYA_GAP_MAKS_DETIK", 60))
+
+JOULE_PER_KWH = 3_600_000
+
+
+def gap_maks_kamar(kamar_data=None):
+    return float((kamar_data or {}).get("GapMaksDetik") or GAP_MAKS_DETIK)
+
+
+def ke_detik(ts):
+    # datetime -> epoch detik; datetime tanpa zona waktu dianggap UTC (sama seperti Firestore)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def integrasi_kwh(detik, watt, gap_maks=None):
+    # Integrasi trapesium atas sampel terurut waktu; selisih waktu dibatasi gap_maks
+    gap_maks = gap_maks or GAP_MAKS_DETIK
+    if np is not None:
+        t = np.asarray(detik, dtype=np.float64)
+        w = np.asarray(watt, dtype=np.float64)
+        if t.size < 2:
+            return 0.0
+        dt = np.clip(np.diff(t), 0, gap_maks)
+        return float(np.dot((w[1:] + w[:-1]) * 0.5, dt) / JOULE_PER_KWH)
+
+    total = 0.0
+    for i in range(1, len(detik)):
+        dt = min(max(detik[i] - detik[i - 1], 0), gap_maks)
+        total += (watt[i] + watt[i - 1]) * 0.5 * dt
+    return total / JOULE_PER_KWH
+
+
+def kwh_per_segmen(detik, watt, gap_maks=None, sebelum=None):
+    # kWh segmen yang berakhir di setiap sampel (rumus sama dengan integrasi_kwh).
+    # Sampel pertama bernilai 0 kecuali ada `sebelum` = (detik, watt) sampel sebelumnya.
+    gap_maks = gap_maks or GAP_MAKS_DETIK
+    hasil = []
+    prev = sebelum
+    for t, w in zip(detik, watt):
+        kwh = 0.0
+        if prev is not None:
+            dt = min(max(t - prev[0], 0), gap_maks)
+            kwh = (w + prev[1]) * 0.5 * dt / JOULE_PER_KWH
+        hasil.append(kwh)
+        prev = (t, w)
+    return hasil
+
+
+def kwh_per_bulan(detik, watt, gap_maks=None, sebelum=None):
+    # Integrasi per bulan UTC ("YYYY-MM") untuk sampel terurut waktu.
+    # `sebelum` = (detik, watt) sampel terakhir yang sudah dihitung sebelumnya, supaya
+    # segmen antara dua pemanggilan tetap ikut terhitung (masuk bulan sampel yang baru).
+    # Hasil: {bulan: {"kwh": float, "sampel": int}}
+    gap_maks = gap_maks or GAP_MAKS_DETIK
+    hasil = defaultdict(lambda: {"kwh": 0.0, "sampel": 0})
+    if len(detik) == 0:
+        return {}
+
+    if np is not None:
+        t = np.asarray(detik, dtype=np.float64)
+        w = np.asarray(watt, dtype=np.float64)
+        detik_bulat = np.floor(t).astype(np.int64)
+        bulan = detik_bulat.astype("datetime64[s]").astype("datetime64[M]")
+        keys, inv = np.unique(bulan, return_inverse=True)
+        sampel = np.bincount(inv, minlength=keys.size)
+
+        if sebelum is not None:
+            t_seg = np.concatenate(([sebelum[0]], t))
+            w_seg = np.concatenate(([sebelum[1]], w))
+            inv_seg = inv
+        else:
+            t_seg, w_seg, inv_seg = t, w, inv[1:]
+        dt = np.clip(np.diff(t_seg), 0, gap_maks)
+        energi = (w_seg[1:] + w_seg[:-1]) * 0.5 * dt / JOULE_PER_KWH
+        kwh = np.bincount(inv_seg, weights=energi, minlength=keys.size)
+
+        for key, k, n in zip(keys.astype(str), kwh, sampel):
+            hasil[key] = {"kwh": float(k), "sampel": int(n)}
+        return dict(hasil)
+
+    prev = sebelum
+    for t, w in zip(detik, watt):
+        key = datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m")
+        hasil[key]["sampel"] += 1
+        if prev is not None:
+            dt = min(max(t - prev[0], 0), gap_maks)
+            hasil[key]["kwh"] += (w + prev[1]) * 0.5 * dt / JOULE_PER_KWH
+        prev = (t, w)
+    return dict(hasil)
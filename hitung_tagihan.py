@@ -0,0 +1,149 @@
+# Hitung tagihan secara offline dengan billing_engine, tanpa menulis apa pun.
+# Hasilnya deterministik (urut KamarID, Bulan), jadi bisa dibandingkan antar versi.
+#
+#   # dari file lokal: kamar.json ({KamarID: {...}} atau list dengan "id") + CSV daya
+#   # (kolom KamarID, Timestamp ISO/epoch, JumlahWatt; mis. hasil /pemilik/ekspor/daya)
+#   python hitung_tagihan.py --kamar kamar.json --data daya.csv --urutkan
+#
+#   # dari Firestore emulator (FIRESTORE_EMULATOR_HOST=localhost:8080) atau project asli
+#   python hitung_tagihan.py --firestore --project sistemdaya
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import billing_engine
+import energi
+
+KOLOM_OUTPUT = ["KamarID", "Bulan", "JumlahKWH", "TotalTagihan", "StatusPembayaran"]
+
+
+def ke_detik(nilai):
+    try:
+        return float(nilai)
+    except ValueError:
+        return energi.ke_detik(datetime.fromisoformat(nilai))
+
+
+def baca_kamar_file(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return {k["id"]: k for k in data}
+    return data
+
+
+def baca_data_file(path, urutkan=False):
+    # Yield (KamarID, detik, watt); --urutkan memuat semua baris ke memori lalu
+    # mengurutkannya (untuk file yang urut terbaru-dulu seperti hasil ekspor)
+    with open(path, newline="") as f:
+        rows = (
+            (r["KamarID"], ke_detik(r["Timestamp"]), float(r["JumlahWatt"] or 0))
+            for r in csv.DictReader(f)
+        )
+        if urutkan:
+            rows = sorted(rows, key=lambda r: (r[0], r[1]))
+        yield from rows
+
+
+def buat_client(project):
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # Emulator tidak butuh kredensial
+        from google.cloud import firestore
+
+        return firestore.Client(project=project)
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    firebase_admin.initialize_app(
+        credentials.Certificate(os.getenv("CREDENTIALS", "firebase-auth.json"))
+    )
+    return firestore.client()
+
+
+def baca_kamar_firestore(db):
+    return {doc.id: doc.to_dict() for doc in db.collection("kamar").stream()}
+
+
+def baca_data_firestore(db, kamar, format_daya):
+    # Yield (KamarID, detik, watt), per kamar urut waktu
+    import timeseries  # butuh firebase_admin, jadi hanya diimpor untuk sumber Firestore
+
+    for kamar_id in sorted(kamar):
+        if format_daya == "bucket":
+            for ms, _, watt in timeseries.iter_sampel(db, kamar_id):
+                yield kamar_id, ms / 1000, watt
+            continue
+        query = (
+            db.collection("data_daya")
+            .where("KamarID", "==", kamar_id)
+            .order_by("Timestamp")
+            .select(["Timestamp", "JumlahWatt"])
+        )
+        for doc in query.stream():
+            data = doc.to_dict()
+            yield kamar_id, energi.ke_detik(data["Timestamp"]), float(data.get("JumlahWatt") or 0)
+
+
+def tulis_output(tagihan, path, format_):
+    f = open(path, "w", newline="") if path else sys.stdout
+    try:
+        if format_ == "json":
+            json.dump(tagihan, f, indent=2)
+            f.write("\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=KOLOM_OUTPUT)
+            writer.writeheader()
+            writer.writerows(tagihan)
+    finally:
+        if path:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hitung tagihan offline dari data daya")
+    sumber = parser.add_mutually_exclusive_group(required=True)
+    sumber.add_argument("--data", help="CSV data daya (KamarID, Timestamp, JumlahWatt)")
+    sumber.add_argument("--firestore", action="store_true", help="baca dari Firestore/emulator")
+    parser.add_argument("--kamar", help="JSON konfigurasi kamar (wajib dengan --data)")
+    parser.add_argument("--urutkan", action="store_true", help="urutkan CSV di memori dulu")
+    parser.add_argument("--project", default="sistemdaya")
+    parser.add_argument("--format-daya", default=os.getenv("DAYA_FORMAT", "sampel"))
+    parser.add_argument("--bulan", help="hanya tampilkan tagihan bulan YYYY-MM")
+    parser.add_argument("--output", help="file hasil (default stdout)")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    args = parser.parse_args()
+
+    mulai = time.perf_counter()
+    if args.firestore:
+        db = buat_client(args.project)
+        kamar = baca_kamar_firestore(db)
+        readings = baca_data_firestore(db, kamar, args.format_daya)
+    else:
+        if not args.kamar:
+            parser.error("--kamar wajib diisi jika memakai --data")
+        kamar = baca_kamar_file(args.kamar)
+        readings = baca_data_file(args.data, args.urutkan)
+
+    statistik = {}
+    tagihan = billing_engine.jalankan(
+        billing_engine.potong(readings), kamar, statistik=statistik
+    )
+    if args.bulan:
+        tagihan = [t for t in tagihan if t["Bulan"] == args.bulan]
+    tulis_output(tagihan, args.output, args.format)
+
+    statistik["total_detik"] = time.perf_counter() - mulai
+    print(
+        "{sampel} sampel, {kamar} kamar, {tagihan} tagihan; integrasi {integrasi_detik:.3f} s, "
+        "aturan tagihan {tagihan_detik:.3f} s, total {total_detik:.3f} s".format(**statistik),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# Hitung ulang rollup_daya dan daya_ringkas (menit/jam/hari) dari data daya mentah,
+# mis. untuk data lama sebelum ringkasan ditulis oleh rollup atau setelah batas bucket
+# berubah. Memegang lease rollup selama berjalan, jadi job rollup/tagihan menunggu.
+#
+#   python hitung_ulang_ringkasan.py                  # semua kamar
+#   python hitung_ulang_ringkasan.py --kamar id1 id2  # kamar tertentu saja
+import argparse
+import sys
+
+import app as aplikasi
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hitung ulang rollup_daya dan daya_ringkas dari data mentah"
+    )
+    parser.add_argument("--kamar", nargs="*", help="KamarID (default semua kamar)")
+    parser.add_argument(
+        "--lease-detik",
+        type=int,
+        default=6 * 3600,
+        help="lama lease rollup dipegang (default 6 jam)",
+    )
+    args = parser.parse_args()
+
+    token = aplikasi.ambil_lease(aplikasi.LEASE_ROLLUP, durasi=args.lease_detik)
+    if token is None:
+        sys.exit("Job rollup/tagihan sedang berjalan, coba lagi nanti")
+    try:
+        aplikasi.hitung_ulang_rollup(args.kamar)
+    finally:
+        aplikasi.lepas_lease(aplikasi.LEASE_ROLLUP, token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Penampung data daya dari meter sebelum ditulis ke Firestore.
+# Data dikumpulkan di memori lalu ditulis dengan batch write (maks 500 operasi
+# per batch) setiap `flush_interval` detik atau saat sudah `flush_size` data.
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+BATAS_OPERASI_BATCH = 500
+# Selisih jam meter yang masih diterima untuk timestamp di masa depan. Sampel yang lebih
+# jauh ditolak: satu sampel masa depan akan memajukan posisi rollup dan membuat semua
+# data asli sesudahnya tidak pernah ikut tertagih.
+TOLERANSI_MASA_DEPAN_DETIK = float(os.getenv("INGEST_TOLERANSI_MASA_DEPAN_DETIK", 300))
+
+logger = logging.getLogger(__name__)
+
+
+class BufferPenuh(Exception):
+    """Buffer sudah mencapai kapasitas, pengirim harus mencoba lagi nanti."""
+
+
+def parse_timestamp(value, sekarang=None, toleransi=None):
+    # Terima ISO 8601 atau epoch (detik / milidetik); tanpa zona waktu dianggap UTC
+    sekarang = sekarang or datetime.now(timezone.utc)
+    if value in (None, ""):
+        return sekarang
+    if isinstance(value, bool):
+        raise ValueError("Timestamp tidak valid")
+    if isinstance(value, (int, float)):
+        if value > 1e11:
+            value = value / 1000
+        ts = datetime.fromtimestamp(value, timezone.utc)
+    else:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+    toleransi = TOLERANSI_MASA_DEPAN_DETIK if toleransi is None else toleransi
+    if ts > sekarang + timedelta(seconds=toleransi):
+        raise ValueError("Timestamp berada di masa depan")
+    return ts
+
+
+def parse_data_daya(item, sekarang=None):
+    kamar_id = item.get("KamarID")
+    watt = item.get("JumlahWatt")
+    if not isinstance(kamar_id, str) or not kamar_id:
+        raise ValueError("KamarID wajib diisi")
+    if isinstance(watt, bool) or not isinstance(watt, (int, float)) or watt < 0:
+        raise ValueError("JumlahWatt harus angka >= 0")
+    return {
+        "KamarID": kamar_id,
+        "JumlahWatt": watt,
+        "Timestamp": parse_timestamp(item.get("Timestamp"), sekarang),
+    }
+
+
+class IngestBuffer:
+    def __init__(
+        self,
+        db,
+        collection="data_daya",
+        flush_size=BATAS_OPERASI_BATCH,
+        flush_interval=2.0,
+        max_pending=20000,
+        writer=None,
+    ):
+        self.db = db
+        self.collection = collection
+        # Fungsi penulis alternatif, mis. untuk format bucket; default satu dokumen per data
+        self.writer = writer
+        self.flush_size = max(1, min(int(flush_size), BATAS_OPERASI_BATCH))
+        self.flush_interval = float(flush_interval)
+        self.max_pending = int(max_pending)
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._ada_data = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._berhenti = False
+
+        # Callback dipanggil dengan list data setelah batch berhasil ditulis
+        self.on_flush = []
+
+        self.total_diterima = 0
+        self.total_ditulis = 0
+        self.total_ditolak = 0
+
+    def sisa_kapasitas(self):
+        with self._lock:
+            return self.max_pending - len(self._pending)
+
+    def submit(self, records):
+        # Semua atau tidak sama sekali, supaya pengirim bisa mengulang satu request utuh
+        with self._lock:
+            if len(self._pending) + len(records) > self.max_pending:
+                self.total_ditolak += len(records)
+                raise BufferPenuh()
+            self._pending.extend(records)
+            self.total_diterima += len(records)
+            jumlah = len(self._pending)
+
+        self._pastikan_thread()
+        if jumlah >= self.flush_size:
+            self._ada_data.set()
+        return len(records)
+
+    def flush(self):
+        # Tulis semua data yang tertunda, satu batch per 500 data
+        ditulis = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    chunk = [
+                        self._pending.popleft()
+                        for _ in range(min(self.flush_size, len(self._pending)))
+                    ]
+
+                try:
+                    self._tulis_batch(chunk)
+                except Exception:
+                    logger.exception("Gagal menulis %d data daya", len(chunk))
+                    # Kembalikan ke depan antrean agar dicoba lagi pada flush berikutnya
+                    with self._lock:
+                        self._pending.extendleft(reversed(chunk))
+                    break
+
+                ditulis += len(chunk)
+                self.total_ditulis += len(chunk)
+                for callback in self.on_flush:
+                    try:
+                        callback(chunk)
+                    except Exception:
+                        logger.exception("Callback flush gagal")
+        return ditulis
+
+    def _tulis_batch(self, chunk):
+        if self.writer:
+            self.writer(chunk)
+            return
+        col = self.db.collection(self.collection)
+        batch = self.db.batch()
+        for data in chunk:
+            batch.set(col.document(), data)
+        batch.commit()
+
+    def _pastikan_thread(self):
+        # Thread dibuat saat data pertama masuk (aman untuk worker gunicorn hasil fork)
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._loop, name="ingest-flush", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _loop(self):
+        while not self._berhenti:
+            self._ada_data.wait(self.flush_interval)
+            self._ada_data.clear()
+            self.flush()
+
+    def stop(self):
+        self._berhenti = True
+        self._ada_data.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "max_pending": self.max_pending,
+            "diterima": self.total_diterima,
+            "ditulis": self.total_ditulis,
+            "ditolak": self.total_ditolak,
+        }
@@ -0,0 +1,34 @@
+# Migrasi satu kali: ubah dokumen data_daya per-sampel menjadi bucket per kamar per jam
+# (data_daya_bucket). Aman dijalankan ulang; sampel dengan timestamp sama tidak dobel.
+#
+#   python migrasi_data_daya.py            # salin ke bucket, data lama tetap ada
+#   python migrasi_data_daya.py --hapus    # salin lalu hapus dokumen per-sampel
+#
+# Setelah migrasi, set DAYA_FORMAT=bucket di .env.
+import argparse
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+import timeseries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrasi data_daya per-sampel ke data_daya_bucket"
+    )
+    parser.add_argument(
+        "--hapus",
+        action="store_true",
+        help="hapus dokumen data_daya setelah bucket-nya tersimpan",
+    )
+    parser.add_argument("--credentials", default="firebase-auth.json")
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    db = firestore.client()
+    timeseries.migrasi(db, hapus=args.hapus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Total kWh bulan berjalan per kamar untuk penegakan batas, dihitung di memori proses.
+#
+# Callback ingest hanya menampung sampel (O(1) per sampel, tanpa Firestore). Job
+# periodik lalu menghitung total per kamar per bulan = total rollup bulan itu + integrasi
+# sampel yang belum di-rollup (sesudah rollup_posisi), dengan rumus yang sama dengan
+# rollup/tagihan. Sampel yang sudah masuk rollup dibuang, jadi memori tetap kecil.
+#
+# Dengan beberapa worker, tiap worker hanya melihat sebagian sampel; karena selisih waktu
+# antar sampelnya tetap di bawah gap_maks, hasil integrasinya tetap mendekati total.
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import energi
+
+MAKS_SAMPEL_KAMAR = 20000  # batas sampel per kamar jika rollup lama tidak berjalan
+
+
+def bulan_dari_detik(detik):
+    return datetime.fromtimestamp(detik, timezone.utc).strftime("%Y-%m")
+
+
+class PemakaianBerjalan:
+    def __init__(self, maks_sampel=MAKS_SAMPEL_KAMAR):
+        self.maks_sampel = maks_sampel
+        self._sampel = defaultdict(list)  # kamar -> [(detik, watt)], belum tentu urut
+        self._berubah = set()  # kamar yang punya sampel baru sejak dihitung
+        self._total = {}  # kamar -> {bulan: kWh terakhir yang dievaluasi}
+        self._lock = threading.Lock()
+
+    def tambah(self, records):
+        # Dipanggil dari thread flush ingest: hanya menampung
+        with self._lock:
+            for r in records:
+                sampel = self._sampel[r["KamarID"]]
+                sampel.append((energi.ke_detik(r["Timestamp"]), float(r["JumlahWatt"])))
+                if len(sampel) > self.maks_sampel:
+                    del sampel[: len(sampel) - self.maks_sampel]
+                self._berubah.add(r["KamarID"])
+
+    def berubah(self):
+        # Kamar dengan sampel baru sejak pemanggilan terakhir
+        with self._lock:
+            kamar, self._berubah = self._berubah, set()
+        return sorted(kamar)
+
+    def bulan(self, kamar_id):
+        with self._lock:
+            return sorted({bulan_dari_detik(t) for t, _ in self._sampel.get(kamar_id, ())})
+
+    def hapus(self, kamar_id):
+        with self._lock:
+            self._sampel.pop(kamar_id, None)
+            self._total.pop(kamar_id, None)
+
+    def hitung(self, kamar_id, posisi=None, rollup=None, gap_maks=None):
+        # posisi: (detik, watt) sampel terakhir yang sudah di-rollup, atau None
+        # rollup: {bulan: TotalKWH rollup}. Hasil: {bulan: (total_lama, total_baru)}
+        rollup = rollup or {}
+        with self._lock:
+            # Timestamp sama diambil yang terakhir, sama seperti penyimpanan bucket
+            sampel = sorted(dict(self._sampel.get(kamar_id, ())).items())
+            if posisi is not None:
+                sampel = [s for s in sampel if s[0] > posisi[0]]
+            self._sampel[kamar_id] = sampel
+            if not sampel:
+                return {}
+            tambahan = energi.kwh_per_bulan(
+                [t for t, _ in sampel], [w for _, w in sampel], gap_maks=gap_maks, sebelum=posisi
+            )
+            sebelumnya = self._total.get(kamar_id, {})
+            hasil = {}
+            for bulan, t in tambahan.items():
+                dasar = rollup.get(bulan, 0.0)
+                lama = sebelumnya.get(bulan, dasar)
+                # Total tidak pernah turun (mis. rollup baru menyerap sampel worker lain)
+                hasil[bulan] = (lama, max(lama, dasar + t["kwh"]))
+            self._total[kamar_id] = {bulan: baru for bulan, (_, baru) in hasil.items()}
+        return hasil
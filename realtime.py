@@ -0,0 +1,79 @@
+# Fan-out event realtime (daya terkini, status relay) ke klien Server-Sent Events.
+# Satu hub per proses: sumber event (listener Firestore atau jalur ingest) cukup
+# publish sekali, lalu setiap klien yang terhubung menerima salinannya lewat queue.
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class TerlaluBanyakKlien(Exception):
+    """Jumlah koneksi SSE di proses ini sudah mencapai batas."""
+
+
+class Hub:
+    def __init__(self, maxsize=100, maks_klien=500):
+        self.maxsize = maxsize
+        self.maks_klien = maks_klien
+        self._subs = defaultdict(set)
+        self._terakhir = defaultdict(dict)  # channel -> {(event, kunci): data}
+        self._lock = threading.Lock()
+
+    def jumlah_klien(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subs.values())
+
+    def subscribe(self, channel, replay=True):
+        with self._lock:
+            if sum(len(subs) for subs in self._subs.values()) >= self.maks_klien:
+                raise TerlaluBanyakKlien()
+            # Keadaan terakhir dikirim dulu agar klien baru langsung punya data; queue
+            # diperbesar sebanyak replay supaya masih ada ruang maxsize untuk event baru
+            terakhir = list(self._terakhir.get(channel, {}).items()) if replay else []
+            q = queue.Queue(maxsize=self.maxsize + len(terakhir))
+            for (event, _), data in terakhir:
+                q.put_nowait((event, data))
+            self._subs[channel].add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            self._subs[channel].discard(q)
+            if not self._subs[channel]:
+                del self._subs[channel]
+
+    def publish(self, channels, event, data, kunci=None, simpan=True):
+        # simpan=False untuk event sekali pakai (mis. perintah) yang tidak perlu di-replay
+        with self._lock:
+            targets = []
+            for channel in channels:
+                if simpan:
+                    self._terakhir[channel][(event, kunci)] = data
+                targets.extend(self._subs.get(channel, ()))
+        for q in targets:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Klien lambat: buang event terlama, data terbaru lebih penting
+                try:
+                    q.get_nowait()
+                    q.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stream(self, channel, heartbeat=15, replay=True):
+        # Generator teks SSE; dipakai sebagai body Response Flask
+        q = None
+        try:
+            q = self.subscribe(channel, replay=replay)
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            if q is not None:
+                self.unsubscribe(channel, q)
@@ -0,0 +1,195 @@
+# Session Flask yang datanya disimpan di server; cookie hanya berisi id acak yang
+# ditandatangani. Backend: "sqlite" (default; file lokal yang dipakai bersama oleh semua
+# worker gunicorn di satu mesin) atau "memory" (LRU di memori proses, hanya untuk satu worker).
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.sid_lama = None
+
+    def regenerate(self):
+        # Ganti id setelah login agar id lama (mis. hasil fixation) tidak berlaku lagi
+        if not self.new:
+            self.sid_lama = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class MemoryStore:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # sid -> (expiry, data)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return entry[1]
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._data[sid] = (time.time() + ttl, data)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteStore:
+    BERSIHKAN_SETIAP = 1000  # hapus session kedaluwarsa setiap N kali set
+
+    def __init__(self, path="sessions.sqlite3"):
+        self.path = path
+        self._local = threading.local()
+        self._jumlah_set = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(sid TEXT PRIMARY KEY, data TEXT NOT NULL, expiry REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        # Satu koneksi per thread per proses (koneksi tidak boleh dibawa lewat fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expiry >= ?", (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, ttl):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expiry) VALUES (?, ?, ?)",
+            (sid, data, time.time() + ttl),
+        )
+        self._jumlah_set += 1
+        if self._jumlah_set % self.BERSIHKAN_SETIAP == 0:
+            conn.execute("DELETE FROM sessions WHERE expiry < ?", (time.time(),))
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        # Data disimpan sebagai teks JSON bertag (sama seperti cookie session Flask),
+        # jadi list/dict di session tidak ikut berubah di store sebelum disimpan
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(
+            app.secret_key,
+            salt="server-session",
+            key_derivation="hmac",
+            digest_method=hashlib.sha256,
+        )
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            data = self.store.get(sid) if sid else None
+            if data is not None:
+                return ServerSession(self.serializer.loads(data), sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.sid_lama:
+            self.store.delete(session.sid_lama)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite,
+                    httponly=httponly,
+                )
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        self.store.set(
+            session.sid,
+            self.serializer.dumps(dict(session)),
+            app.permanent_session_lifetime.total_seconds(),
+        )
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+
+
+def buat_session_interface(backend="sqlite"):
+    if backend == "sqlite":
+        store = SQLiteStore(os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3"))
+        return ServerSessionInterface(store)
+    if backend == "memory":
+        # Session di memori tidak terlihat worker lain: login "hilang" secara acak
+        if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+            raise ValueError(
+                "SESSION_BACKEND=memory hanya untuk satu worker; pakai sqlite jika "
+                "WEB_CONCURRENCY > 1"
+            )
+        store = MemoryStore(int(os.getenv("SESSION_MEMORY_MAXSIZE", 10000)))
+        return ServerSessionInterface(store)
+    raise ValueError(f"SESSION_BACKEND tidak dikenal: {backend}")
@@ -1,9 +1,21 @@
-document.addEventListener('DOMContentLoaded', () => {
+document.addEventListener('DOMContentLoaded', async () => {
     const chartElement = document.getElementById('dayaChart');
     if (!chartElement) return;
 
-    const rawLabels = JSON.parse(chartElement.dataset.labels || '[]');
-    const rawData = JSON.parse(chartElement.dataset.data || '[]');
+    let rawLabels = JSON.parse(chartElement.dataset.labels || '[]');
+    let rawData = JSON.parse(chartElement.dataset.data || '[]');
+
+    // Seri harian dari server (sudah dalam kWh per hari)
+    if (chartElement.dataset.url) {
+        try {
+            const res = await fetch(chartElement.dataset.url);
+            const seri = await res.json();
+            rawLabels = (seri.points || []).map(p => p.t);
+            rawData = (seri.points || []).map(p => p.kwh);
+        } catch (err) {
+            console.error('Gagal mengambil data grafik', err);
+        }
+    }
 
     const days = {};
     const months = {};
@@ -122,6 +134,7 @@ document.addEventListener('DOMContentLoaded', () => {
             updateChartWithWeek(monthKey, 'all');
         } else {
             const lastWeekMonth = Object.keys(months).slice(-1)[0];
+            if (!lastWeekMonth) return;
             const lastWeekData = Object.entries(months[lastWeekMonth].daily).slice(-7);
             const labels = lastWeekData.map(([k]) => k);
             const data = lastWeekData.map(([, v]) => v);
@@ -165,6 +178,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Init: tampilkan minggu terakhir
     const recentMonthKey = Object.keys(months).slice(-1)[0];
+    if (!recentMonthKey) return;
     const recentDays = Object.entries(months[recentMonthKey].daily).slice(-7);
     updateChart(recentDays.map(([k]) => k), recentDays.map(([, v]) => v));
 });
@@ -0,0 +1,42 @@
+// Update daya & status relay di dashboard lewat Server-Sent Events
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.getElementById('realtime');
+    if (!container || !window.EventSource) return;
+
+    // Elemen tanpa nilai atribut (dashboard penghuni) berlaku untuk kamar mana pun di stream
+    const cari = (attr, kamarId) =>
+        document.querySelectorAll(`[${attr}="${kamarId}"], [${attr}=""]`);
+
+    const source = new EventSource(container.dataset.streamUrl);
+
+    source.addEventListener('daya', (e) => {
+        const data = JSON.parse(e.data);
+        const watt = Number(data.watt);
+        cari('data-live-watt', data.kamar_id).forEach((el) => {
+            el.textContent = Number.isFinite(watt) ? `${watt.toLocaleString('id-ID')} W` : '-';
+            if (data.timestamp) el.title = new Date(data.timestamp).toLocaleString('id-ID');
+        });
+    });
+
+    source.addEventListener('relay', (e) => {
+        const data = JSON.parse(e.data);
+        cari('data-live-relay', data.kamar_id).forEach((el) => {
+            el.textContent = data.relay1_status ? 'ON' : 'OFF';
+            if (el.classList.contains('rounded-full')) {
+                el.classList.toggle('bg-green-100', data.relay1_status);
+                el.classList.toggle('text-green-700', data.relay1_status);
+                el.classList.toggle('bg-red-100', !data.relay1_status);
+                el.classList.toggle('text-red-700', !data.relay1_status);
+            }
+        });
+    });
+
+    source.addEventListener('peringatan', (e) => {
+        const data = JSON.parse(e.data);
+        cari('data-live-peringatan', data.kamar_id).forEach((el) => {
+            const persen = Math.round(data.ambang * 100);
+            el.textContent = `Pemakaian ${data.total_kwh} kWh sudah mencapai ${persen}% dari batas ${data.batas_kwh} kWh.`;
+            el.classList.remove('hidden');
+        });
+    });
+});
@@ -0,0 +1,79 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from auth_client import AuthClient, AuthTidakTersedia
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, supaya pemakaian ulang koneksi terlihat
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.permintaan.append((self.path, self.client_address[1]))
+        status = server.balasan.pop(0) if server.balasan else 200
+        body = json.dumps({"localId": "u1", "idToken": "t1"} if status == 200 else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.permintaan = []
+    server.balasan = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def klien(server, retries=2):
+    return AuthClient(
+        api_key="kunci",
+        base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        timeout=(1, 2),
+        retries=retries,
+        backoff=0,
+    )
+
+
+def test_retry_5xx_lalu_berhasil(stub):
+    stub.balasan = [503, 500]
+    hasil = klien(stub).sign_in("a@b.c", "rahasia")
+    assert hasil == {"localId": "u1", "idToken": "t1"}
+    assert len(stub.permintaan) == 3
+    assert stub.permintaan[0][0] == "/v1/accounts:signInWithPassword?key=kunci"
+
+
+def test_400_tidak_diulang_dan_mengembalikan_none(stub):
+    stub.balasan = [400]
+    assert klien(stub).sign_in("a@b.c", "salah") is None
+    assert len(stub.permintaan) == 1
+
+
+def test_5xx_terus_menerus_menaikkan_auth_tidak_tersedia(stub):
+    stub.balasan = [502] * 5
+    with pytest.raises(AuthTidakTersedia):
+        klien(stub, retries=1).sign_in("a@b.c", "rahasia")
+    assert len(stub.permintaan) == 2
+
+
+def test_satu_session_dan_koneksi_dipakai_ulang(stub):
+    auth = klien(stub)
+    session = auth.session
+    for _ in range(3):
+        assert auth.sign_in("a@b.c", "rahasia") is not None
+    assert auth.session is session
+    # Semua permintaan lewat satu koneksi keep-alive dari pool yang sama
+    assert len({port for _, port in stub.permintaan}) == 1
@@ -0,0 +1,126 @@
+# Kesetaraan jalur tagihan: rollup aplikasi (kwh_per_bulan bertahap dengan `sebelum`)
+# dan billing_engine (CLI/benchmark) harus menghasilkan angka yang sama.
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import billing_engine
+import energi
+
+KAMAR = {
+    "k1": {"BatasKWH": 1, "TarifPerKWH": 1500},
+    "k2": {"BatasKWH": 1000, "TarifPerKWH": 1500},
+    "k3": {"BatasKWH": 0.5, "GapMaksDetik": 30},
+}
+
+
+def sampel(kamar_id, mulai, jumlah, seed):
+    # Sampel 3 detik dengan celah sesekali, melewati pergantian bulan
+    acak = random.Random(seed)
+    t = mulai
+    for _ in range(jumlah):
+        t += 3 if acak.random() > 0.01 else acak.randint(60, 600)
+        yield kamar_id, t, acak.uniform(50, 2000)
+
+
+def data():
+    mulai = datetime(2025, 5, 31, 20, tzinfo=timezone.utc).timestamp()
+    hasil = []
+    for i, kamar_id in enumerate(KAMAR):
+        hasil.extend(sampel(kamar_id, mulai, 20000, seed=i))
+    return hasil
+
+
+def rollup_bertahap(readings, ukuran):
+    # Seperti perbarui_rollup_kamar: tiap run memproses sampel baru sesudah posisi terakhir
+    per_kamar = defaultdict(list)
+    for kamar_id, t, w in readings:
+        per_kamar[kamar_id].append((t, w))
+    pemakaian = defaultdict(lambda: defaultdict(float))
+    for kamar_id, daftar in per_kamar.items():
+        sebelum = None
+        for i in range(0, len(daftar), ukuran):
+            potongan = daftar[i : i + ukuran]
+            hasil = energi.kwh_per_bulan(
+                [t for t, _ in potongan],
+                [w for _, w in potongan],
+                gap_maks=energi.gap_maks_kamar(KAMAR[kamar_id]),
+                sebelum=sebelum,
+            )
+            for bulan, r in hasil.items():
+                pemakaian[kamar_id][bulan] += r["kwh"]
+            sebelum = potongan[-1]
+    return {k: dict(v) for k, v in pemakaian.items()}
+
+
+def test_rollup_bertahap_sama_dengan_satu_kali():
+    readings = data()
+    sekali = rollup_bertahap(readings, ukuran=10**9)
+    bertahap = rollup_bertahap(readings, ukuran=97)
+    assert sekali.keys() == bertahap.keys()
+    for kamar_id in sekali:
+        assert sekali[kamar_id] == pytest.approx(bertahap[kamar_id])
+        # Total semua bulan = integrasi trapesium atas seluruh sampel kamar itu
+        t = [r[1] for r in readings if r[0] == kamar_id]
+        w = [r[2] for r in readings if r[0] == kamar_id]
+        total = energi.integrasi_kwh(t, w, gap_maks=energi.gap_maks_kamar(KAMAR[kamar_id]))
+        assert sum(sekali[kamar_id].values()) == pytest.approx(total)
+
+
+def test_engine_sama_dengan_jalur_rollup_aplikasi():
+    readings = data()
+    pemakaian = rollup_bertahap(readings, ukuran=500)
+    aplikasi = billing_engine.buat_tagihan(pemakaian, KAMAR, sebelum_bulan="2025-06")
+    engine = billing_engine.jalankan(
+        billing_engine.potong(readings, ukuran=123), KAMAR, sebelum_bulan="2025-06"
+    )
+    assert engine == aplikasi
+    assert [t["KamarID"] for t in engine] == ["k1", "k3"]
+
+
+def test_segmen_masuk_bulan_sampel_berikutnya():
+    akhir_mei = datetime(2025, 5, 31, 23, 59, 58, tzinfo=timezone.utc).timestamp()
+    hasil = energi.kwh_per_bulan([akhir_mei, akhir_mei + 4], [3600, 3600], gap_maks=60)
+    assert hasil["2025-05"]["kwh"] == 0.0
+    assert hasil["2025-06"]["kwh"] == pytest.approx(3600 * 4 / energi.JOULE_PER_KWH)
+
+
+def test_aturan_tagihan():
+    pemakaian = {"k1": {"2025-04": 0.5, "2025-05": 3.0, "2025-06": 9.0}}
+    kamar = {"k1": {"BatasKWH": 1, "TarifPerKWH": 1000}}
+    tagihan = billing_engine.buat_tagihan(pemakaian, kamar, sebelum_bulan="2025-06")
+    assert tagihan == [
+        {
+            "KamarID": "k1",
+            "Bulan": "2025-05",
+            "JumlahKWH": 2.0,
+            "TotalTagihan": 2000.0,
+            "StatusPembayaran": billing_engine.STATUS_BARU,
+        }
+    ]
+    assert (
+        billing_engine.buat_tagihan(
+            pemakaian, kamar, sudah_tertagih={"k1": {"2025-05"}}, sebelum_bulan="2025-06"
+        )
+        == []
+    )
+    # Tanpa tarif kamar dipakai TARIF_DEFAULT
+    tagihan = billing_engine.buat_tagihan({"k2": {"2025-05": 2}}, {"k2": {"BatasKWH": 1}})
+    assert tagihan[0]["TotalTagihan"] == billing_engine.TARIF_DEFAULT
+
+
+def test_bulan_berjalan_memakai_batas_bulan_utc():
+    wib = timezone(timedelta(hours=7))
+    # 01:00 WIB 1 Juni masih 31 Mei UTC: Mei belum ditutup, jadi belum ditagih
+    assert billing_engine.bulan_berjalan(datetime(2025, 6, 1, 1, tzinfo=wib)) == "2025-05"
+    assert billing_engine.bulan_berjalan(
+        datetime(2025, 5, 31, 23, 59, 59, tzinfo=timezone.utc)
+    ) == "2025-05"
+    assert billing_engine.bulan_berjalan(datetime(2025, 6, 1, tzinfo=timezone.utc)) == "2025-06"
+
+    pemakaian = {"k1": {"2025-05": 5.0}}
+    kamar = {"k1": {"BatasKWH": 1}}
+    sebelum = billing_engine.bulan_berjalan(datetime(2025, 6, 1, 1, tzinfo=wib))
+    assert billing_engine.buat_tagihan(pemakaian, kamar, sebelum_bulan=sebelum) == []
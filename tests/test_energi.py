@@ -0,0 +1,16 @@
+import pytest
+
+import energi
+
+
+def test_kwh_per_segmen_sama_dengan_integrasi():
+    detik = [0, 3, 6, 100, 103]
+    watt = [100, 200, 300, 50, 50]
+    segmen = energi.kwh_per_segmen(detik, watt, gap_maks=60)
+    assert segmen[0] == 0.0
+    assert sum(segmen) == pytest.approx(energi.integrasi_kwh(detik, watt, gap_maks=60))
+
+
+def test_kwh_per_segmen_dengan_sampel_sebelumnya():
+    segmen = energi.kwh_per_segmen([10], [100], gap_maks=60, sebelum=(0, 100))
+    assert segmen == [pytest.approx(100 * 10 / energi.JOULE_PER_KWH)]
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ingest import parse_data_daya, parse_timestamp
+
+SEKARANG = datetime(2025, 5, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def test_timestamp_iso_dan_epoch():
+    assert parse_timestamp("2025-05-10T11:00:00Z", SEKARANG) == SEKARANG - timedelta(hours=1)
+    assert parse_timestamp("2025-05-10T11:00:00", SEKARANG) == SEKARANG - timedelta(hours=1)
+    epoch = (SEKARANG - timedelta(minutes=5)).timestamp()
+    assert parse_timestamp(epoch, SEKARANG) == SEKARANG - timedelta(minutes=5)
+    assert parse_timestamp(epoch * 1000, SEKARANG) == SEKARANG - timedelta(minutes=5)
+
+
+def test_timestamp_kosong_memakai_sekarang():
+    assert parse_timestamp(None, SEKARANG) == SEKARANG
+    assert parse_timestamp("", SEKARANG) == SEKARANG
+
+
+def test_timestamp_masa_depan_dalam_toleransi_diterima():
+    ts = SEKARANG + timedelta(seconds=60)
+    assert parse_timestamp(ts.isoformat(), SEKARANG, toleransi=300) == ts
+
+
+def test_timestamp_masa_depan_ditolak():
+    with pytest.raises(ValueError):
+        parse_timestamp((SEKARANG + timedelta(hours=1)).isoformat(), SEKARANG, toleransi=300)
+    with pytest.raises(ValueError):
+        parse_timestamp((SEKARANG + timedelta(days=365)).timestamp(), SEKARANG, toleransi=300)
+
+
+def test_timestamp_bool_ditolak():
+    with pytest.raises(ValueError):
+        parse_timestamp(True, SEKARANG)
+
+
+def test_parse_data_daya():
+    data = parse_data_daya(
+        {"KamarID": "k1", "JumlahWatt": 120, "Timestamp": "2025-05-10T11:59:00Z"}, SEKARANG
+    )
+    assert data == {
+        "KamarID": "k1",
+        "JumlahWatt": 120,
+        "Timestamp": datetime(2025, 5, 10, 11, 59, tzinfo=timezone.utc),
+    }
+    with pytest.raises(ValueError):
+        parse_data_daya({"KamarID": "k1", "JumlahWatt": -1}, SEKARANG)
+    with pytest.raises(ValueError):
+        parse_data_daya(
+            {"KamarID": "k1", "JumlahWatt": 1, "Timestamp": "2030-01-01T00:00:00Z"}, SEKARANG
+        )
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import energi
+from pemakaian import PemakaianBerjalan
+
+AWAL = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+def records(kamar_id, watt, mulai=0, langkah=3):
+    return [
+        {"KamarID": kamar_id, "Timestamp": AWAL + timedelta(seconds=mulai + i * langkah), "JumlahWatt": w}
+        for i, w in enumerate(watt)
+    ]
+
+
+def kwh(watt, langkah=3):
+    return energi.integrasi_kwh([i * langkah for i in range(len(watt))], watt, gap_maks=60)
+
+
+def test_total_sama_dengan_integrasi_dan_lama_dari_rollup():
+    p = PemakaianBerjalan()
+    p.tambah(records("k1", [1000] * 10))
+    assert p.berubah() == ["k1"]
+    assert p.berubah() == []
+
+    hasil = p.hitung("k1", rollup={"2025-06": 2.0}, gap_maks=60)
+    assert hasil["2025-06"] == (2.0, pytest.approx(2.0 + kwh([1000] * 10)))
+
+
+def test_urutan_sampel_tidak_berpengaruh_dan_lama_dari_evaluasi_sebelumnya():
+    p = PemakaianBerjalan()
+    p.tambah(records("k1", [500] * 5))
+    _, pertama = p.hitung("k1", gap_maks=60)["2025-06"]
+    # Chunk kedua datang tidak urut
+    p.tambah(list(reversed(records("k1", [500] * 5, mulai=15))))
+    lama, baru = p.hitung("k1", gap_maks=60)["2025-06"]
+    assert lama == pertama
+    assert baru == pytest.approx(kwh([500] * 10))
+
+
+def test_sampel_yang_sudah_dirollup_dibuang():
+    p = PemakaianBerjalan()
+    p.tambah(records("k1", [1000] * 10))
+    p.hitung("k1", gap_maks=60)
+    # Rollup sudah memproses 5 sampel pertama
+    posisi = (energi.ke_detik(AWAL) + 12, 1000)
+    basis = kwh([1000] * 5)
+    lama, baru = p.hitung("k1", posisi, {"2025-06": basis}, gap_maks=60)["2025-06"]
+    assert baru == pytest.approx(kwh([1000] * 10))
+    assert len(p._sampel["k1"]) == 5
+
+    # Semua sampel sudah di-rollup: tidak ada yang perlu dievaluasi
+    posisi = (energi.ke_detik(AWAL) + 27, 1000)
+    assert p.hitung("k1", posisi, {"2025-06": baru}, gap_maks=60) == {}
+
+
+def test_total_tidak_turun():
+    p = PemakaianBerjalan()
+    p.tambah(records("k1", [1000] * 10))
+    _, pertama = p.hitung("k1", rollup={"2025-06": 5.0}, gap_maks=60)["2025-06"]
+    # Rollup dihitung ulang dari awal: total yang sudah dievaluasi tetap dipakai
+    p.tambah(records("k1", [1000], mulai=30))
+    lama, baru = p.hitung("k1", rollup={"2025-06": 0.0}, gap_maks=60)["2025-06"]
+    assert lama == baru == pertama
+
+
+def test_segmen_lintas_bulan_masuk_bulan_sampel_baru():
+    p = PemakaianBerjalan()
+    p.tambah(records("k1", [1000, 1000], mulai=-3))
+    hasil = p.hitung("k1", gap_maks=60)
+    assert set(hasil) == {"2025-05", "2025-06"}
+    assert hasil["2025-05"][1] == 0.0
+    assert hasil["2025-06"][1] == pytest.approx(kwh([1000, 1000]))
+
+
+def test_jumlah_sampel_dibatasi():
+    p = PemakaianBerjalan(maks_sampel=3)
+    p.tambah(records("k1", [1, 2, 3, 4, 5]))
+    assert [w for _, w in p._sampel["k1"]] == [3, 4, 5]
+    p.hapus("k1")
+    assert p.bulan("k1") == []
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from realtime import Hub, TerlaluBanyakKlien
+
+
+def test_replay_lebih_banyak_dari_maxsize():
+    hub = Hub(maxsize=10)
+    for i in range(60):
+        hub.publish(["pemilik"], "daya", {"kamar_id": f"k{i}", "watt": i}, kunci=f"k{i}")
+        hub.publish(["pemilik"], "relay", {"kamar_id": f"k{i}"}, kunci=f"k{i}")
+
+    stream = hub.stream("pemilik")
+    assert next(stream) == "retry: 3000\n\n"
+    assert hub.jumlah_klien() == 1
+    events = [next(stream) for _ in range(120)]
+    assert sum(e.startswith("event: daya") for e in events) == 60
+    assert json.loads(events[0].split("data: ", 1)[1])["kamar_id"] == "k0"
+
+    # Masih ada ruang untuk event baru setelah replay
+    for i in range(10):
+        hub.publish(["pemilik"], "daya", {"kamar_id": "k0", "watt": 100 + i}, kunci="k0")
+    assert sum(1 for _ in range(10) if next(stream).startswith("event: daya")) == 10
+
+    stream.close()
+    assert hub.jumlah_klien() == 0
+
+
+def test_klien_ditolak_tidak_memakai_slot():
+    hub = Hub(maks_klien=1)
+    pertama = hub.stream("a")
+    next(pertama)
+    kedua = hub.stream("a")
+    with pytest.raises(TerlaluBanyakKlien):
+        next(kedua)
+    assert hub.jumlah_klien() == 1
+    pertama.close()
+    assert hub.jumlah_klien() == 0
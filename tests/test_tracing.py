@@ -0,0 +1,45 @@
+import tracing
+
+
+class Transaksi:
+    def __init__(self):
+        self.tulis = []
+
+    def set(self, ref, data):
+        self.tulis.append((ref, data))
+
+    def _commit(self):
+        return [object() for _ in self.tulis]
+
+
+class Batch(Transaksi):
+    def commit(self):
+        return self._commit()
+
+
+class Db:
+    def transaction(self):
+        return Transaksi()
+
+    def batch(self):
+        return Batch()
+
+
+def test_commit_batch_dan_transaksi_tercatat():
+    tracer = tracing.Tracer()
+    db = tracer.bungkus(Db())
+    jejak = tracer.mulai("/uji")
+
+    transaksi = db.transaction()
+    transaksi.set("a", {})
+    transaksi.set("b", {})
+    transaksi._commit()  # seperti yang dilakukan @firestore.transactional
+    batch = db.batch()
+    batch.set("c", {})
+    batch.commit()
+
+    assert [(p[0], p[1], p[3]) for p in jejak.panggilan] == [
+        ("(transaction)", "commit", 2),
+        ("(batch)", "commit", 1),
+    ]
+    assert tracer.selesai(jejak)["panggilan"] == 2
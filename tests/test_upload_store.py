@@ -0,0 +1,21 @@
+import os
+import time
+
+import upload_store
+
+
+def test_put_duplikat_memperbarui_mtime(tmp_path):
+    store = upload_store.DiskStore(str(tmp_path / "store"))
+    sumber = tmp_path / "a.jpg"
+    sumber.write_bytes(b"isi")
+    kunci = store.put(str(sumber), ".jpg")
+
+    lama = time.time() - 7200
+    os.utime(store.path(kunci), (lama, lama))
+    sumber.write_bytes(b"isi")
+    assert store.put(str(sumber), ".jpg") == kunci
+    assert not sumber.exists()
+
+    # File yang baru di-upload ulang tidak ikut dihapus GC walau belum direferensikan
+    assert upload_store.gc(store, set()) == 0
+    assert store.exists(kunci)
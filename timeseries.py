@@ -0,0 +1,390 @@
+# Penyimpanan data daya dalam bucket: satu dokumen berisi semua sampel satu kamar
+# selama satu jam, bukan satu dokumen per sampel.
+#
+# Dokumen bucket ("data_daya_bucket"):
+#   KamarID, Mulai (awal jam, UTC), Akhir (sampel terakhir), Jumlah, TotalWatt,
+#   Offset (selisih ms antar sampel, uint32, zlib), Watt (float32, zlib), Kompak
+#
+# Data dari ingest ditulis sebagai bucket "chunk" (Kompak=False, id acak) agar tetap
+# bisa memakai batch write; job kompaksi menggabungkan chunk satu jam menjadi satu
+# dokumen "{KamarID}_{YYYYMMDDHH}" (Kompak=True).
+import sys
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import energi
+
+BUCKET_COLLECTION = "data_daya_bucket"
+BUCKET_DETIK = 3600
+_BUCKET_MS = BUCKET_DETIK * 1000
+_BATAS_BATCH = 500
+
+# Seri ringkasan (downsampling) per kamar: kWh, jumlah sampel, total/min/max watt
+RINGKAS_COLLECTION = "daya_ringkas"
+RESOLUSI_DETIK = {"menit": 60, "jam": 3600, "hari": 86400}
+# Dokumen resolusi menit diberi field Kedaluwarsa untuk kebijakan TTL Firestore
+RETENSI = {"menit": timedelta(days=7)}
+# Bucket harian dimulai tengah malam Asia/Jakarta (UTC+7, tanpa DST), bukan UTC
+OFFSET_DETIK = {"hari": 7 * 3600}
+
+
+def ke_ms(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(round(ts.timestamp() * 1000))
+
+
+def dari_ms(ms):
+    return datetime.fromtimestamp(ms / 1000, timezone.utc)
+
+
+def awal_bucket_ms(ms):
+    return ms - ms % _BUCKET_MS
+
+
+def bucket_id(kamar_id, mulai_ms):
+    return f"{kamar_id}_{dari_ms(mulai_ms).strftime('%Y%m%d%H')}"
+
+
+def _ke_bytes(arr):
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return zlib.compress(arr.tobytes())
+
+
+def _dari_bytes(typecode, data):
+    arr = array(typecode)
+    arr.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def encode(kamar_id, mulai_ms, sampel, kompak):
+    # sampel: list (ms, watt) terurut waktu, semuanya di dalam bucket yang sama
+    offset = array("I")
+    watt = array("f")
+    sebelumnya = mulai_ms
+    for ms, w in sampel:
+        offset.append(ms - sebelumnya)
+        watt.append(w)
+        sebelumnya = ms
+    return {
+        "KamarID": kamar_id,
+        "Mulai": dari_ms(mulai_ms),
+        "Akhir": dari_ms(sampel[-1][0]),
+        "Jumlah": len(sampel),
+        "TotalWatt": float(sum(w for _, w in sampel)),
+        "Offset": _ke_bytes(offset),
+        "Watt": _ke_bytes(watt),
+        "Kompak": kompak,
+    }
+
+
+def decode(data):
+    # Kembalikan list (ms, watt) dari satu dokumen bucket
+    ms = ke_ms(data["Mulai"])
+    hasil = []
+    offset = _dari_bytes("I", data["Offset"])
+    watt = _dari_bytes("f", data["Watt"])
+    for delta, w in zip(offset, watt):
+        ms += delta
+        hasil.append((ms, float(w)))
+    return hasil
+
+
+def gabung(*daftar_sampel):
+    # Gabungkan beberapa list sampel; timestamp yang sama diambil yang terakhir
+    per_ms = {}
+    for sampel in daftar_sampel:
+        for ms, w in sampel:
+            per_ms[ms] = w
+    return sorted(per_ms.items())
+
+
+def kelompokkan(records):
+    # records: dict KamarID/JumlahWatt/Timestamp -> {(kamar_id, mulai_ms): [(ms, watt)]}
+    grup = defaultdict(list)
+    for r in records:
+        ms = ke_ms(r["Timestamp"])
+        grup[(r["KamarID"], awal_bucket_ms(ms))].append((ms, float(r["JumlahWatt"])))
+    return grup
+
+
+def tulis_chunk(db, records, collection=BUCKET_COLLECTION):
+    # Satu dokumen chunk per kamar-jam, ditulis dengan batch write
+    col = db.collection(collection)
+    docs = [
+        encode(kamar_id, mulai_ms, gabung(sampel), kompak=False)
+        for (kamar_id, mulai_ms), sampel in kelompokkan(records).items()
+    ]
+    for i in range(0, len(docs), _BATAS_BATCH):
+        batch = db.batch()
+        for data in docs[i : i + _BATAS_BATCH]:
+            batch.set(col.document(), data)
+        batch.commit()
+    return len(docs)
+
+
+def _simpan_kompak(db, col, kamar_id, mulai_ms, sampel, hapus_refs=()):
+    # Gabungkan dengan bucket kompak yang sudah ada lalu tulis, sekaligus hapus sumbernya
+    target = col.document(bucket_id(kamar_id, mulai_ms))
+    snapshot = target.get()
+    if snapshot.exists:
+        sampel = gabung(decode(snapshot.to_dict()), sampel)
+    batch = db.batch()
+    batch.set(target, encode(kamar_id, mulai_ms, sampel, kompak=True))
+    for ref in hapus_refs:
+        batch.delete(ref)
+    batch.commit()
+
+
+def kompaksi(db, sebelum=None, collection=BUCKET_COLLECTION):
+    # Gabungkan chunk dari jam yang sudah lewat menjadi satu dokumen per kamar-jam
+    sebelum_ms = awal_bucket_ms(ke_ms(sebelum or datetime.now(timezone.utc)))
+    col = db.collection(collection)
+    chunks = (
+        col.where("Kompak", "==", False).where("Mulai", "<", dari_ms(sebelum_ms)).stream()
+    )
+
+    grup = defaultdict(list)
+    for doc in chunks:
+        data = doc.to_dict()
+        grup[(data["KamarID"], ke_ms(data["Mulai"]))].append(doc)
+
+    for (kamar_id, mulai_ms), docs in grup.items():
+        sampel = gabung(*(decode(doc.to_dict()) for doc in docs))
+        # Satu batch maksimal 500 operasi: 1 set + hapus chunk
+        for i in range(0, len(docs), _BATAS_BATCH - 1):
+            bagian = docs[i : i + _BATAS_BATCH - 1]
+            _simpan_kompak(
+                db,
+                col,
+                kamar_id,
+                mulai_ms,
+                sampel if i == 0 else [],
+                [doc.reference for doc in bagian],
+            )
+    return len(grup)
+
+
+def iter_sampel(
+    db,
+    kamar_id=None,
+    mulai=None,
+    akhir=None,
+    turun=False,
+    batas=None,
+    collection=BUCKET_COLLECTION,
+):
+    # Yield (ms, kamar_id, watt) terurut (ms, kamar_id), naik atau turun.
+    # mulai/akhir: rentang [mulai, akhir); batas: (ms, kamar_id) eksklusif untuk cursor.
+    mulai_ms = ke_ms(mulai) if mulai else None
+    akhir_ms = ke_ms(akhir) if akhir else None
+
+    bawah, atas = mulai_ms, akhir_ms
+    if batas:
+        if turun:
+            batas_atas = awal_bucket_ms(batas[0]) + _BUCKET_MS
+            atas = batas_atas if atas is None else min(atas, batas_atas)
+        else:
+            batas_bawah = batas[0]
+            bawah = batas_bawah if bawah is None else max(bawah, batas_bawah)
+
+    query = db.collection(collection)
+    if kamar_id:
+        query = query.where("KamarID", "==", kamar_id)
+    if bawah is not None:
+        query = query.where("Mulai", ">=", dari_ms(awal_bucket_ms(bawah)))
+    if atas is not None:
+        query = query.where("Mulai", "<", dari_ms(atas))
+    query = query.order_by("Mulai", direction="DESCENDING" if turun else "ASCENDING")
+
+    def cocok(kunci):
+        ms = kunci[0]
+        if mulai_ms is not None and ms < mulai_ms:
+            return False
+        if akhir_ms is not None and ms >= akhir_ms:
+            return False
+        if batas:
+            return kunci < batas if turun else kunci > batas
+        return True
+
+    def keluarkan(grup):
+        # Semua dokumen dengan Mulai yang sama mencakup jam yang sama
+        per_kunci = {}
+        for data in grup:
+            for ms, w in decode(data):
+                per_kunci[(ms, data["KamarID"])] = w
+        for kunci in sorted(per_kunci, reverse=turun):
+            if cocok(kunci):
+                yield kunci[0], kunci[1], per_kunci[kunci]
+
+    grup, grup_mulai = [], None
+    for doc in query.stream():
+        data = doc.to_dict()
+        if grup and data["Mulai"] != grup_mulai:
+            yield from keluarkan(grup)
+            grup = []
+        grup.append(data)
+        grup_mulai = data["Mulai"]
+    if grup:
+        yield from keluarkan(grup)
+
+
+def migrasi(db, sumber="data_daya", collection=BUCKET_COLLECTION, hapus=False, log=print):
+    # Ubah dokumen per-sampel menjadi bucket kompak; aman dijalankan ulang
+    col = db.collection(collection)
+    docs = db.collection(sumber).order_by("KamarID").order_by("Timestamp").stream()
+
+    kunci_aktif, sampel, refs = None, [], []
+    jumlah_bucket = jumlah_sampel = 0
+
+    def simpan():
+        nonlocal jumlah_bucket
+        kamar_id, mulai_ms = kunci_aktif
+        _simpan_kompak(db, col, kamar_id, mulai_ms, gabung(sampel))
+        if hapus:
+            for i in range(0, len(refs), _BATAS_BATCH):
+                batch = db.batch()
+                for ref in refs[i : i + _BATAS_BATCH]:
+                    batch.delete(ref)
+                batch.commit()
+        jumlah_bucket += 1
+        if jumlah_bucket % 100 == 0:
+            log(f"{jumlah_bucket} bucket, {jumlah_sampel} sampel")
+
+    for doc in docs:
+        data = doc.to_dict()
+        ts = data.get("Timestamp")
+        if not ts or not data.get("KamarID"):
+            continue
+        ms = ke_ms(ts)
+        kunci = (data["KamarID"], awal_bucket_ms(ms))
+        if kunci != kunci_aktif and sampel:
+            simpan()
+            sampel, refs = [], []
+        kunci_aktif = kunci
+        sampel.append((ms, float(data.get("JumlahWatt", 0))))
+        refs.append(doc.reference)
+        jumlah_sampel += 1
+
+    if sampel:
+        simpan()
+    log(f"Selesai: {jumlah_bucket} bucket, {jumlah_sampel} sampel")
+    return jumlah_bucket, jumlah_sampel
+
+
+def awal_ringkas_ms(ms, resolusi):
+    lebar_ms = RESOLUSI_DETIK[resolusi] * 1000
+    return ms - (ms + OFFSET_DETIK.get(resolusi, 0) * 1000) % lebar_ms
+
+
+def ringkas_id(kamar_id, resolusi, mulai_ms):
+    return f"{kamar_id}_{resolusi}_{dari_ms(mulai_ms).strftime('%Y%m%d%H%M')}"
+
+
+def ringkas(kamar_id, detik, watt, sebelum=None, gap_maks=None):
+    # Ringkas sampel terurut waktu satu kamar ke setiap resolusi. kWh dihitung dengan
+    # rumus yang sama dengan rollup; segmen antar dua sampel masuk bucket sampel yang
+    # belakangan. `sebelum` = (detik, watt) sampel terakhir yang sudah diringkas.
+    hasil = {}
+    kwh_segmen = energi.kwh_per_segmen(detik, watt, gap_maks=gap_maks, sebelum=sebelum)
+    for t, w, kwh in zip(detik, watt, kwh_segmen):
+        ms = int(round(t * 1000))
+        w = float(w)
+        for resolusi in RESOLUSI_DETIK:
+            mulai_ms = awal_ringkas_ms(ms, resolusi)
+            kunci = (kamar_id, resolusi, mulai_ms)
+            agg = hasil.get(kunci)
+            if agg is None:
+                hasil[kunci] = {
+                    "kwh": kwh,
+                    "jumlah": 1,
+                    "total_watt": w,
+                    "min_watt": w,
+                    "max_watt": w,
+                }
+                continue
+            agg["kwh"] += kwh
+            agg["jumlah"] += 1
+            agg["total_watt"] += w
+            agg["min_watt"] = min(agg["min_watt"], w)
+            agg["max_watt"] = max(agg["max_watt"], w)
+    return hasil
+
+
+def dokumen_ringkasan(hasil):
+    # (id dokumen, data) per agregat; field ditambah dengan transform di server (tanpa
+    # baca dulu), jadi bisa ditulis lewat batch maupun di dalam transaksi rollup
+    for (kamar_id, resolusi, mulai_ms), agg in hasil.items():
+        data = {
+            "KamarID": kamar_id,
+            "Resolusi": resolusi,
+            "Mulai": dari_ms(mulai_ms),
+            "KWH": firestore.Increment(agg["kwh"]),
+            "Jumlah": firestore.Increment(agg["jumlah"]),
+            "TotalWatt": firestore.Increment(agg["total_watt"]),
+            "MinWatt": firestore.Minimum(agg["min_watt"]),
+            "MaxWatt": firestore.Maximum(agg["max_watt"]),
+        }
+        if resolusi in RETENSI:
+            data["Kedaluwarsa"] = dari_ms(mulai_ms) + RETENSI[resolusi]
+        yield ringkas_id(kamar_id, resolusi, mulai_ms), data
+
+
+def tulis_ringkasan(db, hasil, collection=RINGKAS_COLLECTION):
+    col = db.collection(collection)
+    items = list(dokumen_ringkasan(hasil))
+    for i in range(0, len(items), _BATAS_BATCH):
+        batch = db.batch()
+        for doc_id, data in items[i : i + _BATAS_BATCH]:
+            batch.set(col.document(doc_id), data, merge=True)
+        batch.commit()
+
+
+def hapus_ringkasan(db, kamar_id, collection=RINGKAS_COLLECTION):
+    # Hapus semua ringkasan satu kamar (sebelum dihitung ulang dari awal)
+    query = db.collection(collection).where("KamarID", "==", kamar_id)
+    refs = [doc.reference for doc in query.stream()]
+    for i in range(0, len(refs), _BATAS_BATCH):
+        batch = db.batch()
+        for ref in refs[i : i + _BATAS_BATCH]:
+            batch.delete(ref)
+        batch.commit()
+    return len(refs)
+
+
+def baca_seri(db, kamar_id, resolusi, mulai, akhir=None, batas=None, collection=RINGKAS_COLLECTION):
+    query = (
+        db.collection(collection)
+        .where("KamarID", "==", kamar_id)
+        .where("Resolusi", "==", resolusi)
+        .where("Mulai", ">=", mulai)
+    )
+    if akhir:
+        query = query.where("Mulai", "<", akhir)
+    query = query.order_by("Mulai")
+    if batas:
+        query = query.limit(batas)
+
+    seri = []
+    for doc in query.stream():
+        data = doc.to_dict()
+        jumlah = data.get("Jumlah") or 0
+        seri.append(
+            {
+                "t": data["Mulai"].isoformat(),
+                "kwh": data.get("KWH", 0.0),
+                "jumlah": jumlah,
+                "min_watt": data.get("MinWatt"),
+                "max_watt": data.get("MaxWatt"),
+                "mean_watt": data.get("TotalWatt", 0.0) / jumlah if jumlah else None,
+            }
+        )
+    return seri
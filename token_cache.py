@@ -0,0 +1,137 @@
+# Cache hasil verifikasi Firebase ID token.
+# Token yang sudah diverifikasi disimpan (key: sha256 token) sampai `exp`-nya, jadi
+# request berikutnya dengan token yang sama tidak perlu verifikasi ulang. Pengecekan
+# revoke memakai peta uid -> tokens_valid_after yang diperbarui berkala di latar
+# belakang, bukan satu panggilan jaringan per request.
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import auth
+
+logger = logging.getLogger(__name__)
+
+BATAS_GET_USERS = 100  # maksimal identifier per auth.get_users
+
+
+class TokenDicabut(Exception):
+    """Token sudah di-revoke atau akun dinonaktifkan."""
+
+
+class TokenCache:
+    def __init__(self, maxsize=10000, refresh_interval=300, clock_skew=60):
+        self.maxsize = maxsize
+        self.refresh_interval = refresh_interval
+        self.clock_skew = clock_skew
+
+        self._token = OrderedDict()  # sha256 -> (exp, claims)
+        self._revoke = {}  # uid -> (valid_after_detik, disabled)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token):
+        # Kembalikan claims token; lempar exception jika tidak valid / dicabut
+        key = hashlib.sha256(token.encode()).hexdigest()
+        sekarang = time.time()
+        with self._lock:
+            entry = self._token.get(key)
+            if entry and entry[0] + self.clock_skew > sekarang:
+                self._token.move_to_end(key)
+                self.hits += 1
+                claims = entry[1]
+            else:
+                self._token.pop(key, None)
+                claims = None
+                self.misses += 1
+
+        if claims is None:
+            # Verifikasi tanda tangan & masa berlaku saja; revoke dicek dari peta
+            claims = auth.verify_id_token(
+                token, check_revoked=False, clock_skew_seconds=self.clock_skew
+            )
+            with self._lock:
+                self._token[key] = (claims["exp"], claims)
+                if self.maxsize and len(self._token) > self.maxsize:
+                    self._token.popitem(last=False)
+
+        self._cek_revoke(claims)
+        return claims
+
+    def _cek_revoke(self, claims):
+        uid = claims["uid"]
+        with self._lock:
+            status = self._revoke.get(uid)
+        if status is None:
+            # Uid baru: ambil sekali, selanjutnya diperbarui oleh thread refresh
+            status = self._ambil_status([uid]).get(uid, (0, False))
+            with self._lock:
+                self._revoke[uid] = status
+            self._pastikan_thread()
+
+        valid_after, disabled = status
+        if disabled or claims.get("auth_time", 0) < valid_after:
+            raise TokenDicabut()
+
+    def _ambil_status(self, uids):
+        hasil = {}
+        for i in range(0, len(uids), BATAS_GET_USERS):
+            identifiers = [auth.UidIdentifier(uid) for uid in uids[i : i + BATAS_GET_USERS]]
+            for user in auth.get_users(identifiers).users:
+                valid_after = (user.tokens_valid_after_timestamp or 0) / 1000
+                hasil[user.uid] = (valid_after, user.disabled)
+        # Uid yang tidak ditemukan dianggap dihapus
+        for uid in uids:
+            hasil.setdefault(uid, (float("inf"), True))
+        return hasil
+
+    def refresh(self):
+        with self._lock:
+            uids = list(self._revoke)
+        if not uids:
+            return
+        status = self._ambil_status(uids)
+        with self._lock:
+            self._revoke.update(status)
+            # Buang token kedaluwarsa supaya peta tidak tumbuh terus
+            sekarang = time.time()
+            for key in [k for k, (exp, _) in self._token.items() if exp + self.clock_skew < sekarang]:
+                del self._token[key]
+            aktif = {claims["uid"] for _, claims in self._token.values()}
+            for uid in [u for u in self._revoke if u not in aktif]:
+                del self._revoke[uid]
+
+    def _pastikan_thread(self):
+        # Thread dibuat saat pertama dipakai (aman untuk worker gunicorn hasil fork)
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._loop, name="token-revoke", daemon=True
+            )
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Gagal memperbarui status revoke token")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "tokens": len(self._token),
+                "uids": len(self._revoke),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
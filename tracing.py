@@ -0,0 +1,357 @@
+# Tracing latensi per request dan per panggilan Firestore.
+#
+# `Tracer.bungkus(db)` mengembalikan proxy client Firestore: setiap collection/query/
+# document/batch/transaction yang dibuat lewat proxy ikut diproksikan, dan panggilan
+# yang benar-benar ke server (get, stream, get_all, set/update/delete/create, commit)
+# dicatat: collection, filter, jumlah dokumen, dan waktu. Proxy yang dikirim sebagai
+# argumen (mis. ref ke transaction.get / batch.set / db.get_all) dibuka dulu, jadi
+# library Firestore tetap menerima objek aslinya.
+#
+# Panggilan selama request dikumpulkan di contextvar; saat request selesai dihitung
+# agregatnya (latensi route, dokumen & panggilan per request, pola N+1). Agregat
+# disimpan sebagai sampel terakhir per kunci (deque terbatas) dan diekspor dalam
+# format teks Prometheus.
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+KUANTIL = (0.5, 0.95, 0.99)
+
+# Method yang hanya membangun query baru (belum ada panggilan ke server)
+PEMBANGUN_QUERY = {
+    "where", "order_by", "limit", "limit_to_last", "offset", "select",
+    "start_at", "start_after", "end_at", "end_before", "count", "sum", "avg",
+}
+OPERASI_BACA = {"get", "stream", "get_all"}
+# "_commit" dipanggil @firestore.transactional pada transaksi (bukan oleh kode aplikasi)
+OPERASI_TULIS = {"set", "update", "delete", "create", "add", "commit", "_commit"}
+
+_jejak = contextvars.ContextVar("jejak_firestore", default=None)
+
+
+class Jejak:
+    # Semua panggilan Firestore dalam satu request
+    __slots__ = ("route", "mulai", "panggilan", "selesai")
+
+    def __init__(self, route):
+        self.route = route
+        self.mulai = time.perf_counter()
+        self.panggilan = []  # (collection, operasi, filter, dokumen, detik)
+        self.selesai = False
+
+
+def _buka(nilai):
+    if isinstance(nilai, _Proxy):
+        return nilai._obj
+    if isinstance(nilai, (list, tuple)):
+        return type(nilai)(_buka(v) for v in nilai)
+    return nilai
+
+
+def _deskripsi(nama, args, kwargs):
+    # Bentuk filter tanpa nilainya, supaya query yang sama dengan nilai berbeda
+    # dikelompokkan bersama (dasar deteksi N+1)
+    if nama == "where":
+        if len(args) >= 2:
+            return f"{args[0]} {args[1]}"
+        filter_ = kwargs.get("filter")
+        return f"{getattr(filter_, 'field_path', '?')} {getattr(filter_, 'op_string', '?')}"
+    if nama == "order_by":
+        return f"order_by {args[0] if args else kwargs.get('field_path')}"
+    return nama
+
+
+class _Proxy:
+    __slots__ = ("_obj", "_tracer", "_collection", "_filter")
+
+    def __init__(self, obj, tracer, collection=None, filter_=()):
+        self._obj = obj
+        self._tracer = tracer
+        self._collection = collection
+        self._filter = filter_
+
+    def __getattr__(self, nama):
+        attr = getattr(self._obj, nama)
+        if not callable(attr):
+            return attr
+
+        def panggil(*args, **kwargs):
+            args = _buka(args)
+            kwargs = {k: _buka(v) for k, v in kwargs.items()} if kwargs else kwargs
+            return self._panggil(nama, attr, args, kwargs)
+
+        return panggil
+
+    def _turunan(self, obj, collection=None, filter_=None):
+        return _Proxy(
+            obj,
+            self._tracer,
+            collection or self._collection,
+            self._filter if filter_ is None else filter_,
+        )
+
+    def _panggil(self, nama, attr, args, kwargs):
+        if nama in ("collection", "collection_group"):
+            hasil = attr(*args, **kwargs)
+            return self._turunan(
+                hasil, collection=getattr(hasil, "id", None) or args[0], filter_=()
+            )
+        if nama == "document":
+            return self._turunan(attr(*args, **kwargs), filter_=("doc",))
+        if nama in ("batch", "transaction"):
+            return self._turunan(attr(*args, **kwargs), collection=f"({nama})", filter_=())
+        if nama in PEMBANGUN_QUERY:
+            return self._turunan(
+                attr(*args, **kwargs),
+                filter_=self._filter + (_deskripsi(nama, args, kwargs),),
+            )
+        if nama in OPERASI_BACA:
+            return self._baca(nama, attr, args, kwargs)
+        if nama in OPERASI_TULIS:
+            mulai = time.perf_counter()
+            hasil = attr(*args, **kwargs)
+            collection = self._collection
+            commit = nama in ("commit", "_commit")
+            if collection in ("(batch)", "(transaction)") and not commit:
+                return hasil  # hanya ditampung, dikirim saat commit
+            dokumen = len(hasil) if commit and hasil is not None else 1
+            self._tracer.catat(
+                collection,
+                "commit" if commit else nama,
+                self._filter,
+                dokumen,
+                time.perf_counter() - mulai,
+            )
+            return hasil
+        return attr(*args, **kwargs)
+
+    def _baca(self, nama, attr, args, kwargs):
+        collection = self._collection
+        if nama == "get_all" or (nama == "get" and collection == "(transaction)"):
+            # Collection diambil dari ref pertama (get_all / transaction.get)
+            target = args[0] if args else None
+            if isinstance(target, (list, tuple)) and target:
+                target = target[0]
+            collection = getattr(getattr(target, "parent", None), "id", None) or getattr(
+                target, "id", collection
+            )
+        mulai = time.perf_counter()
+        hasil = attr(*args, **kwargs)
+        detik = time.perf_counter() - mulai
+
+        if hasattr(hasil, "exists"):  # DocumentSnapshot
+            self._tracer.catat(collection, nama, self._filter, int(hasil.exists), detik)
+            return hasil
+        if isinstance(hasil, list):
+            # Query.get(); hasil agregasi (count/sum) tidak dihitung sebagai dokumen
+            agregasi = {"count", "sum", "avg"}.intersection(self._filter)
+            dokumen = 0 if agregasi else len(hasil)
+            self._tracer.catat(collection, nama, self._filter, dokumen, detik)
+            return hasil
+        # Generator (stream, get_all): waktu dihitung selama iterasi
+        return _Arus(hasil, self._tracer, collection, nama, self._filter, detik)
+
+    def __eq__(self, other):
+        return self._obj == _buka(other)
+
+    def __hash__(self):
+        return hash(self._obj)
+
+    def __repr__(self):
+        return f"<traced {self._obj!r}>"
+
+
+class _Arus:
+    # Iterator hasil stream/get_all yang mencatat jumlah dokumen & waktu saat habis
+    def __init__(self, iterator, tracer, collection, operasi, filter_, detik):
+        self._iterator = iter(iterator)
+        self._tracer = tracer
+        self._collection = collection
+        self._operasi = operasi
+        self._filter = filter_
+        self._detik = detik
+        self._dokumen = 0
+        self._jejak = _jejak.get()
+        self._tercatat = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        mulai = time.perf_counter()
+        try:
+            hasil = next(self._iterator)
+        except StopIteration:
+            self._detik += time.perf_counter() - mulai
+            self._catat()
+            raise
+        self._detik += time.perf_counter() - mulai
+        self._dokumen += 1
+        return hasil
+
+    def _catat(self):
+        if not self._tercatat:
+            self._tercatat = True
+            self._tracer.catat(
+                self._collection, self._operasi, self._filter, self._dokumen,
+                self._detik, jejak=self._jejak,
+            )
+
+    def __del__(self):
+        # Iterasi dihentikan lebih awal (break / limit di sisi klien)
+        self._catat()
+
+
+def _kuantil(nilai, ks=KUANTIL):
+    # Nearest-rank, satu kali sort untuk semua kuantil
+    urut = sorted(nilai)
+    return [(k, urut[max(math.ceil(k * len(urut)) - 1, 0)]) for k in ks]
+
+
+def _escape(nilai):
+    return str(nilai).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label(**label):
+    isi = ",".join(f'{k}="{_escape(v)}"' for k, v in label.items())
+    return f"{{{isi}}}" if isi else ""
+
+
+class Tracer:
+    def __init__(self, sampel=1000, ambang_n1=5, lambat_detik=1.0):
+        self.sampel = sampel
+        self.ambang_n1 = ambang_n1
+        self.lambat_detik = lambat_detik
+        self._lock = threading.Lock()
+
+        def reservoir():
+            return {"sampel": deque(maxlen=sampel), "jumlah": 0, "total": 0.0}
+
+        self._route = defaultdict(reservoir)  # route -> latensi (detik)
+        self._dokumen = defaultdict(reservoir)  # route -> dokumen dibaca per request
+        self._panggilan = defaultdict(reservoir)  # route -> panggilan per request
+        self._firestore = defaultdict(reservoir)  # (collection, operasi) -> detik
+        self._n1 = Counter()  # (route, collection) -> jumlah request terdeteksi N+1
+
+    def bungkus(self, db):
+        return _Proxy(db, self)
+
+    @staticmethod
+    def _tambah(reservoir, nilai):
+        reservoir["sampel"].append(nilai)
+        reservoir["jumlah"] += 1
+        reservoir["total"] += nilai
+
+    def catat(self, collection, operasi, filter_, dokumen, detik, jejak=None):
+        jejak = jejak or _jejak.get()
+        panggilan = (collection, operasi, filter_, dokumen, detik)
+        if jejak is not None and not jejak.selesai:
+            jejak.panggilan.append(panggilan)  # diagregasi saat request selesai
+            return
+        with self._lock:
+            self._tambah(self._firestore[(collection, operasi)], detik)
+
+    def mulai(self, route):
+        jejak = Jejak(route)
+        _jejak.set(jejak)
+        return jejak
+
+    def selesai(self, jejak):
+        # Tutup jejak request; kembalikan ringkasan untuk header/log
+        if jejak.selesai:
+            return None
+        jejak.selesai = True
+        _jejak.set(None)
+        durasi = time.perf_counter() - jejak.mulai
+        panggilan = list(jejak.panggilan)
+
+        dokumen = sum(p[3] for p in panggilan if p[1] in OPERASI_BACA)
+        waktu_firestore = sum(p[4] for p in panggilan)
+        pola = Counter((p[0], p[1], p[2]) for p in panggilan if p[1] in ("get", "stream"))
+        n1 = [(kunci, n) for kunci, n in pola.items() if n >= self.ambang_n1]
+
+        with self._lock:
+            self._tambah(self._route[jejak.route], durasi)
+            self._tambah(self._dokumen[jejak.route], dokumen)
+            self._tambah(self._panggilan[jejak.route], len(panggilan))
+            for collection, operasi, _, _, detik in panggilan:
+                self._tambah(self._firestore[(collection, operasi)], detik)
+            for collection in {kunci[0] for kunci, _ in n1}:
+                self._n1[(jejak.route, collection)] += 1
+
+        for (collection, operasi, filter_), n in n1:
+            logger.warning(
+                "Kemungkinan N+1 di %s: %dx %s %s [%s]",
+                jejak.route, n, operasi, collection, ", ".join(filter_),
+            )
+        if durasi >= self.lambat_detik:
+            logger.warning(
+                "Request lambat %s: %.3f s, %d panggilan Firestore (%.3f s, %d dokumen)\n%s",
+                jejak.route, durasi, len(panggilan), waktu_firestore, dokumen,
+                "\n".join(
+                    f"  {p[4] * 1000:8.1f} ms {p[1]:<7} {p[0]} [{', '.join(p[2])}] -> {p[3]} dok"
+                    for p in sorted(panggilan, key=lambda p: -p[4])[:20]
+                ),
+            )
+        return {
+            "durasi": durasi,
+            "panggilan": len(panggilan),
+            "dokumen": dokumen,
+            "firestore": waktu_firestore,
+            "n1": len(n1),
+        }
+
+    def prometheus(self):
+        # Metrik dalam format teks Prometheus (summary dengan kuantil dari sampel terakhir)
+        baris = []
+
+        def summary(nama, bantuan, data, label_kunci):
+            baris.append(f"# HELP {nama} {bantuan}")
+            baris.append(f"# TYPE {nama} summary")
+            for kunci, r in sorted(data.items()):
+                label = dict(zip(label_kunci, kunci if isinstance(kunci, tuple) else (kunci,)))
+                if r["sampel"]:
+                    for k, v in _kuantil(r["sampel"]):
+                        baris.append(f"{nama}{_label(**label, quantile=k)} {v}")
+                baris.append(f"{nama}_sum{_label(**label)} {r['total']}")
+                baris.append(f"{nama}_count{_label(**label)} {r['jumlah']}")
+
+        with self._lock:
+            summary(
+                "http_request_duration_seconds", "Latensi request per route.",
+                self._route, ("route",),
+            )
+            summary(
+                "firestore_docs_per_request", "Dokumen Firestore dibaca per request.",
+                self._dokumen, ("route",),
+            )
+            summary(
+                "firestore_calls_per_request", "Panggilan Firestore per request.",
+                self._panggilan, ("route",),
+            )
+            summary(
+                "firestore_call_duration_seconds", "Latensi panggilan Firestore.",
+                self._firestore, ("collection", "operation"),
+            )
+            baris.append(
+                "# HELP firestore_n_plus_one_total Request dengan query berulang (pola N+1)."
+            )
+            baris.append("# TYPE firestore_n_plus_one_total counter")
+            for (route, collection), n in sorted(self._n1.items()):
+                baris.append(
+                    f"firestore_n_plus_one_total{_label(route=route, collection=collection)} {n}"
+                )
+        return "\n".join(baris) + "\n"
+
+
+def metrik(nama, bantuan, nilai, tipe="gauge"):
+    # nilai: list (dict label, angka); untuk metrik tambahan dari app (cache, SSE, dll)
+    baris = [f"# HELP {nama} {bantuan}", f"# TYPE {nama} {tipe}"]
+    for label, v in nilai:
+        baris.append(f"{nama}{_label(**label)} {v}")
+    return "\n".join(baris) + "\n"
@@ -0,0 +1,53 @@
+# Penyimpanan file bukti bayar: ditulis ke disk per potongan dengan batas ukuran,
+# lalu (jika Pillow terpasang) di-encode ulang tanpa EXIF dan dibuatkan thumbnail.
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow opsional, tanpa Pillow file disimpan apa adanya
+    Image = None
+
+CHUNK_BYTES = 64 * 1024
+EKSTENSI_GAMBAR = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+
+class FileTerlaluBesar(Exception):
+    """Ukuran upload melebihi batas."""
+
+
+def simpan_stream(stream, path, batas_bytes):
+    # Salin stream ke file sementara per potongan; hapus dan lempar error jika melebihi batas
+    sementara = f"{path}.tmp"
+    total = 0
+    try:
+        with open(sementara, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > batas_bytes:
+                    raise FileTerlaluBesar()
+                f.write(chunk)
+        os.replace(sementara, path)
+    except BaseException:
+        if os.path.exists(sementara):
+            os.remove(sementara)
+        raise
+    return total
+
+
+def bisa_diproses(nama_file):
+    return Image is not None and os.path.splitext(nama_file)[1].lower() in EKSTENSI_GAMBAR
+
+
+def proses_gambar(path_asli, path_hasil, path_thumb, ukuran_maks=2048, ukuran_thumb=320):
+    # Encode ulang ke JPEG (orientasi dari EXIF diterapkan, metadata dibuang) + thumbnail
+    with Image.open(path_asli) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((ukuran_maks, ukuran_maks))
+        img.save(path_hasil, "JPEG", quality=85, optimize=True, progressive=True)
+        img.thumbnail((ukuran_thumb, ukuran_thumb))
+        img.save(path_thumb, "JPEG", quality=75, optimize=True)
@@ -0,0 +1,128 @@
+# Penyimpanan file berdasarkan isi (content-addressed): kunci file adalah sha256 isinya,
+# dibagi ke subfolder "ab/cd/<sha256><ext>". File yang sama persis hanya disimpan sekali
+# dan isinya tidak pernah berubah, sehingga aman di-cache selamanya oleh browser.
+# Backend: disk lokal, atau Firebase Storage (bucket) dengan antarmuka yang sama.
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 64 * 1024
+POLA_KUNCI = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,5})?$")
+
+
+def kunci_valid(kunci):
+    return bool(kunci and POLA_KUNCI.match(kunci))
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def buat_kunci(sha256, ext=""):
+    ext = ext.lower() if re.fullmatch(r"\.[A-Za-z0-9]{1,5}", ext or "") else ""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def etag(kunci):
+    # sha256 di nama kunci sudah merupakan ETag yang kuat
+    return os.path.splitext(kunci.rsplit("/", 1)[-1])[0]
+
+
+class DiskStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, kunci):
+        return os.path.join(self.root, *kunci.split("/"))
+
+    def put(self, path_sumber, ext=""):
+        # Pindahkan file lokal ke store; kembalikan kunci. Duplikat cukup dibuang.
+        kunci = buat_kunci(hash_file(path_sumber), ext)
+        tujuan = self.path(kunci)
+        if os.path.exists(tujuan):
+            os.remove(path_sumber)
+            # Perbarui mtime: GC menganggap file ini baru di-upload (masa tenggang ulang)
+            os.utime(tujuan)
+        else:
+            os.makedirs(os.path.dirname(tujuan), exist_ok=True)
+            shutil.move(path_sumber, tujuan)
+        return kunci
+
+    def exists(self, kunci):
+        return os.path.exists(self.path(kunci))
+
+    def buka(self, kunci):
+        return open(self.path(kunci), "rb")
+
+    def delete(self, kunci):
+        try:
+            os.remove(self.path(kunci))
+        except FileNotFoundError:
+            pass
+
+    def daftar(self):
+        # (kunci, waktu dibuat epoch) untuk semua file di store
+        for dirpath, _, filenames in os.walk(self.root):
+            for nama in filenames:
+                kunci = os.path.relpath(os.path.join(dirpath, nama), self.root).replace(
+                    os.sep, "/"
+                )
+                if kunci_valid(kunci):
+                    yield kunci, os.path.getmtime(os.path.join(dirpath, nama))
+
+
+class FirebaseStorageStore:
+    def __init__(self, bucket, prefix="bukti/"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, path_sumber, ext=""):
+        kunci = buat_kunci(hash_file(path_sumber), ext)
+        blob = self.bucket.blob(self.prefix + kunci)
+        if not blob.exists():
+            blob.cache_control = "private, max-age=31536000, immutable"
+            blob.upload_from_filename(path_sumber)
+        else:
+            # Sama seperti DiskStore: waktu "updated" dipakai GC sebagai waktu upload
+            blob.metadata = {"diupload": str(int(time.time()))}
+            blob.patch()
+        os.remove(path_sumber)
+        return kunci
+
+    def exists(self, kunci):
+        return self.bucket.blob(self.prefix + kunci).exists()
+
+    def buka(self, kunci):
+        return self.bucket.blob(self.prefix + kunci).open("rb")
+
+    def delete(self, kunci):
+        self.bucket.blob(self.prefix + kunci).delete()
+
+    def daftar(self):
+        for blob in self.bucket.list_blobs(prefix=self.prefix):
+            kunci = blob.name[len(self.prefix) :]
+            if kunci_valid(kunci):
+                yield kunci, (blob.updated or blob.time_created).timestamp()
+
+
+def gc(store, direferensikan, tenggang_detik=3600):
+    # Hapus file yang tidak direferensikan lagi. File yang lebih baru dari masa tenggang
+    # dilewati: bisa jadi baru di-upload dan dokumennya belum diperbarui.
+    batas = time.time() - tenggang_detik
+    dihapus = 0
+    for kunci, dibuat in list(store.daftar()):
+        if kunci not in direferensikan and dibuat < batas:
+            store.delete(kunci)
+            dihapus += 1
+    logger.info("GC upload: %d file dihapus", dihapus)
+    return dihapus